@@ -0,0 +1,122 @@
+# EspAtAp.py
+#
+# Soft AP of the AT firmware, loaded by EspAtDrv on first use
+#
+# The list of connected stations is kept from the firmware's +STA_CONNECTED,
+# +DIST_STA_IP and +STA_DISCONNECTED notices, which EspAtDrv.readRX() hands
+# to stationNotice(). Nothing is queried to answer softApStations().
+#
+# Version:
+#  0.1.0: moved from EspAtDrv
+#  0.1.1: AT 2 command names
+
+import EspAtDrv
+import EspAtParse
+from EspAtDrv import maintain, cmdStartSetting, cmdAppend, cmdInt, cmdQuoted, sendCommand, setWifiMode
+from EspAtDrv import LOG_INFO_PRINT, LOG_ERROR_PRINT
+
+stations = []  # EspAtParse.StationInfo of the soft AP's stations
+for i in range(EspAtDrv.STATIONS_COUNT):
+    stations.append(EspAtParse.StationInfo())
+EspAtDrv.stations = stations  # cleared by EspAtDrv.reset()
+stationMac = bytearray(6)  # parsed station notice
+stationIp = bytearray(4)
+
+###################################
+
+def beginSoftAP(ssid: str, passphrase: str, channel: int, maxConn: int) -> int:
+    global stations
+
+    maintain()
+
+    persistent = EspAtDrv.persistent
+    LOG_INFO_PRINT(f'begin AP {ssid}')
+    LOG_INFO_PRINT(" persistent\r\n" if persistent else " current\r\n", False)
+
+    if (setWifiMode(EspAtDrv.wifiMode | EspAtDrv.WIFI_MODE_SAP, persistent) == False):
+        return False
+
+    if (not cmdStartSetting(b"AT+CWSAP=" if persistent else b"AT+CWSAP_CUR=", persistent)):
+        return False
+    cmdQuoted(ssid)
+    cmdAppend(b",")
+    cmdQuoted(passphrase if passphrase else b"")
+    cmdAppend(b",")
+    cmdInt(channel)
+    cmdAppend(b",3," if passphrase else b",0,")  # WPA2_PSK or open
+    cmdInt(maxConn)
+    if (sendCommand(None, True, False) == False):
+        return False
+
+    for st in stations:
+        st.active = False
+    return True
+
+def endSoftAP(save: int) -> int:
+    global stations
+
+    maintain()
+
+    LOG_INFO_PRINT("end AP\r\n")
+
+    wifiMode = EspAtDrv.wifiMode
+    if (not (wifiMode & EspAtDrv.WIFI_MODE_SAP)):
+        return True
+
+    if (setWifiMode(wifiMode & ~EspAtDrv.WIFI_MODE_SAP, EspAtDrv.persistent or save) == False):
+        return False
+
+    for st in stations:
+        st.active = False
+    return True
+
+def stationNotice(buffer: bytearray):
+    # updates the station list from a +STA_CONNECTED, +DIST_STA_IP or +STA_DISCONNECTED line
+    global stations, stationMac, stationIp
+
+    if (EspAtParse.parseStation(buffer, stationMac, stationIp) == 0):
+        return
+
+    free = None
+    found = None
+    for st in stations:
+        if (not st.active):
+            if (free == None):
+                free = st
+        elif (st.mac == stationMac):
+            found = st
+            break
+
+    if (buffer[1] == 83 and buffer[5] == 68):  # '+STA_DISCONNECTED'
+        if (found):
+            found.active = False
+        return
+
+    if (not found):
+        if (not free):
+            LOG_ERROR_PRINT("too many stations\r\n")
+            return
+        found = free
+        found.active = True
+        found.mac[:] = stationMac
+        found.hasIp = False
+
+    if (buffer[1] == 68):  # '+DIST_STA_IP'
+        found.ip[:] = stationIp
+        found.hasIp = True
+
+def softApStations() -> list:
+    global stations
+
+    maintain()  # process pending notices
+    return [st for st in stations if st.active]
+
+def softApStationCount() -> int:
+    global stations
+
+    maintain()  # process pending notices
+    n = 0
+    for st in stations:
+        if (st.active):
+            n += 1
+    return n
@@ -2,21 +2,47 @@
 #
 # Driver for ESP8255 on Chinese RPi Pico W
 #
-# Communication with ESP8255 over UART0 at 115200 Bd
+# Communication with ESP8255 over UART0 at 115200 Bd, or the rate of the
+# profile saved by autotune()
 #
 # Based on source: https://github.com/jandrassy/WiFiEspAT
 #
 # Version:
 #  0.1.0: initial version
+#  0.2.0: per-command deadlines, watchdog with automatic recovery
+#  0.3.0: AT commands are built in a preallocated buffer and sent in one write
+#  0.4.0: responses parsed with EspAtParse into preallocated records
+#  0.5.0: recvDataInto receives into a caller's buffer
+#  0.6.0: soft AP with a station list kept from the firmware's notices
+#  0.7.0: SSL buffer size and SNI configuration, connect time statistics
+#  0.8.0: commands rejected with "busy p..."/"busy s..." are retried with backoff
+#  0.9.0: one AT+CIPSTATUS snapshot for the station state and the links, cached briefly
+#  0.10.0: static IP and DNS configuration kept in the driver, DHCP restored only if it was off
+#  0.11.0: soft AP, queries and SSL settings moved to EspAtAp, EspAtQuery and EspAtSsl
+#  0.12.0: record() logs the UART traffic for replay with tools/replay.py
+#  0.13.0: firmware capabilities probed once by init(), capabilities()
+#  0.14.0: link priorities, bulk links move data in slices with a callback in between
+#  0.15.0: baud rate, receive size and status sync tunable, autotune() profile loaded by init()
+#  0.16.0: power profiles with AT+SLEEP, deadlines extended for the wake-up after an idle time
+#  0.17.0: EspAtPool buffer pool for the clients' data, sendData() and recvDataInto() of buffer lists
+#  0.17.1: the ERROR of an unsupported command probed by init() is not logged
+#  0.17.2: AT 2 gets its command names without _CUR/_DEF, saving set by AT+SYSSTORE
+#  0.17.3: an SSL connect fails with Error_NOT_INITIALIZED before init()
+#  0.18.0: setBaud() and loadProfile() moved to EspAtTune
+#  0.19.0: power profiles moved to EspAtPower
+#  0.19.1: EspAtPool loaded by the first client, bufferPool()
 
 from machine import UART
 from micropython import const
 import utime
+import EspAtParse
 
 class EspAtDrv_linkInfo:
     def __init__(self):
         self.flags = 0
         self.avail = 0
+        self.connectTime = 0  # ms of the AT+CIPSTART, including the TLS handshake
+        self.priority = PRIORITY_NORMAL
 
 ###################################
 
@@ -27,9 +53,12 @@ LOG_INFO = const(False)
 LOG_DEBUG = const(False)
 
 LINKS_COUNT = const(5)
+STATIONS_COUNT = const(8)  # maximum of stations connected to the soft AP
 
 NO_LINK = const(255)
 
+MAX_SEND_SIZE = const(2048)  # maximum data length of one AT+CIPSEND of AT 1.x
+
 Error_NO_ERROR = const(0)
 Error_NOT_INITIALIZED = const(1)
 Error_AT_NOT_RESPONDING = const(2)
@@ -42,16 +71,60 @@ Error_SEND = const(8)
 Error_UDP_BUSY = const(9)
 Error_UDP_LARGE = const(10)
 Error_UDP_TIMEOUT = const(11)
+Error_BUSY = const(12)  # the firmware was still busy after all retries of a command
 
 WIFI_SOFT_RESET = const(0)
 #WIFI_HARD_RESET = 1
 WIFI_EXTERNAL_RESET = const(2)
 
+PRIORITY_INTERACTIVE = const(0)  # control traffic, served between the slices of bulk links
+PRIORITY_NORMAL = const(1)
+PRIORITY_BULK = const(2)         # transfers split in BULK_SLICE bytes
+
+PROFILE_LOW_LATENCY = const(0)  # no sleep, the radio is always on
+PROFILE_BALANCED = const(1)     # modem sleep, the radio sleeps between beacons
+PROFILE_LOW_POWER = const(2)    # light sleep, the CPU sleeps too and wakes for the beacons
+
 WIFI_MODE_STA = const(1)  # 0b01
 WIFI_MODE_SAP = const(2)  # 0b10
 
-TIMEOUT = const(1000)
-TIMEOUT_COUNT = const(5)
+UART_TIMEOUT = const(50)       # granularity of blocking UART reads
+TIMEOUT = const(1000)          # response deadline of commands not in CMD_TIMEOUTS
+PROBE_TIMEOUT = const(250)     # deadline for the response to a '?' probe
+PROBE_COUNT = const(2)         # probes sent before the firmware is declared not responding
+RESYNC_COUNT = const(3)        # 'AT' attempts of the watchdog before AT+RST
+RESYNC_TIMEOUT = const(300)    # deadline for the response to 'AT'
+RECOVER_BACKOFF_MIN = const(1000)
+RECOVER_BACKOFF_MAX = const(60000)
+BUSY_BACKOFF_MIN = const(5)    # first wait before a command rejected as busy is sent again
+BUSY_BACKOFF_MAX = const(100)
+BUSY_TIMEOUT = const(500)      # how long a command is retried while the firmware is busy
+STATUS_MAX_AGE = const(500)    # ms an AT+CIPSTATUS snapshot answers status and link queries
+SYNC_INTERVAL = const(500)     # ms between the link syncs of availData()
+UART_BAUD = const(115200)      # rate of the firmware after a reset
+RECV_SIZE = const(1000)        # bytes requested by recvData() by default
+SLEEP_IDLE = const(10)         # ms without commands after which the firmware may sleep
+BULK_SLICE = const(1024)       # bytes a bulk link sends or receives before sliceCallback runs
+
+# response deadlines in milliseconds, by command prefix (first match wins)
+CMD_TIMEOUTS = (
+    (b"AT+CIPSTATUS", 300),
+    (b"AT+CIPRECVLEN", 300),
+    (b"AT+CWJAP?", 500),
+    (b"AT+CWJAP", 20000),
+    (b"AT+CIPSTART", 10000),
+    (b"AT+CIPSEND", 5000),
+    (b"AT+CIPCLOSE", 5000),
+    (b"AT+CWQAP", 3000),
+    (b"AT+RST", 3000),
+    (b"AT+CWMODE", 2000),
+    (b"AT+CWSAP", 5000),
+    (b"AT+CIPSSL", 2000),
+    (b"ATE", 300),
+)
+
+CMD_BUF_SIZE = const(320)  # longest command: AT+CIPSTART with a 253 characters host name
+HEX_DIGITS = b"0123456789ABCDEF"
 
 LINK_CONNECTED = const(1)         # (1 << 0)
 LINK_CLOSING = const(2)           # (1 << 1)
@@ -68,43 +141,216 @@ wifiMode = 0
 wifiModeDef = 0
 persistent = False
 lastSync = 0  # in milliseconds
+linkStatus = None  # EspAtParse.LinkStatus of every link, from AT+CIPSTATUS
+stations = None  # EspAtAp's station list once the soft AP module is loaded
+sslServerName = None  # SNI for the next SSL connections set by EspAtSsl, None to send none
+sslStats = [0, 0, 0]  # SSL connects, successful SSL connects, ms of the successful ones
+cmdTimeout = TIMEOUT  # response deadline of the last sent command
+probesPending = 0  # '?' probes whose ERROR response was not received yet
+cmdBuf = bytearray(CMD_BUF_SIZE)  # AT command being built, sent with one UART write
+cmdView = memoryview(cmdBuf)
+cmdLen = 0
+cmdOverflow = False
+wedged = False  # the firmware stopped responding, watchdog() has to recover it
+recoverAt = 0  # ticks of the next recovery attempt
+recoverBackoff = RECOVER_BACKOFF_MIN
+recoveryCallback = None
+busyCount = 0  # commands rejected by the busy firmware and sent again
+staState = -1  # STATUS of the last AT+CIPSTATUS snapshot
+statusTime = 0  # ticks of the snapshot
+statusValid = False  # cleared by connection and WiFi events, the snapshot is stale then
+staticIp = False  # EspAtQuery.ipConfig holds the static IP, DHCP is off
+staticDns = False  # EspAtQuery.dnsConfig holds the static DNS servers
+recorder = None  # EspAtTrace.RecordUART while the UART traffic is recorded
+caps = None  # EspAtParse.Capabilities of the firmware, probed once by init()
+maxSendSize = MAX_SEND_SIZE  # caps.maxSend
+sliceCallback = None  # called between the slices of bulk transfers
+inSlice = False  # sliceCallback is running, bulk transfers in it are not sliced again
+uartBaud = UART_BAUD  # current rate of the UART
+# tuned by autotune(), loaded from profileFile by init()
+profileFile = "espat.json"
+tunedBaud = UART_BAUD  # set again after every reset of the firmware
+recvSize = RECV_SIZE
+syncInterval = SYNC_INTERVAL
+statusMaxAge = STATUS_MAX_AGE
+powerProfile = None  # set by setPowerProfile(), None leaves the firmware's sleep mode
+listenInterval = 0  # of the next joinAP(), AT 2 only
+wakeMargin = 0  # ms the firmware may need to wake up, added to the first deadline after an idle time
+syncMin = 0  # ms the power profile keeps between link syncs
+lastCmd = 0  # ticks of the last command sent
+errorsExpected = False  # an ERROR response is an answer, not logged (testCommand())
+sysStore = None  # AT 2's AT+SYSSTORE setting, None while unknown after a reset
+pool = None  # EspAtPool.BufferPool of the clients' data, created by bufferPool()
  
 def init(resetType: int) -> int:
-    global espUART, lastErrorCode, linkInfo
+    global lastErrorCode, linkInfo, linkStatus, wedged
     
+    loadProfile()
+
     # Configure UART for communication with ESP8285
-    espUART = UART(0, 115200, timeout=1000, timeout_char=100)
+    openUART(UART_BAUD)
 
     lastErrorCode = Error_NO_ERROR
+    wedged = False
     
     linkInfo = []
+    linkStatus = []
     for i in range(LINKS_COUNT):
         linkInfo.append(EspAtDrv_linkInfo())
+        linkStatus.append(EspAtParse.LinkStatus())
         
-    return reset(resetType)
+    if (tunedBaud != UART_BAUD and not simpleCommand(b"AT")):
+        openUART(tunedBaud)  # the firmware may still run at the tuned rate of the last start
+        lastErrorCode = Error_NO_ERROR
+        wedged = False
+
+    if (not reset(resetType)):
+        return False
+    if (caps == None and not probeCapabilities()):  # kept over resets of the firmware
+        return False
+    if (tunedBaud != uartBaud and not setBaud(tunedBaud)):
+        LOG_WARN_PRINT(f'tuned rate {tunedBaud} Bd failed, staying at {uartBaud} Bd\r\n')
+    return True
+
+def openUART(baud: int):
+    global espUART, uartBaud, probesPending
+
+    espUART = UART(0, baud, timeout=UART_TIMEOUT, timeout_char=100)
+    uartBaud = baud
+    probesPending = 0  # probes sent at another rate get no answer
+    if (recorder):
+        recorder.uart = espUART
+        espUART = recorder
+
+def setBaud(baud: int) -> int:
+    # the firmware and the UART to baud, see EspAtTune
+    import EspAtTune
+    return EspAtTune.setBaud(baud)
+
+def loadProfile() -> int:
+    # the settings autotune() saved, EspAtTune is loaded only if there is a profileFile
+    try:
+        open(profileFile).close()
+    except OSError:
+        return False
+    import EspAtTune
+    return EspAtTune.loadProfile()
+
+def autotune(host: str, port: int, save: bool = True) -> dict:
+    # measures the settings against an echo server, see EspAtTune
+    import EspAtTune
+    return EspAtTune.autotune(host, port, save)
+
+def probeCapabilities() -> int:
+    # identifies the firmware with AT+GMR and tests the optional commands
+    global caps, buffer, lastErrorCode, maxSendSize
+
+    c = EspAtParse.Capabilities()
+    cmdStart(b"AT+GMR")
+    if (not sendCommand(b"AT version:", True, False)):
+        return False
+    EspAtParse.parseGmr(buffer, c)
+    while (readRX(b"Version ESP_ATMod", True, True)):  # ends with OK
+        c.atMod = True
+    if (lastErrorCode != Error_NO_ERROR):
+        return False
+
+    c.curCommands = c.atMajor < 2
+    c.recvColon = c.atMajor < 2
+    c.passiveRecv = c.atMod or c.atMajor >= 2 or c.atMinor >= 7
+    c.maxSend = 8192 if c.atMajor >= 2 else MAX_SEND_SIZE
+    if (c.atMod):
+        # the command set of ESP_ATMod 0.6 (firmware/ESP_ATMod.0.6.bin), it sends
+        # the host of AT+CIPSTART as SNI itself
+        c.sslSize = True
+        c.mfln = True
+        c.uartCur = True
+    else:
+        c.sslSize = testCommand(b"AT+CIPSSLSIZE=?")
+        c.sni = testCommand(b"AT+CIPSSLCSNI=?")
+        c.mfln = testCommand(b"AT+CIPSSLMFLN=?")
+        c.sendBuf = testCommand(b"AT+CIPSENDBUF=?")
+        c.uartCur = testCommand(b"AT+UART_CUR=?")
+        c.sleep = testCommand(b"AT+SLEEP=?")
+        if (wedged):
+            return False
+        lastErrorCode = Error_NO_ERROR  # ERROR of an unsupported command
+
+    LOG_INFO_PRINT(f'AT version {c.version.decode()}')
+    LOG_INFO_PRINT(" ESP_ATMod\r\n" if c.atMod else "\r\n", False)
+
+    maxSendSize = c.maxSend
+    caps = c
+    return True
+
+def testCommand(cmd: bytes) -> int:
+    # True if the firmware knows the command, cmd is its test form AT+<cmd>=?
+    global errorsExpected
+
+    cmdStart(cmd)
+    errorsExpected = True
+    try:
+        return sendCommand(None, True, False)
+    finally:
+        errorsExpected = False
+
+def capabilities() -> EspAtParse.Capabilities:
+    return caps
+
+def setPoolBudget(budget: int) -> int:
+    # bytes of the clients' buffer pool, False while the pool holds data
+    return bufferPool().resize(budget)
+
+def poolStatistics() -> tuple:
+    # (blocks, block size, blocks in use, high-water mark, refused allocations,
+    # high-water marks per link) of the buffer pool
+    return bufferPool().statistics()
+
+def bufferPool() -> object:
+    # the clients' buffer pool, EspAtPool is loaded by the first client's connect
+    global pool
+
+    if (pool == None):
+        import EspAtPool
+        pool = EspAtPool.BufferPool()
+    return pool
 
 def reset(resetType: int) -> int:
-    global wifiMode, wifiModeDef, buffer
+    global wifiMode, wifiModeDef, buffer, stations, statusValid, staticIp, staticDns, sysStore
     
     if (resetType != WIFI_EXTERNAL_RESET):
         maintain()
+
+    statusValid = False
+    sysStore = None
+    if (stations):
+        for st in stations:
+            st.active = False
         
     if (resetType == WIFI_SOFT_RESET):
+        staticIp = False  # the current static configuration is lost with the reset
+        staticDns = False
         LOG_INFO_PRINT("soft reset\r\n")
 
-        sendString("AT+RST")
-        sendCommand("ready", True, False)  # can be missed
+        cmdStart(b"AT+RST")
+        if (uartBaud != UART_BAUD):
+            # the OK comes at the tuned rate, the firmware restarts at its default
+            sendCommand(b"OK", True, False)
+            openUART(UART_BAUD)
+            readRX(b"ready", True, False)
+        else:
+            sendCommand(b"ready", True, False)  # can be missed
     else:
         LOG_INFO_PRINT("no reset\r\n")
 
-    if (not simpleCommand("ATE0") or             # turn off echo. must work
-        not simpleCommand("AT+CIPMUX=1") or      # Enable multiple connections.
-        not simpleCommand("AT+CIPRECVMODE=1")):  # Set TCP Receive Mode - passive
+    if (not simpleCommand(b"ATE0") or             # turn off echo. must work
+        not simpleCommand(b"AT+CIPMUX=1") or      # Enable multiple connections.
+        not simpleCommand(b"AT+CIPRECVMODE=1")):  # Set TCP Receive Mode - passive
         return False
 
     # read default wifi mode
-    sendString("AT+CWMODE?")
-    if (not sendCommand("+CWMODE", True, False)):
+    cmdStart(b"AT+CWMODE?")
+    if (not sendCommand(b"+CWMODE", True, False)):
         return False
 
     wifiMode = buffer[8] - ord('0')  # '+CWMODE:'
@@ -112,52 +358,201 @@ def reset(resetType: int) -> int:
         return False
 
     wifiModeDef = wifiMode
+    if (caps != None and tunedBaud != uartBaud):  # after a reset by the watchdog
+        setBaud(tunedBaud)
+    if (caps != None and powerProfile != None):
+        setPowerProfile(powerProfile)
     return True
 
+def setPowerProfile(profile: int) -> int:
+    # PROFILE_LOW_LATENCY, PROFILE_BALANCED or PROFILE_LOW_POWER, see EspAtPower
+    import EspAtPower
+    return EspAtPower.setPowerProfile(profile)
+
 def maintain():
     global lastErrorCode
     
     lastErrorCode = Error_NO_ERROR
     return readRX(None, False, False)
 
-def sendString(cmd: str) -> int:
-    global espUART
+def commandTimeout() -> int:
+    # deadline for the responses of the command in cmdBuf
+    if (cmdLen == 2):  # 'AT'
+        return RESYNC_TIMEOUT
+    for prefix, timeout in CMD_TIMEOUTS:
+        if (cmdBuf.startswith(prefix)):
+            return timeout
+    return TIMEOUT
+
+def cmdStart(cmd: bytes):
+    global cmdLen, cmdOverflow
     
-    LOG_DEBUG_PRINT(cmd, False)
-    n = espUART.write(cmd)
-    return (n == len(cmd))
+    cmdLen = 0
+    cmdOverflow = False
+    cmdAppend(cmd)
+
+def cmdAppend(s: bytes):
+    global cmdBuf, cmdLen, cmdOverflow
     
-def sendCommand(expected: str, bufferData: int, listItem: int):
-    global lastErrorCode
+    if (isinstance(s, str)):
+        s = s.encode()
+    n = cmdLen + len(s)
+    if (n > CMD_BUF_SIZE - 2):  # keep room for "\r\n"
+        cmdOverflow = True
+        return
+    cmdBuf[cmdLen:n] = s
+    cmdLen = n
+
+def cmdInt(i: int):
+    global cmdBuf, cmdLen, cmdOverflow
+    
+    if (cmdLen + 12 > CMD_BUF_SIZE - 2):
+        cmdOverflow = True
+        return
+    if (i < 0):
+        cmdBuf[cmdLen] = 45  # '-'
+        cmdLen += 1
+        i = -i
+
+    # digits are written in reverse order and then swapped in place
+    start = cmdLen
+    while True:
+        cmdBuf[cmdLen] = 48 + i % 10
+        cmdLen += 1
+        i //= 10
+        if (i == 0):
+            break
+    end = cmdLen - 1
+    while (start < end):
+        cmdBuf[start], cmdBuf[end] = cmdBuf[end], cmdBuf[start]
+        start += 1
+        end -= 1
+
+def cmdHex(b: int):
+    global cmdBuf, cmdLen, cmdOverflow
+    
+    if (cmdLen + 2 > CMD_BUF_SIZE - 2):
+        cmdOverflow = True
+        return
+    cmdBuf[cmdLen] = HEX_DIGITS[b >> 4]
+    cmdBuf[cmdLen + 1] = HEX_DIGITS[b & 15]
+    cmdLen += 2
+
+def cmdQuoted(s: bytes):
+    # appends s in double quotes, '"', ',' and '\' are escaped with '\'
+    global cmdBuf, cmdLen, cmdOverflow
     
-    # AT command is already printed, but not 'entered' with "\r\n"
-    LOG_DEBUG_PRINT(" ...sent", False)
+    if (isinstance(s, str)):
+        s = s.encode()
+    n = cmdLen
+    if (n + 2 * len(s) + 2 > CMD_BUF_SIZE - 2):  # worst case: every character escaped
+        cmdOverflow = True
+        return
+    cmdBuf[n] = 34  # '"'
+    n += 1
+    for c in s:
+        if (c == 34 or c == 44 or c == 92):  # '"', ',' and '\'
+            cmdBuf[n] = 92
+            n += 1
+        cmdBuf[n] = c
+        n += 1
+    cmdBuf[n] = 34
+    cmdLen = n + 1
+
+def cmdSend() -> int:
+    global espUART, cmdBuf, cmdTimeout, lastErrorCode, lastCmd
+    
+    if (cmdOverflow):
+        LOG_ERROR_PRINT("AT command too long\r\n")
+        lastErrorCode = Error_AT_ERROR
+        return False
 
-    # finish AT command sending
-    if (sendString("\r\n") != True):
+    cmdTimeout = commandTimeout()  # deadline for the responses of this command
+    now = utime.ticks_ms()
+    if (wakeMargin and utime.ticks_diff(now, lastCmd) > SLEEP_IDLE):
+        cmdTimeout += wakeMargin  # the firmware sleeps, it answers after its next wake-up
+    lastCmd = now
+    if (LOG_DEBUG):
+        LOG_DEBUG_PRINT(bytes(cmdBuf[:cmdLen]))
+        LOG_DEBUG_PRINT(" ...sent", False)
+
+    cmdBuf[cmdLen] = 13  # '\r'
+    cmdBuf[cmdLen + 1] = 10  # '\n'
+    if (espUART.write(cmdView[:cmdLen + 2]) != cmdLen + 2):
         lastErrorCode = Error_AT_NOT_RESPONDING  # UART error
         return False
+    return True
 
-    if (expected):
-        return readRX(expected, bufferData, listItem)
-    else:
-        return readOK()
+def sendCommand(expected: bytes, bufferData: int, listItem: int):
+    # Sends the AT command built in cmdBuf and reads the response. The firmware
+    # drops a command it gets while it is still processing the previous one and
+    # answers "busy p..." (or "busy s..." while sending data). The command is
+    # then sent again after an increasing pause until BUSY_TIMEOUT is over.
+    global busyCount, lastErrorCode
+    
+    start = utime.ticks_ms()
+    backoff = BUSY_BACKOFF_MIN
+    while True:
+        if (not cmdSend()):
+            return False
+
+        if (expected):
+            ok = readRX(expected, bufferData, listItem)
+        else:
+            ok = readOK()
+        if (ok or lastErrorCode != Error_BUSY):
+            return ok
 
-def simpleCommand(cmd: str) -> int:
+        if (utime.ticks_diff(utime.ticks_ms(), start) + backoff > BUSY_TIMEOUT):
+            LOG_ERROR_PRINT("AT firmware busy\r\n")
+            return False
+        busyCount += 1
+        utime.sleep_ms(backoff)
+        backoff = min(backoff * 2, BUSY_BACKOFF_MAX)
+        maintain()  # the busy firmware may have sent data notices meanwhile
+
+def simpleCommand(cmd: bytes) -> int:
     maintain()
-    if (not sendString(cmd)):
-        return False
+    cmdStart(cmd)
+    return sendCommand(None, True, False)
 
-    LOG_DEBUG_PRINT(" ...sent", False)
-    if (not sendString("\r\n")):
-        return False
+def cmdStartSetting(cmd: bytes, save: int) -> int:
+    # Starts cmd given in the AT 1 form: _CUR, _DEF or the plain name which
+    # saves. AT 2 has only the plain name and AT+SYSSTORE decides if it saves,
+    # switched here first if needed. save None is a query which saves nothing.
+    global sysStore
 
-    return readOK()
+    if (caps == None or caps.curCommands):
+        cmdStart(cmd)
+        return True
+    if (save != None and sysStore != bool(save)):
+        cmdStart(b"AT+SYSSTORE=1" if save else b"AT+SYSSTORE=0")
+        if (not sendCommand(None, True, False)):
+            return False
+        sysStore = bool(save)
+    i = cmd.find(b"_CUR")
+    if (i < 0):
+        i = cmd.find(b"_DEF")
+    if (i < 0):
+        cmdStart(cmd)
+    else:
+        cmdStart(cmd[:i])
+        cmdAppend(cmd[i + 4:])
+    return True
 
-def readRX(expected: str, bufferData: int, listItem: int) -> int:
-    global espUART, buffer, lastErrorCode, linkInfo
+def settingCommand(cmd: bytes, save: int) -> int:
+    # simpleCommand() of a setting, see cmdStartSetting()
+    maintain()
+    if (not cmdStartSetting(cmd, save)):
+        return False
+    return sendCommand(None, True, False)
+
+def readRX(expected: bytes, bufferData: int, listItem: int) -> int:
+    global espUART, buffer, lastErrorCode, linkInfo, linkStatus, wedged, probesPending, statusValid
     
-    timeout = 0
+    deadline = utime.ticks_add(utime.ticks_ms(), cmdTimeout)
+    probes = 0
+    sentProbes = 0  # probes sent while waiting for this command's response
     unlinkBug = False
     ignoredCount = 0
 
@@ -171,18 +566,25 @@ def readRX(expected: str, bufferData: int, listItem: int) -> int:
         b = espUART.read(1)
         if (b == None):  # read first byte with stream's timeout
             # timeout or unconnected
-            if (timeout == TIMEOUT_COUNT):
+            if (utime.ticks_diff(deadline, utime.ticks_ms()) > 0):
+                continue  # the command's deadline is not over yet
+
+            if (probes == PROBE_COUNT):
                 LOG_ERROR_PRINT("AT firmware not responding\r\n")
                 lastErrorCode = Error_AT_NOT_RESPONDING
+                wedged = True
                 return False
 
             # next we send an invalid command to AT.
-            sendString("?")
+            espUART.write(b"?")
+            probesPending += 1
+            sentProbes += 1
             # response is:
-            # nothing if the firmware doesn't respond at all. readBytes will timeout again
-            # "busy p..." if still processing a command. will be printed to debug output and ignored
+            # nothing if the firmware doesn't respond at all. read will timeout again
+            # "busy p..." if still processing a command. the deadline is extended
             # ERROR if we missed some unexpected response of a current command. will be evaluated as ERROR
-            timeout += 1
+            probes += 1
+            deadline = utime.ticks_add(utime.ticks_ms(), PROBE_TIMEOUT)
             continue
 
         buffer.extend(b)
@@ -193,13 +595,13 @@ def readRX(expected: str, bufferData: int, listItem: int) -> int:
             # AT+CIPSEND prompt
             # AT versions 1.x send a space after '>', we must clear it
             espUART.read(1)
-            timeout = 0  # AT firmware responded
+            probes = 0  # AT firmware responded
             
         else:
             b = espUART.read(1)  # read second byte with stream's timeout
             if (b == None):  
                 continue  # No processing when the firmware not responded
-            timeout = 0  # AT firmware responded
+            probes = 0  # AT firmware responded
             buffer.extend(b)
 
             pos += 1
@@ -240,7 +642,7 @@ def readRX(expected: str, bufferData: int, listItem: int) -> int:
             LOG_DEBUG_PRINT(" ...matched\r\n", False)
             return True
         
-        if (buffer.startswith("+IPD,")):
+        if (buffer.startswith(b"+IPD,")):
             linkId = buffer[5] - ord('0')
             recLen = int(buffer[7:])
 
@@ -251,7 +653,26 @@ def readRX(expected: str, bufferData: int, listItem: int) -> int:
                 # +IPD truncated in serial buffer overflow
                 LOG_DEBUG_PRINT(" ...ignored\r\n")
 
-        elif (buffer[1:].startswith(",CONNECT")):
+        elif (buffer.startswith(b"busy ")):
+            if (sentProbes):
+                # the busy firmware dropped our '?' probe, the command itself is still running
+                probesPending = max(probesPending - 1, 0)
+                sentProbes -= 1
+                deadline = utime.ticks_add(utime.ticks_ms(), cmdTimeout)
+                LOG_DEBUG_PRINT(" ...busy, waiting\r\n", False)
+            elif (expected):
+                LOG_DEBUG_PRINT(" ...busy, command dropped\r\n", False)
+                lastErrorCode = Error_BUSY
+                return False
+            else:
+                LOG_DEBUG_PRINT(" ...ignored\r\n", False)
+
+        elif (buffer.startswith(b"+STA_") or buffer.startswith(b"+DIST_STA_IP")):
+            import EspAtAp
+            EspAtAp.stationNotice(buffer)
+            LOG_DEBUG_PRINT(" ...processed\r\n", False)
+
+        elif (buffer[1:].startswith(b",CONNECT")):
             linkId = buffer[0] - ord('0')
 
             if (linkInfo[linkId].avail == 0
@@ -259,18 +680,33 @@ def readRX(expected: str, bufferData: int, listItem: int) -> int:
                             or (linkInfo[linkId].flags & LINK_CLOSING))):
                 # incoming connection (and we could miss CLOSED)
                 linkInfo[linkId].flags = LINK_CONNECTED | LINK_IS_INCOMING
+                statusValid = False
                 LOG_DEBUG_PRINT(" ...processed\r\n", False)
             else:
                 LOG_DEBUG_PRINT(" ...ignored\r\n", False)
                 
-        elif (buffer[1:].startswith(",CLOSED") or
-              buffer[1:].startswith(",CONNECT FAIL")):
+        elif (buffer[1:].startswith(b",CLOSED") or
+              buffer[1:].startswith(b",CONNECT FAIL")):
             linkId = buffer[0] - ord('0')
             linkInfo[linkId].flags = 0
+            linkStatus[linkId].linkId = -1
+            statusValid = False
             LOG_DEBUG_PRINT(" ...processed\r\n", False)
             LOG_INFO_PRINT(f'closed linkId {linkId}\r\n')
 
-        elif (buffer.startswith("ERROR") or buffer == b'FAIL'):
+        elif (buffer.startswith(b"WIFI ")):
+            # WIFI CONNECTED, WIFI GOT IP, WIFI DISCONNECT
+            statusValid = False
+            LOG_DEBUG_PRINT(" ...processed\r\n", False)
+
+        elif (buffer.startswith(b"ERROR") and probesPending > sentProbes):
+            probesPending -= 1
+            LOG_DEBUG_PRINT(" ...late response to '?'\r\n", False)
+
+        elif (buffer.startswith(b"ERROR") or buffer == b'FAIL'):
+            if (sentProbes and buffer != b'FAIL'):  # our probe's answer, the response was missed
+                probesPending -= 1
+                sentProbes -= 1
             if (unlinkBug):
                 LOG_DEBUG_PRINT(" ...UNLINK is OK\r\n", False)
                 return True
@@ -278,7 +714,8 @@ def readRX(expected: str, bufferData: int, listItem: int) -> int:
                 LOG_DEBUG_PRINT(" ...ignored\r\n", False)  # it is only a late response to timeout query '?'
             else:
                 LOG_DEBUG_PRINT(" ...error\r\n", False)
-                LOG_ERROR_PRINT(f'expected {expected} got {buffer.decode()}\r\n')
+                if (not errorsExpected):
+                    LOG_ERROR_PRINT(f'expected {expected} got {buffer.decode()}\r\n')
                 lastErrorCode = Error_AT_ERROR
                 return False
             
@@ -303,16 +740,108 @@ def readRX(expected: str, bufferData: int, listItem: int) -> int:
                 # reset() has many ignored lines
                 LOG_ERROR_PRINT("Too much garbage on RX\r\n")
                 lastErrorCode = Error_AT_NOT_RESPONDING
+                wedged = True
                 return False
             LOG_DEBUG_PRINT(" ...ignored\r\n", False)
             
     return False
 
 def readOK() -> int:
-    return readRX("OK", True, False)
+    return readRX(b"OK", True, False)
+
+def record(stream) -> int:
+    # Logs the UART traffic to stream (a file opened 'wb') in the EspAtTrace
+    # format, record(None) ends the recording. The stream is not closed.
+    global espUART, recorder
+
+    if (recorder):
+        espUART = recorder.stop()  # None if the recording started before init()
+        recorder = None
+    if (stream):
+        import EspAtTrace
+        recorder = EspAtTrace.RecordUART(espUART, stream)
+        if (espUART):
+            espUART = recorder  # else init() puts it in front of the UART
+    return True
+
+def setLinkPriority(linkId: int, priority: int):
+    linkInfo[linkId].priority = priority
+
+def setSliceCallback(callback):
+    # callback(linkId) runs after every slice of a transfer on a PRIORITY_BULK
+    # link, to serve the interactive links while the transfer goes on
+    global sliceCallback
+
+    sliceCallback = callback
+
+def sliceSize(linkId: int) -> int:
+    # bytes to move on the link with one AT+CIPSEND or AT+CIPRECVDATA
+    if (linkInfo[linkId].priority == PRIORITY_BULK and not inSlice):
+        return BULK_SLICE
+    return maxSendSize
+
+def sliceDone(linkId: int):
+    # a slice of a transfer on the link was moved, bulk links let others go first
+    global inSlice
+
+    if (linkInfo[linkId].priority != PRIORITY_BULK or inSlice):
+        return
+    maintain()  # notices of the other links
+    if (sliceCallback):
+        inSlice = True
+        try:
+            sliceCallback(linkId)
+        finally:
+            inSlice = False
+
+def setRecoveryCallback(callback):
+    # callback(wasReset) is called after watchdog() brought the firmware back.
+    # wasReset is True if the firmware was restarted and all links are lost.
+    global recoveryCallback
+    
+    recoveryCallback = callback
+
+def watchdog() -> int:
+    global wedged, recoverAt, recoverBackoff, linkInfo, espUART, probesPending
+    
+    if (not wedged):
+        return True
+
+    if (utime.ticks_diff(recoverAt, utime.ticks_ms()) > 0):
+        return False  # backing off from the previous attempt
+
+    LOG_INFO_PRINT("recovering AT firmware\r\n")
+
+    while (espUART.any()):  # drop the rest of whatever wedged the parser
+        espUART.read()
+    probesPending = 0
+
+    wasReset = False
+    for i in range(RESYNC_COUNT):
+        if (simpleCommand(b"AT")):
+            break
+    else:
+        LOG_WARN_PRINT("AT firmware resync failed, resetting\r\n")
+        if (not reset(WIFI_SOFT_RESET)):
+            recoverAt = utime.ticks_add(utime.ticks_ms(), recoverBackoff)
+            LOG_ERROR_PRINT(f'AT firmware recovery failed, next attempt in {recoverBackoff} ms\r\n')
+            recoverBackoff = min(recoverBackoff * 2, RECOVER_BACKOFF_MAX)
+            return False
+
+        wasReset = True
+        for link in linkInfo:
+            link.flags = 0
+            link.avail = 0
+
+    LOG_INFO_PRINT("AT firmware recovered\r\n")
+    wedged = False
+    recoverBackoff = RECOVER_BACKOFF_MIN
+    if (recoveryCallback):
+        recoveryCallback(wasReset)
+    return True
 
 def staStatus() -> int:
-    global wifiModedef, lastErrorCode, buffer
+    global wifiModeDef, lastErrorCode
     
     maintain()
 
@@ -324,15 +853,48 @@ def staStatus() -> int:
         lastErrorCode = Error_NOT_INITIALIZED
         return -1
 
-    if (sendString("AT+CIPSTATUS") != True):
-        lastErrorCode = Error_AT_NOT_RESPONDING
+    return statusSnapshot(max(statusMaxAge, syncMin))
+
+def statusSnapshot(maxAge: int) -> int:
+    # Reads the whole AT+CIPSTATUS response: the station state, which is
+    # returned, and the open links, which update linkStatus and the links'
+    # flags. A snapshot younger than maxAge ms is reused, so status and link
+    # polling cost one round trip per interval.
+    global buffer, linkInfo, linkStatus, staState, statusTime, statusValid
+    
+    maintain()
+
+    if (statusValid and utime.ticks_diff(utime.ticks_ms(), statusTime) < maxAge):
+        return staState
+
+    cmdStart(b"AT+CIPSTATUS")
+    if (sendCommand(b"STATUS", True, False) == False):
         return -1
 
-    if (sendCommand("STATUS", True, False) != True):
+    state = EspAtParse.parseInt(buffer, 7, len(buffer))  # 'STATUS:'
+    for st in linkStatus:
+        st.linkId = -1
+
+    while (readRX(b"+CIPSTATUS", True, True)):
+        EspAtParse.parseCipstatus(buffer, linkStatus)
+    if (lastErrorCode != Error_NO_ERROR or state is None):
         return -1
 
-    status = buffer[7] - ord('0')  # 'STATUS:'
-    return status if readOK() else -1
+    for linkId in range(LINKS_COUNT):
+        link = linkInfo[linkId]
+
+        if (linkStatus[linkId].linkId == linkId):
+            if (not (link.flags & LINK_CONNECTED)):
+                # missed incoming connection
+                link.flags = LINK_CONNECTED | LINK_IS_INCOMING
+        elif (link.flags & LINK_CONNECTED):
+            # missed CLOSED, data not read yet stay available
+            link.flags = 0
+
+    staState = state
+    statusTime = utime.ticks_ms()
+    statusValid = True
+    return state
 
 def joinAP(ssid: str, password: str, bssid: bytearray):
     global wifiMode, persistent
@@ -345,34 +907,41 @@ def joinAP(ssid: str, password: str, bssid: bytearray):
     if (setWifiMode(wifiMode | WIFI_MODE_STA, persistent) == False):
         return False  # can't join ap without sta mode
 
-    if (persistent):
-        sendString("AT+CWJAP=\"")
-    else:
-        sendString("AT+CWJAP_CUR=\"")
-    sendString(ssid)
+    if (not cmdStartSetting(b"AT+CWJAP=" if persistent else b"AT+CWJAP_CUR=", persistent)):
+        return False
+    cmdQuoted(ssid)
 
     if (password):
-        sendString("\",\"")
-        sendString(password)
+        cmdAppend(b",")
+        cmdQuoted(password)
 
         if (bssid):
-            sendString("\",\"")
-            hx = ''
+            cmdAppend(b",\"")
             for i in range(6):
-                hx += ":%02X" % bssid[i]
-            sendString(hx[1:])
+                if (i > 0):
+                    cmdAppend(b":")
+                cmdHex(bssid[i])
+            cmdAppend(b"\"")
+
+    if (listenInterval):
+        # AT 2: ,<bssid>,<pci_en>,<reconn_interval>,<listen_interval>
+        if (not password):
+            cmdAppend(b",\"\"")
+        if (not (password and bssid)):
+            cmdAppend(b",")
+        cmdAppend(b",,,")
+        cmdInt(listenInterval)
 
-    sendString("\"")
     if (sendCommand(None, True, False) == False):
         return False
 
     if (persistent):
-        simpleCommand("AT+CWAUTOCONN=1")
+        simpleCommand(b"AT+CWAUTOCONN=1")
 
     return True
 
 def setWifiMode(mode: int, save: int) -> int:
-    global wifiMode, wifiModeDef, lastErrorCode
+    global wifiMode, wifiModeDef, lastErrorCode, statusValid
     
     if (wifiModeDef == 0):
         # reset() was not executed successful
@@ -386,20 +955,21 @@ def setWifiMode(mode: int, save: int) -> int:
     if (mode == wifiMode and (not save or mode == wifiModeDef)):  # no change
         return True
 
-    sendString("AT+CWMODE=" if save else "AT+CWMODE_CUR=")
-    sMode = chr(mode + ord('0'))
-    sendString(sMode)
+    if (not cmdStartSetting(b"AT+CWMODE=" if save else b"AT+CWMODE_CUR=", save)):
+        return False
+    cmdInt(mode)
     if (sendCommand(None, True, False) == False):
         return False
 
-        wifiMode = mode
-        if (save):
-            wifiModeDef = mode
+    wifiMode = mode
+    statusValid = False
+    if (save):
+        wifiModeDef = mode
 
-        return True
+    return True
 
 def connect(type: str, host: str, port: int) -> int:
-    global linkInfo, lastErrorCode
+    global linkInfo, linkStatus, lastErrorCode, sslStats
     
     maintain()
 
@@ -410,16 +980,28 @@ def connect(type: str, host: str, port: int) -> int:
     LOG_INFO_PRINT(f'start {type} to {host}:{port} on link {linkId}\r\n')
 
     link = linkInfo[linkId]
+    linkStatus[linkId].linkId = -1
 
     if (link.flags & LINK_CONNECTED):
-        LOG_ERROR_PRINTF(f'linkId {linkId} is already connected.\r\n')
+        LOG_ERROR_PRINT(f'linkId {linkId} is already connected.\r\n')
         lastErrorCode = Error_LINK_ALREADY_CONNECTED
         return NO_LINK
 
-    cmd = f'AT+CIPSTART={linkId},"{type}","{host}",{port}'
-    if (sendString(cmd) != True):
-        link.flags = 0
-        return NO_LINK
+    ssl = type == "SSL"
+    if (ssl and sslServerName):
+        import EspAtSsl
+        if (not EspAtSsl.sendSni(linkId)):
+            return NO_LINK
+
+    t = utime.ticks_ms()
+    cmdStart(b"AT+CIPSTART=")
+    cmdInt(linkId)
+    cmdAppend(b",")
+    cmdQuoted(type)
+    cmdAppend(b",")
+    cmdQuoted(host)
+    cmdAppend(b",")
+    cmdInt(port)
 
 #if 0  // TODO:
 #	if (udpLocalPort != 0)
@@ -430,11 +1012,20 @@ def connect(type: str, host: str, port: int) -> int:
 #	}
 #endif
 
-    if (sendCommand(None, True, False) == False):
+    ok = sendCommand(None, True, False)
+    link.connectTime = utime.ticks_diff(utime.ticks_ms(), t)
+    if (ssl):
+        sslStats[0] += 1
+        if (ok):
+            sslStats[1] += 1
+            sslStats[2] += link.connectTime
+
+    if (ok == False):
         link.flags = 0
         return NO_LINK
 
     link.flags = LINK_CONNECTED
+    LOG_INFO_PRINT(f'\tconnected in {link.connectTime} ms\r\n')
 
 #if 0  // TODO:
 #	if (udpLocalPort != 0)
@@ -460,7 +1051,7 @@ def freeLinkId():
     return NO_LINK
 
 def quitAP(save: int) -> int:
-    global wifiMode, persistent
+    global wifiMode, persistent, staticIp, staticDns
     
     LOG_INFO_PRINT("quit AP ")
     LOG_INFO_PRINT(" persistent\r\n" if (persistent or save) else " current\r\n", False)
@@ -471,19 +1062,21 @@ def quitAP(save: int) -> int:
         return False
 
     if (persistent or save):
-        if (simpleCommand("AT+CWAUTOCONN=0") == False):  # don't reconnect on reset
+        if (simpleCommand(b"AT+CWAUTOCONN=0") == False):  # don't reconnect on reset
             return False
-        if (simpleCommand("AT+CIPDNS_DEF=0") == False):  # clear static DNS servers
+        if (settingCommand(b"AT+CIPDNS_DEF=0", True) == False):  # clear static DNS servers
             return False
-        if (simpleCommand("AT+CWDHCP=1,1") == False):  # enable DHCP back in case static IP disabled it
+        if (settingCommand(b"AT+CWDHCP=1,1", True) == False):  # enable DHCP back in case static IP disabled it
             return False
     else:
-        if (simpleCommand("AT+CIPDNS_CUR=0") == False):  # clear static DNS servers
+        if (staticDns and settingCommand(b"AT+CIPDNS_CUR=0", False) == False):  # clear static DNS servers
             return False
-        if (simpleCommand("AT+CWDHCP_CUR=1,1") == False):  # enable DHCP back in case static IP disabled it
+        if (staticIp and settingCommand(b"AT+CWDHCP_CUR=1,1", False) == False):  # static IP disabled DHCP
             return False
+    staticIp = False
+    staticDns = False
 
-    return simpleCommand("AT+CWQAP")  # it doesn't clear the persistent settings
+    return simpleCommand(b"AT+CWQAP")  # it doesn't clear the persistent settings
 
 def close(linkId: int, abort: int) -> int:
     global linkInfo
@@ -502,23 +1095,28 @@ def close(linkId: int, abort: int) -> int:
     link.flags |= LINK_CLOSING
 
     if (abort):
-        if (sendString(f'AT+CIPCLOSEMODE={linkId},1') != True):
-            return False
+        cmdStart(b"AT+CIPCLOSEMODE=")
+        cmdInt(linkId)
+        cmdAppend(b",1")
         sendCommand(None, True, False)  # Note: do not check the return value
 
-    if (sendString(f'AT+CIPCLOSE={linkId}') != True):
-        return False
-    
+    cmdStart(b"AT+CIPCLOSE=")
+    cmdInt(linkId)
     return sendCommand(None, True, False)
 
-def sendData(linkId: int, buff: bytes) -> int:
+def sendData(linkId: int, buff) -> int:
+    # buff is a bytes-like object or a list of them sent as one segment
     global linkInfo, espUART, buffer, lastErrorCode
     
     maintain()
 
     LOG_INFO_PRINT(f'send data on link {linkId}\r\n')
 
-    if (len(buff) == 0):
+    parts = buff if isinstance(buff, list) else (buff,)
+    size = 0
+    for b in parts:
+        size += len(b)
+    if (size == 0):
         return 0
     
     if (not (linkInfo[linkId].flags & LINK_CONNECTED)):
@@ -526,7 +1124,10 @@ def sendData(linkId: int, buff: bytes) -> int:
         lastErrorCode = Error_LINK_NOT_ACTIVE
         return 0
 
-    sendString(f'AT+CIPSEND={linkId},{len(buff)}')
+    cmdStart(b"AT+CIPSEND=")
+    cmdInt(linkId)
+    cmdAppend(b",")
+    cmdInt(size)
 
 #   // TODO
 #	if (udpHost != nullptr)
@@ -537,13 +1138,14 @@ def sendData(linkId: int, buff: bytes) -> int:
 #		cmd->print(udpPort);
 #	}
 
-    if (sendCommand(">", True, False) == False):
+    if (sendCommand(b">", True, False) == False):
         return 0
 
-    if (espUART.write(buff) != len(buff)):
-        return 0
+    for b in parts:
+        if (espUART.write(b) != len(b)):
+            return 0
 
-    if (readRX("Recv ", True, False) == False):
+    if (readRX(b"Recv ", True, False) == False):
         return 0
 
     l = buffer.find(b' ', 5)
@@ -552,7 +1154,7 @@ def sendData(linkId: int, buff: bytes) -> int:
     if (l > 0):
         rLen = int(buffer[5:l])
 
-        if (readRX("SEND ", True, False) == True):  # SEND OK or SEND FAIL
+        if (readRX(b"SEND ", True, False) == True):  # SEND OK or SEND FAIL
             if (buffer[5:7] == b'OK'):
                 sendOk = True
 
@@ -578,7 +1180,7 @@ def availData(linkId: int) -> int:
 def syncLinkInfo() -> int:
     global lastSync
     
-    if (utime.ticks_ms() - lastSync < 500):
+    if (utime.ticks_ms() - lastSync < max(syncInterval, syncMin)):
         return False
     lastSync = utime.ticks_ms()
 
@@ -587,40 +1189,15 @@ def syncLinkInfo() -> int:
     return checkLinks() and recvLenQuery()
 
 def checkLinks() -> int:
-    global buffer, linkInfo
-    
-    maintain()
-
-    sendString("AT+CIPSTATUS")
-    if (sendCommand("STATUS", True, False) == False):
-        return False
-
-    ok = [False] * LINKS_COUNT
-
-    while (readRX("+CIPSTATUS", True, True)):
-        linkId = buffer[11] - 48  # '+CIPSTATUS:'
-        ok[linkId] = True
-
-    for linkId in range(LINKS_COUNT):
-        link = linkInfo[linkId]
-
-        if (ok[linkId]):
-            if (not (link.flags & (LINK_CONNECTED)) and (link.flags & (LINK_CLOSING))):
-                # missed incoming connection
-                link.flags = LINK_CONNECTED | LINK_IS_INCOMING
-        else:
-            # not connected
-            flags = 0
-
-    return True
+    return statusSnapshot(max(statusMaxAge, syncMin)) >= 0
 
 def recvLenQuery() -> int:
     global buffer, linkInfo
     
     maintain()
 
-    sendString("AT+CIPRECVLEN?")
-    if (sendCommand("+CIPRECVLEN", True, False) == False):
+    cmdStart(b"AT+CIPRECVLEN?")
+    if (sendCommand(b"+CIPRECVLEN", True, False) == False):
         return False
 
     tok = buffer[12:].split(b',')  # '+CIPRECVLEN:'
@@ -633,7 +1210,45 @@ def recvLenQuery() -> int:
 
     return readOK()
 
-def recvData(linkId: int, buffSize: int = 1000) -> bytes:
+def recvData(linkId: int, buffSize: int = 0) -> bytes:
+    # up to buffSize bytes, recvSize if 0
+    global espUART
+    
+    explen = recvStart(linkId, buffSize or recvSize)
+    if (explen <= 0):
+        return b''
+
+    b = espUART.read(explen)
+    return b if recvDone(linkId, explen, 0 if b == None else len(b)) else b''
+
+def recvDataInto(linkId: int, buff) -> int:
+    # receives up to len(buff) bytes directly into buff, a memoryview or a list
+    # of them filled in order, returns the count
+    global espUART
+    
+    parts = buff if isinstance(buff, list) else (buff,)
+    size = 0
+    for b in parts:
+        size += len(b)
+    explen = recvStart(linkId, size)
+    if (explen <= 0):
+        return 0
+
+    n = 0
+    for b in parts:
+        k = min(len(b), explen - n)
+        if (k <= 0):
+            break
+        r = espUART.readinto(b, k)
+        if (r != k):
+            n += 0 if r == None else r
+            break
+        n += k
+    return explen if recvDone(linkId, explen, n) else 0
+
+def recvStart(linkId: int, buffSize: int) -> int:
+    # sends AT+CIPRECVDATA and reads the response up to the data,
+    # returns the length of the data which follows
     global linkInfo, lastErrorCode, buffer, espUART
     
     maintain()
@@ -646,24 +1261,41 @@ def recvData(linkId: int, buffSize: int = 1000) -> bytes:
             lastErrorCode = Error_LINK_NOT_ACTIVE
         else:
             LOG_WARN_PRINT("no data for link\r\n")
-        return b''
+        return 0
 
-    sendString(f'AT+CIPRECVDATA={linkId},{buffSize}')
+    cmdStart(b"AT+CIPRECVDATA=")
+    cmdInt(linkId)
+    cmdAppend(b",")
+    cmdInt(buffSize)
 
-    if (sendCommand("+CIPRECVDATA", False, False) == False):
+    if (sendCommand(b"+CIPRECVDATA", False, False) == False):
         LOG_ERROR_PRINT(f'error receiving on link {linkId}\r\n')
         linkInfo[linkId].avail = 0
         lastErrorCode = Error_RECEIVE
         return 0
 
-    explen = int(buffer[13:])  # "+CIPRECVDATA," AT 1.7.x has : after <data_len> (not matching the doc)
-    b = espUART.read(explen)
+    if (not caps or caps.recvColon):
+        # "+CIPRECVDATA," AT 1.7.x has : after <data_len> (not matching the doc)
+        explen = EspAtParse.parseInt(buffer, 13, len(buffer))
+        return 0 if explen == None else explen
 
-    if (len(b) != explen):  # timeout
+    # "+CIPRECVDATA:<data_len>," the ':' ended the response line
+    explen = 0
+    while (True):
+        b = espUART.read(1)
+        if (b == None or b[0] < 48 or b[0] > 57):
+            break
+        explen = explen * 10 + b[0] - 48
+    return explen if b == b',' else 0
+
+def recvDone(linkId: int, explen: int, n: int) -> int:
+    global linkInfo, lastErrorCode
+    
+    if (n != explen):  # timeout
         LOG_ERROR_PRINT(f'error receiving on link {linkId}\r\n')
         linkInfo[linkId].avail = 0
         lastErrorCode = Error_RECEIVE
-        return b''
+        return False
 
     if (explen > linkInfo[linkId].avail):
         linkInfo[linkId].avail = 0
@@ -673,8 +1305,7 @@ def recvData(linkId: int, buffSize: int = 1000) -> bytes:
     readOK()
 
     LOG_INFO_PRINT(f'\tgot {explen} bytes on link {linkId}\r\n')
-
-    return b
+    return True
 
 def getLastErrorCode() -> int:
     global lastErrorCode
@@ -694,53 +1325,14 @@ def connected(linkId: int) -> int:
     link = linkInfo[linkId]
     return (link.flags & LINK_CONNECTED) and not (link.flags & LINK_CLOSING)
 
-def apQuery() -> list:
-    global wifiMode, buffer
+def linkStatusQuery(linkId: int) -> EspAtParse.LinkStatus:
+    global linkStatus
     
     maintain()
-    if (wifiMode != WIFI_MODE_STA):
-        LOG_ERROR_PRINT("STA is off\r\n", True)
-        return None;
-
-    sendString("AT+CWJAP?")
-    if (sendCommand("+CWJAP", True, False) == True):
-        return buffer.split(b',')
-    return None;
-
-def staIpQuery() -> list:
-    global buffer
-    
-    maintain()
-    ret = []
-
-    sendString("AT+CIPSTA?")
-    if (sendCommand("+CIPSTA", True, False) == False):
-        return None
-    for i in  range(3):
-        ret.append(buffer.split(b':')[2][1:-1].decode())
-        if (i < 2):
-            if (readRX("+CIPSTA", True, False) == False):
-                return None
-    readOK()
-    
-    return ret        
-
-def dnsQuery() -> list:
-    global buffer
-    
-    maintain()
-    ret = []
-
-    sendString("AT+CIPDNS_CUR?")
-    if (sendCommand("+CIPDNS_CUR", True, False) == False):
-        return None
-    ret.append(buffer.split(b':')[1].decode())
-    if (readRX("+CIPDNS_CUR", True, False) == False):
-        return None
-    ret.append(buffer.split(b':')[1].decode())
-    readOK()
-        
-    return ret
+    st = linkStatus[linkId]
+    if (st.linkId != linkId):  # not known since the link was opened
+        statusSnapshot(0)
+    return st if st.linkId == linkId else None
 
 
 ####################### For Debugging 
@@ -752,6 +1344,9 @@ def LOG_INFO_PRINT(x: str = None, prefix: int = True):
         if (x != None):
             print(x, end="")
     
+def LOG_WARN_PRINT(x: str = None, prefix: int = True):
+    LOG_ERROR_PRINT(x, prefix)
+
 def LOG_ERROR_PRINT(x: str = None, prefix: int = True):
     if (LOG_ERROR):
         if (x == None or prefix):
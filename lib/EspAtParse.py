@@ -0,0 +1,322 @@
+# EspAtParse.py
+#
+# Parsers of AT firmware responses
+#
+# Every parser scans a response line once and fills a preallocated record.
+# Strings and addresses are kept in the record's bytearrays, nothing is
+# allocated while parsing. Malformed lines are rejected with a False
+# (or -1 link ID) return value and leave the record incomplete.
+#
+# Version:
+#  0.1.0: initial version
+#  0.2.0: firmware capabilities from AT+GMR
+#  0.2.1: AT+SLEEP capability
+#  0.2.2: AT 2's +CIPDNS:<enable>,<servers>
+
+from micropython import const
+
+MAX_FIELDS = const(8)
+
+LINK_TYPE_TCP = const(0)
+LINK_TYPE_UDP = const(1)
+LINK_TYPE_SSL = const(2)
+
+###################################
+
+class ApInfo:
+    def __init__(self):
+        self.ssid = bytearray(32)
+        self.ssidLen = 0
+        self.bssid = bytearray(6)
+        self.channel = 0
+        self.rssi = 0
+
+    def ssidStr(self) -> str:
+        return bytes(self.ssid[:self.ssidLen]).decode()
+
+class IpConfig:
+    def __init__(self):
+        self.ip = bytearray(4)
+        self.gateway = bytearray(4)
+        self.netmask = bytearray(4)
+
+class DnsConfig:
+    def __init__(self):
+        self.servers = (bytearray(4), bytearray(4))
+        self.count = 0
+
+class LinkStatus:
+    def __init__(self):
+        self.linkId = -1  # -1 if the record is not filled
+        self.type = LINK_TYPE_TCP
+        self.remoteIp = bytearray(4)
+        self.remotePort = 0
+        self.localPort = 0
+        self.isServer = False
+
+class Capabilities:
+    def __init__(self):
+        self.version = b""       # AT version as reported by AT+GMR
+        self.atMajor = 0
+        self.atMinor = 0
+        self.atMod = False       # ESP_ATMod
+        self.curCommands = True  # _CUR/_DEF variants of the WiFi commands (AT 1.x)
+        self.passiveRecv = True  # AT+CIPRECVMODE=1
+        self.recvColon = True    # +CIPRECVDATA,<len>:<data> (AT 1.7), else +CIPRECVDATA:<len>,<data>
+        self.maxSend = 2048      # longest data of one AT+CIPSEND
+        self.sslSize = False     # AT+CIPSSLSIZE
+        self.sni = False         # AT+CIPSSLCSNI
+        self.mfln = False        # AT+CIPSSLMFLN, TLS max fragment length negotiation
+        self.sendBuf = False     # AT+CIPSENDBUF
+        self.uartCur = False     # AT+UART_CUR, the baud rate can be raised
+        self.sleep = False       # AT+SLEEP, modem and light sleep
+
+class StationInfo:
+    def __init__(self):
+        self.active = False
+        self.mac = bytearray(6)
+        self.ip = bytearray(4)
+        self.hasIp = False
+
+###################################
+
+# start and end offsets of the fields found by fields()
+offs = [0] * (2 * MAX_FIELDS)
+
+def fields(buf, start: int) -> int:
+    # Splits buf[start:] on commas outside of double quotes. Offsets of the
+    # fields, without the quotes, are stored in offs. Returns the number of fields.
+    global offs
+
+    n = 0
+    i = start
+    end = len(buf)
+    while (n < MAX_FIELDS):
+        if (i < end and buf[i] == 34):  # '"'
+            i += 1
+            offs[2 * n] = i
+            while (i < end and buf[i] != 34):
+                if (buf[i] == 92):  # '\' escapes the next character
+                    i += 1
+                i += 1
+            offs[2 * n + 1] = min(i, end)
+            i += 1
+            while (i < end and buf[i] != 44):  # ',', skip to the end of the field
+                i += 1
+        else:
+            offs[2 * n] = i
+            while (i < end and buf[i] != 44):
+                i += 1
+            offs[2 * n + 1] = i
+        n += 1
+        if (i >= end):
+            break
+        i += 1  # skip ','
+    return n
+
+def parseInt(buf, start: int, end: int) -> int:
+    # returns None if buf[start:end] is not a decimal integer
+    neg = start < end and buf[start] == 45  # '-'
+    if (neg):
+        start += 1
+    if (start >= end):
+        return None
+    val = 0
+    for i in range(start, end):
+        d = buf[i] - 48
+        if (d < 0 or d > 9):
+            return None
+        val = val * 10 + d
+    return -val if neg else val
+
+def parseIp(buf, start: int, end: int, ip: bytearray) -> int:
+    # dotted IPv4 address in buf[start:end] to the 4 bytes of ip
+    part = 0
+    val = -1
+    for i in range(start, end):
+        c = buf[i]
+        if (c == 46):  # '.'
+            if (val < 0 or part == 3):
+                return False
+            ip[part] = val
+            part += 1
+            val = -1
+        elif (c >= 48 and c <= 57):
+            val = (0 if val < 0 else val * 10) + c - 48
+            if (val > 255):
+                return False
+        else:
+            return False
+    if (val < 0 or part != 3):
+        return False
+    ip[3] = val
+    return True
+
+def parseMac(buf, start: int, end: int, mac: bytearray) -> int:
+    # 'aa:bb:cc:dd:ee:ff' in buf[start:end] to the 6 bytes of mac
+    if (end - start != 17):
+        return False
+    for part in range(6):
+        i = start + 3 * part
+        if (part < 5 and buf[i + 2] != 58):  # ':'
+            return False
+        hi = _hexDigit(buf[i])
+        lo = _hexDigit(buf[i + 1])
+        if (hi < 0 or lo < 0):
+            return False
+        mac[part] = (hi << 4) | lo
+    return True
+
+def _hexDigit(c: int) -> int:
+    if (c >= 48 and c <= 57):
+        return c - 48
+    c |= 32  # lower case
+    if (c >= 97 and c <= 102):
+        return c - 87
+    return -1
+
+def ipStr(ip: bytearray) -> str:
+    return f'{ip[0]}.{ip[1]}.{ip[2]}.{ip[3]}'
+
+def macStr(mac: bytearray) -> str:
+    return ':'.join(f'{b:02x}' for b in mac)
+
+###################################
+
+def parseCwjap(buf, ap: ApInfo) -> int:
+    # +CWJAP:"<ssid>","<bssid>",<channel>,<rssi>
+    # The firmware doesn't escape the SSID, so it is everything between the first
+    # quote and the fixed format fields counted from the end of the line.
+    start = buf.find(b':') + 1
+    end = len(buf)
+    if (start <= 0 or start >= end or buf[start] != 34):
+        return False
+
+    comma2 = buf.rfind(b',', start)
+    comma1 = buf.rfind(b',', start, comma2) if comma2 > 0 else -1
+    bssidEnd = comma1 - 1  # closing quote of bssid
+    bssidStart = bssidEnd - 17
+    if (comma1 < 0 or bssidStart - 3 <= start or buf[bssidEnd] != 34 or buf[bssidStart - 1] != 34
+            or buf[bssidStart - 2] != 44 or buf[bssidStart - 3] != 34):
+        return False
+
+    channel = parseInt(buf, comma1 + 1, comma2)
+    rssi = parseInt(buf, comma2 + 1, end)
+    if (channel is None or rssi is None or not parseMac(buf, bssidStart, bssidEnd, ap.bssid)):
+        return False
+
+    ssidLen = bssidStart - 3 - (start + 1)
+    if (ssidLen > len(ap.ssid)):
+        return False
+    for i in range(ssidLen):
+        ap.ssid[i] = buf[start + 1 + i]
+    ap.ssidLen = ssidLen
+    ap.channel = channel
+    ap.rssi = rssi
+    return True
+
+def parseGmr(buf, caps: Capabilities) -> int:
+    # AT version:<major>.<minor>.<patch>.<build>(<date>) or AT version:1.7.0.0 (partial)
+    start = buf.find(b':') + 1
+    if (start <= 0):
+        return False
+    dot1 = buf.find(b'.', start)
+    dot2 = buf.find(b'.', dot1 + 1) if dot1 > 0 else -1
+    major = parseInt(buf, start, dot1)
+    minor = parseInt(buf, dot1 + 1, dot2)
+    if (dot2 < 0 or major is None or minor is None):
+        return False
+    end = start
+    while (end < len(buf) and buf[end] != 40 and buf[end] != 32):  # '(' or ' '
+        end += 1
+    caps.version = bytes(buf[start:end])
+    caps.atMajor = major
+    caps.atMinor = minor
+    return True
+
+def parseCipsta(buf, cfg: IpConfig) -> int:
+    # +CIPSTA:<ip|gateway|netmask>:"<address>" (or +CIPSTA_CUR:, +CIPSTA_DEF:)
+    key = buf.find(b':') + 1
+    if (key <= 0):
+        return False
+    colon = buf.find(b':', key)
+    if (colon < 0 or colon + 2 >= len(buf) or buf[colon + 1] != 34 or buf[-1] != 34):
+        return False
+
+    k = buf[key]
+    if (k == 105):  # 'i'
+        ip = cfg.ip
+    elif (k == 103):  # 'g'
+        ip = cfg.gateway
+    elif (k == 110):  # 'n'
+        ip = cfg.netmask
+    else:
+        return False
+    return parseIp(buf, colon + 2, len(buf) - 1, ip)
+
+def parseCipdns(buf, dns: DnsConfig, index: int) -> int:
+    # +CIPDNS_CUR:<address> (or +CIPDNS_DEF:), one line per server, or AT 2's
+    # +CIPDNS:<enable>[,"<address>",...] with all servers in one line
+    start = buf.find(b':') + 1
+    if (start <= 0 or index >= len(dns.servers)):
+        return False
+    end = len(buf)
+    if (start + 1 < end and buf[start] in (48, 49) and buf[start + 1] == 44):  # "0," or "1,"
+        n = fields(buf, start + 2)
+        for k in range(min(n, len(dns.servers) - index)):
+            if (not parseIp(buf, offs[2 * k], offs[2 * k + 1], dns.servers[index])):
+                return False
+            index += 1
+        dns.count = index
+        return True
+    if (start < end and buf[start] == 34):  # newer firmware quotes the address
+        start += 1
+        end -= 1
+    if (not parseIp(buf, start, end, dns.servers[index])):
+        return False
+    dns.count = index + 1
+    return True
+
+def parseCipstatus(buf, links: list) -> int:
+    # +CIPSTATUS:<link ID>,"<type>","<remote IP>",<remote port>,<local port>,<tetype>
+    # Fills links[<link ID>], returns the link ID or -1.
+    start = buf.find(b':') + 1
+    if (start <= 0 or fields(buf, start) != 6):
+        return -1
+
+    linkId = parseInt(buf, offs[0], offs[1])
+    remotePort = parseInt(buf, offs[6], offs[7])
+    localPort = parseInt(buf, offs[8], offs[9])
+    tetype = parseInt(buf, offs[10], offs[11])
+    if (linkId is None or remotePort is None or localPort is None or tetype is None
+            or linkId < 0 or linkId >= len(links)):
+        return -1
+    link = links[linkId]
+    if (not parseIp(buf, offs[4], offs[5], link.remoteIp)):
+        return -1
+
+    t = buf[offs[2]] if offs[2] < offs[3] else 0
+    if (t == 85):  # 'U'
+        link.type = LINK_TYPE_UDP
+    elif (t == 83):  # 'S'
+        link.type = LINK_TYPE_SSL
+    else:
+        link.type = LINK_TYPE_TCP
+    link.linkId = linkId
+    link.remotePort = remotePort
+    link.localPort = localPort
+    link.isServer = tetype == 1
+    return linkId
+
+def parseStation(buf, mac: bytearray, ip: bytearray) -> int:
+    # +STA_CONNECTED:"<mac>", +STA_DISCONNECTED:"<mac>" or +DIST_STA_IP:"<mac>","<ip>"
+    # Returns the number of parsed fields (1 or 2), 0 for a malformed line.
+    start = buf.find(b':') + 1
+    if (start <= 0):
+        return 0
+    n = fields(buf, start)
+    if (n < 1 or n > 2 or not parseMac(buf, offs[0], offs[1], mac)):
+        return 0
+    if (n == 2 and not parseIp(buf, offs[2], offs[3], ip)):
+        return 0
+    return n
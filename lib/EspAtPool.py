@@ -0,0 +1,267 @@
+# EspAtPool.py
+#
+# Receive and transmit buffers of the clients in blocks of one preallocated
+# pool
+#
+# The pool is one bytearray cut into blocks of BLOCK_SIZE bytes, allocated
+# once by the first attach(), so buffering doesn't fragment the heap, an
+# application without clients doesn't pay for it and the memory of all links
+# stays within the pool's budget. Each link (the owner) may hold up to its
+# share of the blocks, the count divided by the attached links, the remainder
+# one block each to the first links. A link's receive and transmit queues
+# draw from its one share. A link over its share gets no more blocks until it
+# consumed or sent data, so one busy link can't starve the others.
+#
+# BlockQueue is the FIFO of a client's data in the blocks of a pool.
+#
+# Version:
+#  0.1.0: initial version
+#  0.1.1: the memory is allocated by the first attach(), not at import
+#  0.1.2: the remainder of the blocks is shared, commit(0) returns the new block, room()
+
+from micropython import const
+import micropython
+
+BLOCK_SIZE = const(1024)
+POOL_BUDGET = const(12288)  # default bytes of the pool
+OWNERS_COUNT = const(5)     # EspAtDrv.LINKS_COUNT
+
+class BufferPool:
+    def __init__(self, budget: int = POOL_BUDGET, blockSize: int = BLOCK_SIZE):
+        self.blockSize = blockSize
+        self.attached = [False] * OWNERS_COUNT  # owners sharing the pool
+        self.mem = None  # allocated by the first attach()
+        self.resize(budget)
+
+    def resize(self, budget: int) -> int:
+        # new budget, only while no block is in use
+        if (self.mem != None and len(self.free) != self.count):
+            return False
+        self.count = budget // self.blockSize
+        self.mem = None  # the old pool is freed before the new is allocated
+        self.view = None
+        self.free = list(range(self.count - 1, -1, -1))
+        self.held = [0] * OWNERS_COUNT  # blocks per owner
+        self.peak = [0] * OWNERS_COUNT  # high-water marks per owner
+        self.highWater = 0  # most blocks in use
+        self.denied = 0  # allocations refused by the budget or the share
+        if (True in self.attached):
+            self.allocate()
+        return True
+
+    def allocate(self):
+        self.mem = bytearray(self.count * self.blockSize)
+        self.view = memoryview(self.mem)
+
+    def attach(self, owner: int):
+        if (self.mem == None):
+            self.allocate()
+        self.attached[owner] = True
+
+    def detach(self, owner: int):
+        self.attached[owner] = False
+
+    def share(self, owner: int) -> int:
+        # blocks the owner may hold: the count divided by the attached owners,
+        # the first count % owners of them get one more
+        owners = 0 if self.attached[owner] else 1
+        rank = 0  # attached owners before this one
+        for i in range(OWNERS_COUNT):
+            if (self.attached[i]):
+                owners += 1
+                if (i < owner):
+                    rank += 1
+        return max(self.count // owners + (1 if rank < self.count % owners else 0), 1)
+
+    def room(self, owner: int) -> int:
+        # blocks alloc() would give the owner now
+        return max(min(len(self.free), self.share(owner) - self.held[owner]), 0)
+
+    def alloc(self, owner: int) -> int:
+        # a free block for the owner, -1 if there is none or the owner is over its share
+        if (self.mem == None or not self.free or self.held[owner] >= self.share(owner)):
+            self.denied += 1
+            return -1
+        i = self.free.pop()
+        self.held[owner] += 1
+        self.peak[owner] = max(self.peak[owner], self.held[owner])
+        self.highWater = max(self.highWater, self.count - len(self.free))
+        return i
+
+    def release(self, owner: int, i: int):
+        self.held[owner] -= 1
+        self.free.append(i)
+
+    def block(self, i: int) -> memoryview:
+        return self.view[i * self.blockSize:(i + 1) * self.blockSize]
+
+    def statistics(self) -> tuple:
+        # (blocks, block size, blocks in use, high-water mark, refused allocations,
+        # high-water marks per owner)
+        return (self.count, self.blockSize, self.count - len(self.free), self.highWater,
+                self.denied, tuple(self.peak))
+
+class BlockQueue:
+    # data from start in the first block to end in the last block
+    def __init__(self, pool: BufferPool, owner: int = 0):
+        self.pool = pool
+        self.owner = owner
+        self.blocks = []
+        self.spare = []  # blocks of reserve() not committed yet
+        self.start = 0
+        self.end = 0
+        self.n = 0  # bytes queued
+
+    def clear(self):
+        for i in self.blocks + self.spare:
+            self.pool.release(self.owner, i)
+        self.blocks = []
+        self.spare = []
+        self.start = 0
+        self.end = 0
+        self.n = 0
+
+    def space(self) -> memoryview:
+        # the free room behind the data, in a new block if the last one is
+        # full. None if the pool has no block for the owner.
+        if (not self.blocks or self.end == self.pool.blockSize):
+            i = self.pool.alloc(self.owner)
+            if (i < 0):
+                return None
+            self.blocks.append(i)
+            self.end = 0
+        return self.pool.block(self.blocks[-1])[self.end:]
+
+    def reserve(self, size: int) -> list:
+        # views of up to size free bytes behind the data, for one read into
+        # them, in as many blocks as the pool gives. None if it gives none.
+        room = self.space()
+        if (room == None):
+            return None
+        ret = [room[:size]]
+        size -= len(ret[0])
+        while (size > 0 and self.pool.room(self.owner)):
+            i = self.pool.alloc(self.owner)
+            self.spare.append(i)
+            ret.append(self.pool.block(i)[:size])
+            size -= len(ret[-1])
+        return ret
+
+    def commit(self, n: int):
+        # n bytes were written to space() or reserve(), the unused blocks go back
+        self.n += n
+        while True:
+            k = min(n, self.pool.blockSize - self.end)
+            self.end += k
+            n -= k
+            if (n == 0):
+                break
+            self.blocks.append(self.spare.pop(0))
+            self.end = 0
+        for i in self.spare:
+            self.pool.release(self.owner, i)
+        self.spare = []
+        if (self.blocks and self.end == 0):  # the new block of space() got nothing
+            self.pool.release(self.owner, self.blocks.pop())
+            self.end = self.pool.blockSize if self.blocks else 0
+
+    def room(self) -> int:
+        # bytes put() takes now, behind the data and in the blocks the pool gives
+        last = self.pool.blockSize - self.end if self.blocks else 0
+        return last + self.pool.room(self.owner) * self.pool.blockSize
+
+    def put(self, data) -> int:
+        # copies data in, returns the count which got blocks
+        mv = memoryview(data)
+        pos = 0
+        while (pos < len(mv)):
+            room = self.space()
+            if (room == None):
+                break
+            n = min(len(room), len(mv) - pos)
+            room[:n] = mv[pos:pos + n]
+            self.commit(n)
+            pos += n
+        return pos
+
+    def views(self, size: int) -> list:
+        # memoryviews of the first size bytes, one per block
+        ret = []
+        start = self.start
+        for k in range(len(self.blocks)):
+            if (size <= 0):
+                break
+            stop = self.end if k == len(self.blocks) - 1 else self.pool.blockSize
+            n = min(stop - start, size)
+            ret.append(self.pool.block(self.blocks[k])[start:start + n])
+            size -= n
+            start = 0
+        return ret
+
+    def skip(self, n: int):
+        # drops n bytes from the front, the emptied blocks go back to the pool
+        self.n -= n
+        self.start += n
+        while (self.blocks):
+            stop = self.end if len(self.blocks) == 1 else self.pool.blockSize
+            if (self.start < stop):
+                break
+            self.start -= stop
+            self.pool.release(self.owner, self.blocks.pop(0))
+        if (not self.blocks):
+            self.start = 0
+            self.end = 0
+
+    def get(self, buf) -> int:
+        # moves up to len(buf) bytes into buf, returns the count
+        pos = 0
+        for mv in self.views(len(buf)):
+            buf[pos:pos + len(mv)] = mv
+            pos += len(mv)
+        self.skip(pos)
+        return pos
+
+    def take(self, n: int) -> bytes:
+        # removes and returns up to n bytes
+        buf = bytearray(min(n, self.n))
+        self.get(buf)
+        return bytes(buf)
+
+    def peek(self) -> int:
+        # the first byte, -1 if empty
+        if (not self.n):
+            return -1
+        return self.pool.view[self.blocks[0] * self.pool.blockSize + self.start]
+
+    def find(self, delim: bytes, start: int = 0, end: int = None) -> int:
+        # offset of delim in the data from start to end, -1 if not there
+        end = self.n if end == None else min(end, self.n)
+        mem = self.pool.view
+        bs = self.pool.blockSize
+        last = end - len(delim)
+        while (start <= last):
+            # the first byte of delim in one block, the rest byte by byte
+            k, off = divmod(self.start + start, bs)
+            stop = min(bs, off + last - start + 1)
+            base = self.blocks[k] * bs
+            i = _index(mem, delim[0], base + off, base + stop)
+            if (i < 0):
+                start += stop - off
+                continue
+            start += i - base - off
+            for j in range(1, len(delim)):
+                k, off = divmod(self.start + start + j, bs)
+                if (mem[self.blocks[k] * bs + off] != delim[j]):
+                    break
+            else:
+                return start
+            start += 1
+        return -1
+
+@micropython.native
+def _index(buf, b: int, start: int, end: int) -> int:
+    # position of byte b in buf[start:end], -1 if not there
+    for i in range(start, end):
+        if (buf[i] == b):
+            return i
+    return -1
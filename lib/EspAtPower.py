@@ -0,0 +1,54 @@
+# EspAtPower.py
+#
+# Power profiles of the AT firmware, loaded by EspAtDrv on first use
+#
+# A profile sets the firmware's sleep mode with AT+SLEEP and the listen
+# interval of the next join (AT 2 only). EspAtDrv extends the first response
+# deadline after an idle time by EspAtDrv.wakeMargin and keeps at least
+# EspAtDrv.syncMin ms between link syncs, both set here for the profile.
+#
+# Version:
+#  0.1.0: moved from EspAtDrv
+
+from micropython import const
+import EspAtDrv
+from EspAtDrv import maintain, cmdStart, cmdInt, sendCommand
+from EspAtDrv import LOG_ERROR_PRINT
+
+# per EspAtDrv.PROFILE_*: AT+SLEEP mode, listen interval in beacons (AT 2, 0
+# for the DTIM period of the AP), minimum ms between link syncs and snapshot age
+POWER_PROFILES = (
+    (0, 0, 0),
+    (2, 3, 500),
+    (1, 10, 2000),
+)
+SLEEP_LIGHT = const(1)
+BEACON_TIME = const(103)  # ms, the usual beacon interval of 102.4 ms
+DTIM_MAX = const(3)       # DTIM period assumed for the wake-ups without a listen interval
+
+###################################
+
+def setPowerProfile(profile: int) -> int:
+    # Sets the sleep mode of the profile and adapts the response deadlines and
+    # the link syncs to its wake-up delays. The listen interval is sent with
+    # the next joinAP(), only AT 2 has the parameter.
+    mode, listen, sync = POWER_PROFILES[profile]
+    caps = EspAtDrv.caps
+    if (caps == None or not caps.sleep):
+        LOG_ERROR_PRINT("AT+SLEEP not supported\r\n")
+        EspAtDrv.lastErrorCode = EspAtDrv.Error_AT_ERROR
+        return False
+
+    maintain()
+    cmdStart(b"AT+SLEEP=")
+    cmdInt(mode)
+    if (not sendCommand(None, True, False)):
+        return False
+
+    EspAtDrv.powerProfile = profile
+    EspAtDrv.listenInterval = listen if caps.atMajor >= 2 else 0
+    # in modem sleep the UART stays awake, in light sleep the CPU wakes for the beacons
+    EspAtDrv.wakeMargin = (BEACON_TIME * (EspAtDrv.listenInterval or DTIM_MAX)
+                           if mode == SLEEP_LIGHT else 0)
+    EspAtDrv.syncMin = sync
+    return True
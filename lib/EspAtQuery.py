@@ -0,0 +1,125 @@
+# EspAtQuery.py
+#
+# Station queries and static IP configuration, loaded on first use
+#
+# Every query fills a preallocated EspAtParse record. The static IP and DNS
+# servers are kept in the same records, so with a static configuration
+# staIpQuery() and dnsQuery() answer without a command.
+#
+# Version:
+#  0.1.0: moved from EspAtDrv
+#  0.1.1: AT 2 command names, AT 2's AT+CIPDNS? response
+
+import EspAtDrv
+import EspAtParse
+from EspAtDrv import maintain, cmdStart, cmdStartSetting, cmdAppend, cmdQuoted, sendCommand, readRX, readOK
+from EspAtDrv import LOG_INFO_PRINT, LOG_ERROR_PRINT
+
+apInfo = EspAtParse.ApInfo()  # records filled by the queries
+ipConfig = EspAtParse.IpConfig()
+dnsConfig = EspAtParse.DnsConfig()
+
+###################################
+
+def apQuery() -> EspAtParse.ApInfo:
+    global apInfo
+
+    maintain()
+    if (not (EspAtDrv.wifiMode & EspAtDrv.WIFI_MODE_STA)):
+        LOG_ERROR_PRINT("STA is off\r\n", True)
+        return None;
+
+    cmdStart(b"AT+CWJAP?")
+    if (sendCommand(b"+CWJAP", True, False) == False):
+        return None
+
+    ok = EspAtParse.parseCwjap(EspAtDrv.buffer, apInfo)
+    readOK()
+    return apInfo if ok else None
+
+def staStaticIp(ip: str, gateway: str, netmask: str) -> int:
+    # Sets a static IP of the station, the firmware turns DHCP off with it.
+    # The addresses are kept in ipConfig, staIpQuery() doesn't ask for them.
+    global ipConfig
+
+    maintain()
+
+    LOG_INFO_PRINT(f'static IP {ip}\r\n')
+
+    for addr, rec in ((ip, ipConfig.ip), (gateway, ipConfig.gateway), (netmask, ipConfig.netmask)):
+        addr = addr.encode()
+        if (not EspAtParse.parseIp(addr, 0, len(addr), rec)):
+            LOG_ERROR_PRINT(f'invalid address {addr}\r\n')
+            EspAtDrv.lastErrorCode = EspAtDrv.Error_AT_ERROR
+            return False
+
+    if (not cmdStartSetting(b"AT+CIPSTA_DEF=" if EspAtDrv.persistent else b"AT+CIPSTA_CUR=",
+                            EspAtDrv.persistent)):
+        return False
+    cmdQuoted(ip)
+    cmdAppend(b",")
+    cmdQuoted(gateway)
+    cmdAppend(b",")
+    cmdQuoted(netmask)
+    EspAtDrv.staticIp = sendCommand(None, True, False)
+    return EspAtDrv.staticIp
+
+def setDNS(dns1: str, dns2: str) -> int:
+    # static DNS servers, kept in dnsConfig for dnsQuery()
+    global dnsConfig
+
+    maintain()
+
+    dnsConfig.count = 0
+    if (not cmdStartSetting(b"AT+CIPDNS_DEF=1" if EspAtDrv.persistent else b"AT+CIPDNS_CUR=1",
+                            EspAtDrv.persistent)):
+        return False
+    for addr in (dns1, dns2):
+        if (not addr):
+            continue
+        cmdAppend(b",")
+        cmdQuoted(addr)
+        addr = addr.encode()
+        if (not EspAtParse.parseIp(addr, 0, len(addr), dnsConfig.servers[dnsConfig.count])):
+            LOG_ERROR_PRINT(f'invalid address {addr}\r\n')
+            EspAtDrv.lastErrorCode = EspAtDrv.Error_AT_ERROR
+            return False
+        dnsConfig.count += 1
+
+    EspAtDrv.staticDns = sendCommand(None, True, False)
+    return EspAtDrv.staticDns
+
+def dhcpEnabled() -> int:
+    # the station's DHCP client is on unless a static IP was set
+    return not EspAtDrv.staticIp
+
+def staIpQuery() -> EspAtParse.IpConfig:
+    global ipConfig
+
+    maintain()
+    if (EspAtDrv.staticIp):
+        return ipConfig
+
+    cmdStart(b"AT+CIPSTA?")
+    ok = sendCommand(b"+CIPSTA", True, True)
+    while (ok):
+        EspAtParse.parseCipsta(EspAtDrv.buffer, ipConfig)
+        ok = readRX(b"+CIPSTA", True, True)  # ends with OK
+
+    return ipConfig if EspAtDrv.lastErrorCode == EspAtDrv.Error_NO_ERROR else None
+
+def dnsQuery() -> EspAtParse.DnsConfig:
+    global dnsConfig
+
+    maintain()
+    if (EspAtDrv.staticDns):
+        return dnsConfig
+    dnsConfig.count = 0
+
+    cmdStartSetting(b"AT+CIPDNS_CUR?", None)
+    ok = sendCommand(b"+CIPDNS", True, True)
+    while (ok):
+        EspAtParse.parseCipdns(EspAtDrv.buffer, dnsConfig, dnsConfig.count)
+        ok = readRX(b"+CIPDNS", True, True)  # ends with OK
+
+    return dnsConfig if EspAtDrv.lastErrorCode == EspAtDrv.Error_NO_ERROR else None
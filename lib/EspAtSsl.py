@@ -0,0 +1,75 @@
+# EspAtSsl.py
+#
+# TLS settings of the AT firmware, loaded on first use
+#
+# EspAtDrv.connect() calls sendSni() before an SSL AT+CIPSTART once a
+# server name was configured here. The handshake statistics are counted
+# by EspAtDrv.connect() in EspAtDrv.sslStats.
+#
+# Version:
+#  0.1.0: moved from EspAtDrv
+#  0.2.0: commands the firmware doesn't have (EspAtDrv.capabilities()) are not sent
+#  0.2.1: Error_NOT_INITIALIZED before init() instead of an exception
+
+import EspAtDrv
+from EspAtDrv import maintain, cmdStart, cmdAppend, cmdInt, cmdQuoted, sendCommand
+from EspAtDrv import LOG_WARN_PRINT, LOG_ERROR_PRINT
+
+sslBufferSize = 0  # AT+CIPSSLSIZE, 0 for the firmware default
+sniSupported = True  # cleared when the firmware rejects AT+CIPSSLCSNI
+
+###################################
+
+def sslConfig(bufSize: int, serverName: str) -> int:
+    # Sets the firmware's TLS buffer size (0 keeps the current one) and the
+    # server name sent as SNI on the next SSL connections (None: no SNI).
+    # The buffer size can be changed only while no SSL link is open.
+    global sslBufferSize
+
+    maintain()
+    if (not initialized()):
+        return False
+
+    if (bufSize and bufSize != sslBufferSize):
+        if (not EspAtDrv.caps.sslSize):
+            LOG_ERROR_PRINT("the firmware has no AT+CIPSSLSIZE\r\n")
+            EspAtDrv.lastErrorCode = EspAtDrv.Error_AT_ERROR
+            return False
+        cmdStart(b"AT+CIPSSLSIZE=")
+        cmdInt(bufSize)
+        if (sendCommand(None, True, False) == False):
+            return False
+        sslBufferSize = bufSize
+
+    EspAtDrv.sslServerName = serverName
+    return True
+
+def sslStatistics() -> tuple:
+    # (SSL connects, successful SSL connects, average ms of a successful handshake)
+    stats = EspAtDrv.sslStats
+    return (stats[0], stats[1], stats[2] // stats[1] if stats[1] else 0)
+
+def initialized() -> int:
+    # init() probed the firmware, the settings depend on its capabilities
+    if (EspAtDrv.caps == None):
+        LOG_ERROR_PRINT("AT firmware was not initialized\r\n")
+        EspAtDrv.lastErrorCode = EspAtDrv.Error_NOT_INITIALIZED
+        return False
+    return True
+
+def sendSni(linkId: int) -> int:
+    # False if the firmware wasn't initialized, a rejected SNI is only a warning
+    global sniSupported
+
+    if (not initialized()):
+        return False
+    if (not sniSupported or not EspAtDrv.caps.sni):
+        return True  # ESP_ATMod sends the host of AT+CIPSTART as SNI itself
+    cmdStart(b"AT+CIPSSLCSNI=")
+    cmdInt(linkId)
+    cmdAppend(b",")
+    cmdQuoted(EspAtDrv.sslServerName)
+    if (sendCommand(None, True, False) == False):
+        LOG_WARN_PRINT("SNI is not supported by the firmware\r\n")
+        sniSupported = False
+    return True
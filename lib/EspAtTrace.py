@@ -0,0 +1,107 @@
+# EspAtTrace.py
+#
+# Recording of the UART traffic with the AT firmware, loaded on first use
+#
+# EspAtDrv.record(stream) puts a RecordUART between the driver and the UART.
+# It logs every chunk the driver writes or reads with its time, so a trace of
+# a field problem can be replayed to the unmodified driver with
+# tools/replay.py on CPython.
+#
+# Trace format: the header b"EATR1\n", then records of
+#   kind    1 byte: REC_TX, REC_RX or REC_PROBE (the '?' probe, no data)
+#   dt      varint: ms since the previous record
+#   length  varint: bytes of data (not for REC_PROBE)
+#   data
+# Chunks of the same kind within MERGE_TIME ms are merged into one record.
+#
+# Version:
+#  0.1.0: initial version
+
+from micropython import const
+import utime
+
+TRACE_HEADER = b"EATR1\n"
+REC_TX = const(0x54)     # 'T', bytes written by the driver
+REC_RX = const(0x52)     # 'R', bytes read by the driver
+REC_PROBE = const(0x50)  # 'P', a '?' probe written by the driver
+MERGE_TIME = const(2)    # ms a record stays open for more chunks of the same kind
+MERGE_SIZE = const(1024) # record size closing the record
+
+class RecordUART:
+    def __init__(self, uart, stream):
+        self.uart = uart
+        self.stream = stream
+        self.kind = 0  # open record
+        self.data = bytearray()
+        self.start = utime.ticks_ms()  # of the open record
+        self.last = self.start  # start of the previous record
+        self.varBuf = bytearray(5)
+        stream.write(TRACE_HEADER)
+
+    # UART interface used by EspAtDrv
+
+    def any(self) -> int:
+        return self.uart.any()
+
+    def read(self, n: int = None):
+        b = self.uart.read() if n == None else self.uart.read(n)
+        if (b):
+            self.log(REC_RX, b)
+        return b
+
+    def readinto(self, buf, nbytes: int = None):
+        n = self.uart.readinto(buf) if nbytes == None else self.uart.readinto(buf, nbytes)
+        if (n):
+            self.log(REC_RX, buf[:n])
+        return n
+
+    def write(self, data) -> int:
+        n = self.uart.write(data)
+        if (data == b"?"):
+            self.log(REC_PROBE, None)
+        elif (n):
+            self.log(REC_TX, data[:n])
+        return n
+
+    # trace
+
+    def log(self, kind: int, data):
+        now = utime.ticks_ms()
+        if (kind != self.kind or kind == REC_PROBE or len(self.data) >= MERGE_SIZE
+                or utime.ticks_diff(now, self.start) > MERGE_TIME):
+            self.flush()
+            self.kind = kind
+            self.start = now
+        if (data):
+            self.data.extend(data)
+
+    def flush(self):
+        # writes the open record
+        if (not self.kind):
+            return
+        self.stream.write(bytes((self.kind,)))
+        self.writeVarint(utime.ticks_diff(self.start, self.last))
+        if (self.kind != REC_PROBE):
+            self.writeVarint(len(self.data))
+            self.stream.write(self.data)
+        self.last = self.start
+        self.kind = 0
+        self.data = bytearray()
+
+    def writeVarint(self, i: int):
+        n = 0
+        while True:
+            b = i & 0x7F
+            i >>= 7
+            self.varBuf[n] = b | 0x80 if i else b
+            n += 1
+            if (not i):
+                break
+        self.stream.write(self.varBuf[:n])
+
+    def stop(self):
+        # flushes the trace, returns the wrapped UART. the stream stays open
+        self.flush()
+        if (hasattr(self.stream, "flush")):
+            self.stream.flush()
+        return self.uart
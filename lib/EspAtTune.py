@@ -0,0 +1,224 @@
+# EspAtTune.py
+#
+# Throughput tuning of the driver, loaded on first use
+#
+# EspAtDrv.autotune(host, port) measures the driver's settings against a TCP
+# echo server (port 7 of a host on the LAN, or the emulator's EchoServer):
+#   baud         raised with AT+UART_CUR as long as the echo comes back intact
+#   recvSize     the AT+CIPRECVDATA request size with the best throughput
+#   syncInterval from the time of one link sync (AT+CIPSTATUS and
+#   statusMaxAge AT+CIPRECVLEN?), polling spends 1/SYNC_SHARE of the time on it
+# The result is applied and saved as JSON to EspAtDrv.profileFile, which
+# init() loads at the next start. The response deadlines (TIMEOUT and
+# CMD_TIMEOUTS) are not tuned, they follow the firmware's processing times.
+# setBaud() and loadProfile() are here too, EspAtDrv loads the module for
+# them only if a profile was saved, so the core stays free of the tuning.
+#
+# Version:
+#  0.1.0: initial version
+#  0.1.1: Error_NOT_INITIALIZED before init() instead of an exception
+#  0.2.0: setBaud() and loadProfile() moved from EspAtDrv
+
+from micropython import const
+import utime
+import EspAtDrv
+from EspAtDrv import cmdStart, cmdAppend, cmdInt, sendCommand, simpleCommand, openUART
+from EspAtDrv import LOG_INFO_PRINT, LOG_WARN_PRINT, LOG_ERROR_PRINT
+
+BAUD_RATES = (115200, 230400, 460800, 921600)
+RECV_SIZES = (256, 512, 1000, 2048)
+TEST_SIZE = const(4096)       # bytes echoed for the throughput
+LATENCY_SIZE = const(32)      # bytes echoed for the latency
+ECHO_TIMEOUT = const(5000)
+SETTLE_TIME = const(200)      # ms for late echo data after a failed measurement
+SYNC_COUNT = const(4)         # link syncs timed
+SYNC_SHARE = const(20)
+SYNC_INTERVAL_MIN = const(100)
+SYNC_INTERVAL_MAX = const(2000)
+
+results = []  # (baud, recvSize, B/s, latency ms) of the last autotune(), B/s 0 if it failed
+
+def autotune(host: str, port: int, save: bool = True) -> dict:
+    # returns the applied profile, None if the echo server isn't reachable
+    global results
+
+    results = []
+    if (not initialized()):
+        return None
+    linkId = EspAtDrv.connect("TCP", host, port)
+    if (linkId == EspAtDrv.NO_LINK):
+        LOG_ERROR_PRINT(f'autotune: no echo server at {host}:{port}\r\n')
+        return None
+    try:
+        profile = sweep(linkId)
+    finally:
+        EspAtDrv.close(linkId, False)
+    if (profile == None):
+        return None
+
+    EspAtDrv.tunedBaud = profile["baud"]
+    EspAtDrv.recvSize = profile["recvSize"]
+    EspAtDrv.syncInterval = profile["syncInterval"]
+    EspAtDrv.statusMaxAge = profile["statusMaxAge"]
+    if (save):
+        import json
+        with open(EspAtDrv.profileFile, "w") as f:
+            json.dump(profile, f)
+    LOG_INFO_PRINT(f'autotune: {profile}\r\n')
+    return profile
+
+def setBaud(baud: int) -> int:
+    # Switches the firmware and the UART to baud with AT+UART_CUR, checked
+    # with 'AT'. On failure both go back to the previous rate.
+    old = EspAtDrv.uartBaud
+    if (baud == old):
+        return True
+    if (EspAtDrv.caps == None or not EspAtDrv.caps.uartCur):
+        LOG_ERROR_PRINT("AT+UART_CUR not supported\r\n")
+        EspAtDrv.lastErrorCode = EspAtDrv.Error_AT_ERROR
+        return False
+
+    cmdStart(b"AT+UART_CUR=")
+    cmdInt(baud)
+    cmdAppend(b",8,1,0,0")
+    if (not sendCommand(None, True, False)):
+        return False
+    openUART(baud)
+    utime.sleep_ms(5)  # the firmware switches after the OK
+    for i in range(EspAtDrv.RESYNC_COUNT):
+        if (simpleCommand(b"AT")):
+            LOG_INFO_PRINT(f'UART at {baud} Bd\r\n')
+            return True
+
+    LOG_WARN_PRINT(f'no response at {baud} Bd\r\n')
+    for i in range(EspAtDrv.RESYNC_COUNT):  # garbled, but it may understand a command
+        cmdStart(b"AT+UART_CUR=")
+        cmdInt(old)
+        cmdAppend(b",8,1,0,0")
+        if (sendCommand(None, True, False)):
+            break
+    openUART(old)
+    utime.sleep_ms(5)
+    uart = EspAtDrv.espUART
+    while (uart.any()):
+        uart.read()
+    EspAtDrv.wedged = not simpleCommand(b"AT")  # else the watchdog's reset restores the rate
+    EspAtDrv.lastErrorCode = EspAtDrv.Error_AT_NOT_RESPONDING
+    return False
+
+def loadProfile() -> int:
+    # the settings of EspAtDrv.profileFile saved by autotune(), if there is one
+    try:
+        f = open(EspAtDrv.profileFile)
+    except OSError:
+        return False
+    import json
+    with f:
+        try:
+            profile = json.load(f)
+        except ValueError:
+            LOG_ERROR_PRINT(f'invalid profile {EspAtDrv.profileFile}\r\n')
+            return False
+    EspAtDrv.tunedBaud = profile.get("baud", EspAtDrv.UART_BAUD)
+    EspAtDrv.recvSize = profile.get("recvSize", EspAtDrv.RECV_SIZE)
+    EspAtDrv.syncInterval = profile.get("syncInterval", EspAtDrv.SYNC_INTERVAL)
+    EspAtDrv.statusMaxAge = profile.get("statusMaxAge", EspAtDrv.STATUS_MAX_AGE)
+    LOG_INFO_PRINT(f'profile {EspAtDrv.profileFile}: {profile}\r\n')
+    return True
+
+def initialized() -> int:
+    # init() probed the firmware, the sweep needs its capabilities
+    if (EspAtDrv.caps == None):
+        LOG_ERROR_PRINT("AT firmware was not initialized\r\n")
+        EspAtDrv.lastErrorCode = EspAtDrv.Error_NOT_INITIALIZED
+        return False
+    return True
+
+def sweep(linkId: int) -> dict:
+    if (not initialized()):
+        return None
+    pattern = bytearray(TEST_SIZE)
+    for i in range(TEST_SIZE):
+        pattern[i] = i & 255
+    pattern = bytes(pattern)
+
+    # baud rates in rising order until the echo fails
+    best = (EspAtDrv.uartBaud, 0, 0)
+    bauds = BAUD_RATES if EspAtDrv.caps.uartCur else (EspAtDrv.uartBaud,)
+    for baud in bauds:
+        if (not setBaud(baud)):
+            break
+        rate, latency = measure(linkId, pattern)
+        if (rate == 0):
+            break  # errors at this rate, the higher ones are worse
+        if (rate > best[1]):
+            best = (baud, rate, latency)
+    if (not setBaud(best[0])):
+        return None
+    baud = best[0]
+
+    # receive sizes at that rate
+    best = (EspAtDrv.recvSize, best[1], best[2])
+    for size in RECV_SIZES:
+        EspAtDrv.recvSize = size
+        rate, latency = measure(linkId, pattern)
+        if (rate > best[1]):
+            best = (size, rate, latency)
+    EspAtDrv.recvSize = best[0]
+    if (best[1] == 0):
+        LOG_ERROR_PRINT("autotune: no measurement succeeded\r\n")
+        return None
+
+    # link syncs of the polling at that rate
+    t = utime.ticks_us()
+    for i in range(SYNC_COUNT):
+        if (EspAtDrv.statusSnapshot(0) < 0 or not EspAtDrv.recvLenQuery()):
+            return None
+    t = utime.ticks_diff(utime.ticks_us(), t) // (SYNC_COUNT * 1000)
+    interval = min(max(t * SYNC_SHARE, SYNC_INTERVAL_MIN), SYNC_INTERVAL_MAX)
+
+    return {"baud": baud, "recvSize": best[0], "syncInterval": interval,
+            "statusMaxAge": interval, "rate": best[1], "latency": best[2]}
+
+def measure(linkId: int, pattern: bytes) -> tuple:
+    # B/s of echoing the pattern and ms of a LATENCY_SIZE echo, (0, 0) on errors
+    t = utime.ticks_ms()
+    ok = echo(linkId, pattern[:LATENCY_SIZE])
+    latency = utime.ticks_diff(utime.ticks_ms(), t)
+    t = utime.ticks_ms()
+    ok = ok and echo(linkId, pattern)
+    rate = len(pattern) * 1000 // max(utime.ticks_diff(utime.ticks_ms(), t), 1) if ok else 0
+    if (not ok):
+        latency = 0
+        utime.sleep_ms(SETTLE_TIME)
+        while (EspAtDrv.recvLenQuery() and EspAtDrv.linkInfo[linkId].avail):
+            if (not EspAtDrv.recvData(linkId, EspAtDrv.maxSendSize)):
+                break
+    results.append((EspAtDrv.uartBaud, EspAtDrv.recvSize, rate, latency))
+    LOG_INFO_PRINT(f'autotune: {EspAtDrv.uartBaud} Bd, recv {EspAtDrv.recvSize}: '
+                            f'{rate} B/s, {latency} ms\r\n')
+    return rate, latency
+
+def echo(linkId: int, data: bytes) -> int:
+    # sends data and reads it back, False if it doesn't come back intact
+    mv = memoryview(data)
+    pos = 0
+    while (pos < len(data)):
+        n = EspAtDrv.sendData(linkId, mv[pos:pos + EspAtDrv.maxSendSize])
+        if (n == 0):
+            return False
+        pos += n
+
+    deadline = utime.ticks_add(utime.ticks_ms(), ECHO_TIMEOUT)
+    pos = 0
+    while (pos < len(data)):
+        if (utime.ticks_diff(deadline, utime.ticks_ms()) <= 0):
+            return False
+        if (EspAtDrv.availData(linkId) == 0):
+            utime.sleep_ms(1)
+            continue
+        b = EspAtDrv.recvData(linkId)
+        if (b != data[pos:pos + len(b)]):
+            return False
+        pos += len(b)
+    return True
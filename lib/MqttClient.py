@@ -0,0 +1,315 @@
+# MqttClient.py
+#
+# MQTT 3.1.1 client over WiFi.Client
+#
+# Outgoing packets are coalesced and handed to the ESP in full AT+CIPSEND
+# segments instead of one stop-and-wait send per packet. QoS 1 publishes
+# are pipelined with a bounded window of unacknowledged packets.
+# loop() has to be called regularly. It flushes coalesced packets, handles
+# incoming packets, keepalive and retransmissions, and never waits for the
+# network.
+#
+# Version:
+#  0.1.0: initial version
+#  0.1.1: a busy firmware holds packets back instead of dropping the connection
+#  0.1.2: segments of the firmware's maximum send size
+
+from micropython import const
+import utime
+import EspAtDrv
+import WiFi
+
+CONNECT = const(0x10)
+CONNACK = const(0x20)
+PUBLISH = const(0x30)
+PUBACK = const(0x40)
+SUBSCRIBE = const(0x82)
+SUBACK = const(0x90)
+UNSUBSCRIBE = const(0xA2)
+UNSUBACK = const(0xB0)
+PINGREQ = const(0xC0)
+PINGRESP = const(0xD0)
+DISCONNECT = const(0xE0)
+
+PUBLISH_DUP = const(0x08)
+PUBLISH_QOS1 = const(0x02)
+PUBLISH_RETAIN = const(0x01)
+
+FLUSH_DELAY = const(20)       # ms a partial segment may wait for more packets
+RETRY_TIMEOUT = const(5000)   # ms until an unacknowledged QoS 1 publish is sent again
+CONNECT_TIMEOUT = const(5000)
+
+###################################
+
+class MqttClient:
+    def __init__(self, clientId: str, keepAlive: int = 60, window: int = 8,
+                 user: str = None, password: str = None):
+        self.clientId = clientId
+        self.keepAlive = keepAlive  # in seconds, 0 disables PINGREQ
+        self.window = window  # maximum of unacknowledged QoS 1 publishes
+        self.user = user
+        self.password = password
+        self.cli = WiFi.Client()
+        self.isConnected = False
+        self.out = bytearray()  # coalesced packets not handed to the client yet
+        self.outSince = 0  # ticks of the oldest packet in out
+        self.inBuf = bytearray()
+        self.inflight = {}  # packet id -> [ticks sent, topic, message, retain]
+        self.nextId = 0
+        self.lastTx = 0
+        self.pingSent = 0  # ticks of the outstanding PINGREQ, 0 if none
+        self.connack = -1
+        self.callback = None
+
+    def setCallback(self, callback):
+        # callback(topic: str, message: bytes) is called for received publishes
+        self.callback = callback
+
+    def connect(self, host: str, port: int = 1883, ssl: bool = False, cleanSession: bool = True) -> int:
+        if (not (self.cli.connectSSL(host, port) if ssl else self.cli.connect(host, port))):
+            return False
+
+        flags = 0x02 if cleanSession else 0
+        body = bytearray(b'\x00\x04MQTT\x04')
+        if (self.user):
+            flags |= 0x80
+        if (self.password):
+            flags |= 0x40
+        body.append(flags)
+        body.append(self.keepAlive >> 8)
+        body.append(self.keepAlive & 255)
+        _appendStr(body, self.clientId)
+        if (self.user):
+            _appendStr(body, self.user)
+        if (self.password):
+            _appendStr(body, self.password)
+
+        self.out = bytearray()
+        self.inBuf = bytearray()
+        self.connack = -1
+        self._packet(CONNECT, body)
+        if (not self.flush()):
+            return False
+
+        t = utime.ticks_ms()
+        while (self.connack < 0 and utime.ticks_diff(utime.ticks_ms(), t) < CONNECT_TIMEOUT):
+            if (not self._receive()):
+                break
+            utime.sleep_ms(1)
+
+        if (self.connack != 0):
+            EspAtDrv.LOG_ERROR_PRINT(f'MQTT connect refused ({self.connack})\r\n')
+            self.cli.stop()
+            return False
+
+        self.isConnected = True
+        self.pingSent = 0
+        for entry in self.inflight.values():  # session continues, resend unacknowledged
+            entry[0] = utime.ticks_add(utime.ticks_ms(), -RETRY_TIMEOUT)
+        return True
+
+    def publish(self, topic: str, message: bytes, qos: int = 0, retain: bool = False) -> int:
+        # Returns the packet id of a QoS 1 publish, 0 for QoS 0 and -1 if the
+        # publish can't be queued now (not connected or the QoS 1 window is full).
+        if (not self.isConnected):
+            return -1
+
+        pid = 0
+        if (qos):
+            if (len(self.inflight) >= self.window):
+                self.flush()  # the window is full, acks can come only for sent packets
+                return -1
+            pid = self._packetId()
+            self.inflight[pid] = [utime.ticks_ms(), topic, message, retain]
+
+        self._publish(topic, message, pid, retain, False)
+        return pid
+
+    def subscribe(self, topic: str, qos: int = 0) -> int:
+        if (not self.isConnected):
+            return -1
+
+        pid = self._packetId()
+        body = bytearray((pid >> 8, pid & 255))
+        _appendStr(body, topic)
+        body.append(min(qos, 1))  # QoS 2 is not supported
+        self._packet(SUBSCRIBE, body)
+        self.flush()
+        return pid
+
+    def unsubscribe(self, topic: str) -> int:
+        if (not self.isConnected):
+            return -1
+
+        pid = self._packetId()
+        body = bytearray((pid >> 8, pid & 255))
+        _appendStr(body, topic)
+        self._packet(UNSUBSCRIBE, body)
+        self.flush()
+        return pid
+
+    def pending(self) -> int:
+        # number of unacknowledged QoS 1 publishes
+        return len(self.inflight)
+
+    def loop(self) -> int:
+        if (not self.isConnected):
+            return False
+        if (not self._receive()):
+            self._lost()
+            return False
+
+        now = utime.ticks_ms()
+        if ((self.out and (utime.ticks_diff(now, self.outSince) >= FLUSH_DELAY
+                           or len(self.inflight) >= self.window))
+                or self.cli.availableForWrite() < EspAtDrv.maxSendSize):  # held back by a busy firmware
+            self.flush()
+
+        for pid, entry in self.inflight.items():
+            if (utime.ticks_diff(now, entry[0]) >= RETRY_TIMEOUT):
+                entry[0] = now
+                self._publish(entry[1], entry[2], pid, entry[3], True)
+
+        if (self.keepAlive):
+            if (self.pingSent):
+                if (utime.ticks_diff(now, self.pingSent) >= self.keepAlive * 1000):
+                    EspAtDrv.LOG_ERROR_PRINT("MQTT broker not responding\r\n")
+                    self._lost()
+                    return False
+            elif (utime.ticks_diff(now, self.lastTx) >= self.keepAlive * 500):
+                self._packet(PINGREQ, b'')
+                self.pingSent = now
+                self.flush()
+
+        return self.isConnected
+
+    def flush(self) -> int:
+        # hands all coalesced packets to the ESP
+        while True:
+            if (not self._push(min(len(self.out), EspAtDrv.maxSendSize))):
+                return False
+            if (not self.out):
+                return True
+
+    def disconnect(self):
+        if (self.isConnected):
+            self._packet(DISCONNECT, b'')
+            self.flush()
+        self.isConnected = False
+        self.cli.stop()
+
+    def _packetId(self) -> int:
+        while True:
+            self.nextId = self.nextId % 65535 + 1
+            if (self.nextId not in self.inflight):
+                return self.nextId
+
+    def _publish(self, topic: str, message: bytes, pid: int, retain: bool, dup: bool):
+        header = PUBLISH
+        if (pid):
+            header |= PUBLISH_QOS1
+        if (retain):
+            header |= PUBLISH_RETAIN
+        if (dup):
+            header |= PUBLISH_DUP
+
+        topic = topic.encode()
+        self._header(header, 2 + len(topic) + (2 if pid else 0) + len(message))
+        _appendStr(self.out, topic)
+        if (pid):
+            self.out.append(pid >> 8)
+            self.out.append(pid & 255)
+        self.out.extend(message)
+        self._queued()
+
+    def _packet(self, header: int, body: bytes):
+        self._header(header, len(body))
+        self.out.extend(body)
+        self._queued()
+
+    def _header(self, header: int, length: int):
+        if (not self.out):
+            self.outSince = utime.ticks_ms()
+        out = self.out
+        out.append(header)
+        while True:  # remaining length, 7 bits per byte
+            b = length & 0x7F
+            length >>= 7
+            out.append(b | 0x80 if length else b)
+            if (not length):
+                break
+
+    def _queued(self):
+        self.lastTx = utime.ticks_ms()
+        while (len(self.out) >= EspAtDrv.maxSendSize):  # a full segment is ready
+            if (not self._push(EspAtDrv.maxSendSize)):
+                break
+
+    def _push(self, n: int) -> int:
+        del self.out[:self.cli.write(self.out[:n])]
+        if (not self.cli.flush()):
+            if (EspAtDrv.getLastErrorCode() == EspAtDrv.Error_BUSY):
+                return False  # the client keeps the data, loop() sends them later
+            EspAtDrv.LOG_ERROR_PRINT("MQTT send failed\r\n")
+            self._lost()
+            return False
+        self.outSince = utime.ticks_ms()
+        return True
+
+    def _lost(self):
+        self.isConnected = False
+        self.out = bytearray()
+        self.cli.stop()
+
+    def _receive(self) -> int:
+        # reads what is available and processes all complete packets
+        if (not self.cli.connected()):
+            return False
+        n = self.cli.available()
+        if (n > 0):
+            self.inBuf.extend(self.cli.readBuf(n))
+
+        buf = self.inBuf
+        while (len(buf) >= 2):
+            length = 0
+            shift = 0
+            pos = 1
+            while True:
+                if (pos >= len(buf)):
+                    return True  # incomplete remaining length
+                b = buf[pos]
+                length |= (b & 0x7F) << shift
+                shift += 7
+                pos += 1
+                if (not (b & 0x80)):
+                    break
+            if (len(buf) < pos + length):
+                return True  # incomplete packet
+            self._dispatch(buf[0], memoryview(buf)[pos:pos + length])
+            del buf[:pos + length]
+        return True
+
+    def _dispatch(self, header: int, body: memoryview):
+        type = header & 0xF0
+        if (type == PUBLISH):
+            topicLen = (body[0] << 8) | body[1]
+            topic = bytes(body[2:2 + topicLen]).decode()
+            pos = 2 + topicLen
+            if (header & PUBLISH_QOS1):
+                pid = (body[pos] << 8) | body[pos + 1]
+                pos += 2
+                self._packet(PUBACK, bytes((pid >> 8, pid & 255)))
+            if (self.callback):
+                self.callback(topic, bytes(body[pos:]))
+        elif (type == PUBACK):
+            self.inflight.pop((body[0] << 8) | body[1], None)
+        elif (type == CONNACK):
+            self.connack = body[1]
+        elif (type == PINGRESP):
+            self.pingSent = 0
+
+def _appendStr(buf: bytearray, s: str):
+    b = s.encode() if isinstance(s, str) else s
+    buf.append(len(b) >> 8)
+    buf.append(len(b) & 255)
+    buf.extend(b)
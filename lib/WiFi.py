@@ -4,9 +4,31 @@
 #
 # Version:
 #  0.1.0: initial version
+#  0.2.0: rejoin AP and re-establish client links after a firmware recovery
+#  0.3.0: query results from EspAtParse records, Client.remoteIp/remotePort/localPort
+#  0.4.0: Client.write for binary data, flush in AT+CIPSEND sized segments
+#  0.5.0: Client.copyTo streams received data through a fixed buffer
+#  0.6.0: soft AP with beginAP/endAP and the list of connected stations
+#  0.7.0: SSL configuration and statistics, prewarmed SSL links, Client.connectTime
+#  0.8.0: bounded Client transmit buffer, write() returns less while the firmware is busy
+#  0.9.0: Client.readline/readuntil and line iteration
+#  0.10.0: static IP and DNS with config() and setDns()
+#  0.11.0: soft AP, query and SSL modules of the driver imported on first use
+#  0.12.0: firmwareVersion(), Client transmit buffer of the firmware's maximum send size
+#  0.13.0: Client priorities, bulk clients served in slices with setSliceCallback() in between
+#  0.14.0: Client.readinto
+#  0.15.0: setPowerProfile()
+#  0.16.0: Client data in blocks of the driver's buffer pool, poolStatistics()
+#  0.16.1: status() reports a lost station also while the soft AP runs
+#  0.16.2: availableForWrite() within the room of the buffer pool
+#  0.16.3: EspAtPool loaded by the first connect
+#  0.16.4: peek() receives one byte unbuffered if the pool has no block for the link
+#  0.16.5: readuntil() returns None instead of a partial line if the link is over its pool share
 
 from micropython import const
+import utime
 import EspAtDrv
+import EspAtParse
 
 WL_NO_SHIELD = const(255)
 WL_NO_MODULE = WL_NO_SHIELD
@@ -19,15 +41,40 @@ WL_AP_LISTENING = const(5)
 WL_AP_CONNECTED = const(6)
 WL_AP_FAILED = const(7)
 
+RX_CHUNK_SIZE = const(2048)   # most bytes asked with one AT+CIPRECVDATA into the receive queue
+
 ###################################
 
+class _NoQueue:
+    # the receive and transmit queue of a client until its first connect,
+    # _attach() loads EspAtPool and creates its queues then
+    n = 0
+
+    def clear(self):
+        pass
+
+    def find(self, delim: bytes, start: int = 0, end: int = None) -> int:
+        return -1
+
+    def take(self, n: int) -> bytes:
+        return b''
+
+noQueue = _NoQueue()
+
 class Client:
     def __init__(self):
         self.linkId  = EspAtDrv.NO_LINK
         self.port = 0
         self.assigned = False
-        self.rxBuffer = b''
-        self.txBuffer = b''
+        self.rx = noQueue  # data fetched but not read yet, EspAtPool.BlockQueue
+        self.tx = noQueue  # data written but not sent yet
+        self.peeked = -1  # the byte peek() received while the pool had no block for the link
+        self.protocol = None  # remote endpoint of the last connect
+        self.host = None
+        self.recoverCallback = None
+        self.copyRate = 0  # bytes/s of the last copyTo()
+        self.copyDigest = None  # CRC32 (int) or SHA-256 (bytes) of the last copyTo()
+        self.priority = EspAtDrv.PRIORITY_NORMAL
 
     def connect(self, host: str, port: int) -> int:
         return self.connectInternal("TCP", host, port)
@@ -38,19 +85,59 @@ class Client:
     def connectInternal(self, protocol: str, host: str, port: int) -> int:
         global clientPool
         
-        linkId = EspAtDrv.connect(protocol, host, port)
+        linkId = _prewarmedLink(protocol, host, port)
+        if (linkId == EspAtDrv.NO_LINK):
+            linkId = EspAtDrv.connect(protocol, host, port)
         if (linkId == EspAtDrv.NO_LINK):
             return False;
 
+        self._attach(linkId, protocol, host, port)
+
+        EspAtDrv.LOG_INFO_PRINT();
+        EspAtDrv.LOG_INFO_PRINT(f'Connected {host} at port {port} and client\'s linkId {linkId}\r\n')
+
+        return True
+
+    def _attach(self, linkId: int, protocol: str, host: str, port: int):
+        global clientPool
+        
         self.linkId = linkId
         self.port = port
+        self.protocol = protocol
+        self.host = host
         self.assigned = True
+        pool = EspAtDrv.bufferPool()
+        if (self.rx is noQueue):
+            import EspAtPool
+            self.rx = EspAtPool.BlockQueue(pool)
+            self.tx = EspAtPool.BlockQueue(pool)
+        self.rx.clear()
+        self.tx.clear()
+        self.peeked = -1
+        self.rx.owner = linkId  # the queues take their blocks in the link's share
+        self.tx.owner = linkId
+        pool.attach(linkId)
         clientPool[linkId] = self
+        EspAtDrv.setLinkPriority(linkId, self.priority)
 
-        EspAtDrv.LOG_INFO_PRINT();
-        EspAtDrv.LOG_INFO_PRINT(f'Connected {host} at port {port} and client\'s linkId {linkId}\r\n')
+    def setPriority(self, priority: int):
+        # EspAtDrv.PRIORITY_BULK splits the transfers of the client in slices,
+        # between them the slice callback serves the PRIORITY_INTERACTIVE clients
+        self.priority = priority
+        if (self.linkId != EspAtDrv.NO_LINK):
+            EspAtDrv.setLinkPriority(self.linkId, priority)
 
-        return True
+    def connectTime(self) -> int:
+        # ms the last connect took, for SSL including the handshake (0 for a prewarmed link)
+        if (self.linkId == EspAtDrv.NO_LINK):
+            return 0
+        return EspAtDrv.linkInfo[self.linkId].connectTime
+
+    def onRecover(self, callback):
+        # After a reset of a not responding firmware the client is connected again
+        # to the same endpoint and callback(client, ok) is called. Clients without
+        # the callback are only closed.
+        self.recoverCallback = callback
 
     def connected(self) -> int:
         if (self.linkId == EspAtDrv.NO_LINK):
@@ -66,12 +153,23 @@ class Client:
         self.flush()
         self.abort()
 
-    def flush(self):
+    def flush(self) -> int:
+        # Sends the buffered data. If the firmware stays busy, the data not sent
+        # are kept for the next flush(), on other errors they are dropped.
+        ok = True
         if (self.linkId != EspAtDrv.NO_LINK):
-            if (self.txBuffer):
-                EspAtDrv.sendData(self.linkId, self.txBuffer)
-                # TODO: check all the data has been sent
-        self.txBuffer = b''
+            slice = EspAtDrv.sliceSize(self.linkId)  # at most maxSendSize
+            while (self.tx.n):
+                n = EspAtDrv.sendData(self.linkId, self.tx.views(slice))  # one segment from the blocks
+                if (n == 0):
+                    ok = False
+                    break
+                self.tx.skip(n)
+                if (self.tx.n):
+                    EspAtDrv.sliceDone(self.linkId)
+        if (ok or EspAtDrv.getLastErrorCode() != EspAtDrv.Error_BUSY):
+            self.tx.clear()
+        return ok
 
     def abort(self):
         if (self.linkId != EspAtDrv.NO_LINK):
@@ -86,11 +184,53 @@ class Client:
         if (len(data) == 0):
             return 0
 
-        self.txBuffer += data.encode()  # copy data to internal buffer - only utf-8 supported
-        return len(self.txBuffer)
+        return self.write(data.encode())  # only utf-8 supported
+
+    def write(self, data: bytes) -> int:
+        if (self.linkId == EspAtDrv.NO_LINK):
+            return 0
+
+        # Data are buffered up to one AT+CIPSEND segment of the firmware
+        # (EspAtDrv.maxSendSize), a full buffer is sent first. If
+        # the firmware is busy and the buffer can't be sent, only the part which
+        # fits is taken and the returned count is less than len(data). Whole
+        # segments are sent from data without the copy into the buffer pool, and
+        # if the pool has no block for the link, the data are sent unbuffered.
+        mv = memoryview(data)
+        n = 0
+        while (n < len(mv)):
+            if (self.tx.n == 0 and len(mv) - n >= EspAtDrv.maxSendSize):
+                k = EspAtDrv.sendData(self.linkId, mv[n:n + EspAtDrv.sliceSize(self.linkId)])
+                n += k
+                if (k):
+                    EspAtDrv.sliceDone(self.linkId)
+                    continue
+                if (EspAtDrv.getLastErrorCode() == EspAtDrv.Error_BUSY):
+                    n += self.tx.put(mv[n:n + EspAtDrv.maxSendSize])  # sent by the next flush()
+                break
+            room = EspAtDrv.maxSendSize - self.tx.n
+            k = self.tx.put(mv[n:n + room]) if room else 0  # sent by flush()
+            n += k
+            if (k):
+                continue
+            if (self.tx.n):
+                if (not self.flush()):
+                    break
+                continue
+            k = EspAtDrv.sendData(self.linkId, mv[n:n + EspAtDrv.maxSendSize])
+            if (k == 0):
+                break
+            n += k
+        return n
+
+    def availableForWrite(self) -> int:
+        # bytes write() takes without sending, as far as the buffer pool has room
+        if (self.linkId == EspAtDrv.NO_LINK):
+            return 0
+        return min(EspAtDrv.maxSendSize - self.tx.n, self.tx.room())
 
     def available(self) -> int:
-        avail = len(self.rxBuffer)
+        avail = self.rx.n + (1 if self.peeked >= 0 else 0)
         if (self.linkId == EspAtDrv.NO_LINK):
             return avail;
 
@@ -105,6 +245,10 @@ class Client:
     def read(self) -> int:
         if (self.linkId == EspAtDrv.NO_LINK):
             return -1
+        if (self.rx.n):
+            b = self.rx.peek()
+            self.rx.skip(1)
+            return b
         if (self.available() == 0):
             return -1;
 
@@ -118,39 +262,199 @@ class Client:
         if (size == 0 or self.available() == 0):
             return b''
 
-        # copy from internal buffer
-        if (len(self.rxBuffer) == 0):
-            self.rxBuffer = EspAtDrv.recvData(self.linkId)  # TODO: max buffer size
+        if (self.peeked >= 0):
+            b = bytes((self.peeked,))
+            self.peeked = -1
+            return b + self.readBuf(size - 1)
 
-        b = self.rxBuffer[:size]
-        self.rxBuffer = self.rxBuffer[size:]
+        if (self.rx.n == 0 and self._fill() == 0):  # no block from the pool
+            return EspAtDrv.recvData(self.linkId, min(size, EspAtDrv.recvSize))
 
+        b = self.rx.take(size)
         if (len(b) >= size):  # the buffer was filled
             return b
         
         return b + self.readBuf(size - len(b))  # handle the rest of provided buffer
 
+    def _fill(self) -> int:
+        # Fetches available data into the receive queue, returns the count. 0 if
+        # the link is over its share of the buffer pool, then it gets no more
+        # data until the application has read some.
+        room = self.rx.reserve(min(max(EspAtDrv.linkInfo[self.linkId].avail, 1), RX_CHUNK_SIZE))
+        if (room == None):
+            return 0
+        n = EspAtDrv.recvDataInto(self.linkId, room)
+        self.rx.commit(n)
+        return n
+
+    def readinto(self, buf) -> int:
+        # Reads the available data, up to len(buf) bytes, into buf (a bytearray
+        # or memoryview). Returns the count, 0 if no data are available.
+        if (len(buf) == 0 or self.available() == 0):
+            return 0
+        if (self.peeked >= 0):
+            buf[0] = self.peeked
+            self.peeked = -1
+            return 1
+        if (self.rx.n):  # data already fetched by peek(), readBuf() or readuntil()
+            return self.rx.get(buf)
+        mv = memoryview(buf)
+        return EspAtDrv.recvDataInto(self.linkId, mv[:min(len(mv), EspAtDrv.sliceSize(self.linkId))])
+
+    def copyTo(self, stream, length: int = None, bufsize: int = 1024,
+               digest: str = None, timeout: int = 5000) -> int:
+        # Copies received data to stream.write() until length bytes are copied or,
+        # if length is None, until the link is closed. Data go through one buffer of
+        # bufsize bytes, so memory use doesn't depend on the size of the download.
+        # digest 'crc32' or 'sha256' is computed on the fly into copyDigest.
+        # Returns the number of copied bytes, stops after timeout ms without data.
+        buf = bytearray(bufsize)
+        mv = memoryview(buf)
+        crc = 0
+        sha = None
+        if (digest == "crc32"):
+            import binascii
+        elif (digest == "sha256"):
+            import hashlib
+            sha = hashlib.sha256()
+
+        total = 0
+        start = utime.ticks_ms()
+        last = start
+        while (length is None or total < length):
+            want = bufsize if length is None else min(bufsize, length - total)
+            if (self.rx.n or self.peeked >= 0):  # data already fetched by peek(), readBuf() or readuntil()
+                n = self.readinto(mv[:want])
+            elif (self.linkId == EspAtDrv.NO_LINK):
+                break
+            elif (EspAtDrv.availData(self.linkId) == 0):
+                if (not EspAtDrv.connected(self.linkId)):
+                    _clientFree(self)  # closed and all data read
+                    break
+                if (utime.ticks_diff(utime.ticks_ms(), last) > timeout):
+                    break
+                utime.sleep_ms(1)
+                continue
+            else:
+                n = EspAtDrv.recvDataInto(self.linkId, mv[:min(want, EspAtDrv.sliceSize(self.linkId))])
+                if (n == 0):
+                    break
+                EspAtDrv.sliceDone(self.linkId)
+
+            chunk = mv[:n]
+            stream.write(chunk)
+            if (sha):
+                sha.update(chunk)
+            elif (digest):
+                crc = binascii.crc32(chunk, crc)
+            total += n
+            last = utime.ticks_ms()
+
+        t = utime.ticks_diff(utime.ticks_ms(), start)
+        self.copyRate = total * 1000 // t if t > 0 else 0
+        self.copyDigest = sha.digest() if sha else (crc if digest else None)
+        return total
+
+    def readuntil(self, delim: bytes = b'\n', limit: int = 256, timeout: int = 1000) -> bytes:
+        # Returns the received data up to and including delim, but at most limit
+        # bytes. delim is searched in the data already received, more data are
+        # fetched into the receive queue only if it is not there. Less data
+        # without delim are returned if the link is closed or no data come for
+        # timeout ms. b'' means all data were read. None means the link is over
+        # its share of the buffer pool before delim came, the data stay queued
+        # for the next call (limit should fit in the share, readBuf() takes them).
+        if (self.peeked >= 0):  # goes first into the queue
+            if (self.rx.put(bytes((self.peeked,))) == 0):
+                return None
+            self.peeked = -1
+        start = 0  # where the search continues after more data came
+        last = utime.ticks_ms()
+        while True:
+            i = self.rx.find(delim, start, limit)
+            if (i >= 0):
+                n = i + len(delim)
+                break
+            n = self.rx.n
+            if (n >= limit):
+                n = limit
+                break
+            if (self.linkId == EspAtDrv.NO_LINK):
+                break
+            start = n - len(delim) + 1 if n >= len(delim) else 0
+            if (EspAtDrv.availData(self.linkId)):
+                if (self._fill() == 0):
+                    return None
+                last = utime.ticks_ms()
+            elif (not EspAtDrv.connected(self.linkId)
+                  or utime.ticks_diff(utime.ticks_ms(), last) > timeout):
+                break
+            else:
+                self.flush()  # maybe the peer waits for a request not flushed yet
+                utime.sleep_ms(1)
+
+        return self.rx.take(n)
+
+    def readline(self, limit: int = 256) -> bytes:
+        # a line with its b'\n', None while it doesn't fit in the pool share (see readuntil)
+        return self.readuntil(b'\n', limit)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        # iterates the received lines until the link is closed or the data stop coming,
+        # or the next line doesn't fit in the pool share (None from readline())
+        line = self.readline()
+        if (not line):
+            raise StopIteration
+        return line
+
     def peek(self) -> int:
-        if (self.linkId == EspAtDrv.NO_LINK or self.available == 0):
+        if (self.peeked >= 0):
+            return self.peeked
+        if (self.linkId == EspAtDrv.NO_LINK or self.available() == 0):
             return -1
 
-        # copy from internal buffer
-        if (len(self.rxBuffer) == 0):
-            self.rxBuffer = EspAtDrv.recvData(self.linkId)  # TODO: max buffer size
+        if (self.rx.n == 0 and self._fill() == 0):
+            # no block from the pool, the byte is received unbuffered as by read()
+            b = EspAtDrv.recvData(self.linkId, 1)
+            if (len(b) < 1):
+                return -1
+            self.peeked = b[0]
+            return self.peeked
 
-        return self.rxBuffer[0]
+        return self.rx.peek()
+
+
+    def remoteIp(self) -> str:
+        st = self._linkStatus()
+        return EspAtParse.ipStr(st.remoteIp) if st else None
+
+    def remotePort(self) -> int:
+        st = self._linkStatus()
+        return st.remotePort if st else 0
+
+    def localPort(self) -> int:
+        st = self._linkStatus()
+        return st.localPort if st else 0
+
+    def _linkStatus(self) -> EspAtParse.LinkStatus:
+        if (self.linkId == EspAtDrv.NO_LINK):
+            return None
+        return EspAtDrv.linkStatusQuery(self.linkId)
 
-        
 # TODO
 #    def status(self) -> int:
-#    def remoteIp(self):
-#    def remotePort(self):
-#    def localPort(self):
         
 ###################################
 
 clientPool = []
 state = WL_NO_MODULE
+joinArgs = None  # arguments of the last begin(), to rejoin after a firmware reset
+ipArgs = None  # static IP of the last config(), set again after a firmware reset
+dnsArgs = None  # static DNS servers of the last config() or setDns()
+prewarmed = []  # Clients holding SSL links opened by prewarmSSL() until a connectSSL() takes them
+sliceCallback = None  # the application's callback between the slices of bulk transfers
     
 def init(resetType: int = EspAtDrv.WIFI_SOFT_RESET) -> int:
     global clientPool, state
@@ -158,20 +462,75 @@ def init(resetType: int = EspAtDrv.WIFI_SOFT_RESET) -> int:
     for i in range(EspAtDrv.LINKS_COUNT):
         clientPool.append(Client())
         
+    EspAtDrv.setRecoveryCallback(_recovered)
+    EspAtDrv.setSliceCallback(_slice)
     ok = EspAtDrv.init(resetType)
     state = WL_NO_MODULE if ok == False else WL_IDLE_STATUS
     return ok
         
 def _clientFree(cli: Client):
+    if (cli.assigned):
+        EspAtDrv.pool.detach(cli.rx.owner)
     cli.linkId = EspAtDrv.NO_LINK
     cli.assigned = False
     cli.port = 0
-    cli.rxBuffer = b''
-    cli.txBuffer = b''
+    cli.peeked = -1
+    cli.rx.clear()  # the blocks go back to the pool
+    cli.tx.clear()
+
+def _recovered(wasReset: int):
+    global clientPool, state
+    
+    state = WL_IDLE_STATUS
+    if (not wasReset):
+        return  # the firmware resynced, links are still valid
+
+    prewarmed.clear()  # the parked links are gone with the reset
+    lost = []
+    for cli in clientPool:
+        if (cli.assigned):
+            lost.append((cli, cli.port))
+    for cli, port in lost:
+        clientPool[cli.linkId] = Client()
+        _clientFree(cli)
+
+    if (ipArgs or dnsArgs):
+        import EspAtQuery
+        if (ipArgs):
+            EspAtQuery.staStaticIp(*ipArgs)
+        if (dnsArgs):
+            EspAtQuery.setDNS(*dnsArgs)
+    if (joinArgs):
+        begin(*joinArgs)
+
+    for cli, port in lost:
+        if (cli.recoverCallback):
+            ok = state == WL_CONNECTED and cli.connectInternal(cli.protocol, cli.host, port)
+            cli.recoverCallback(cli, ok)
+
+def setSliceCallback(callback):
+    # callback(client) runs between the slices of a transfer of a PRIORITY_BULK
+    # client, there the application serves its interactive clients. The data
+    # written but not flushed by PRIORITY_INTERACTIVE clients are sent before.
+    # The callback must not use the bulk client itself.
+    global sliceCallback
+
+    sliceCallback = callback
+
+def _slice(linkId: int):
+    for cli in clientPool:
+        if (cli.assigned and cli.priority == EspAtDrv.PRIORITY_INTERACTIVE and cli.tx.n):
+            cli.flush()
+    if (sliceCallback):
+        sliceCallback(clientPool[linkId])
 
 def status() -> int:
     global state
     
+    if (not EspAtDrv.watchdog()):
+        state = WL_NO_MODULE  # still recovering
+        return state
+
     if (state == WL_NO_MODULE):
         return state
     
@@ -185,7 +544,13 @@ def status() -> int:
     elif (res in (2, 3, 4)):
         state = WL_CONNECTED;
     elif (res in (0, 1, 5)):  # inactive, idle, STA disconnected
-        if (state == WL_CONNECT_FAILED):
+        # The AP states only without a station in use (AP-only mode, or STA+AP
+        # with no begin()), a lost station is reported also while the soft AP runs.
+        if (EspAtDrv.wifiMode & EspAtDrv.WIFI_MODE_SAP and
+            (not (EspAtDrv.wifiMode & EspAtDrv.WIFI_MODE_STA) or joinArgs == None)):
+            import EspAtAp
+            state = WL_AP_CONNECTED if EspAtAp.softApStationCount() else WL_AP_LISTENING
+        elif (state == WL_CONNECT_FAILED):
             pass  # no change
         elif (state == WL_CONNECTED):
             state = WL_CONNECTION_LOST
@@ -195,71 +560,191 @@ def status() -> int:
     return state;
 
 def begin(ssid: str, passphrase: str, bssid: bytearray = None):
-    global state
+    global state, joinArgs
     
+    joinArgs = (ssid, passphrase, bssid)
     ok = EspAtDrv.joinAP(ssid, passphrase, bssid)
     state = WL_CONNECTED if ok else WL_CONNECT_FAILED
     return state
 
 def disconnect(persistent: int) -> int:
-    global state
+    global state, joinArgs, ipArgs, dnsArgs
     
     if (EspAtDrv.quitAP(persistent)):
+        joinArgs = None
+        ipArgs = None  # the station is back on DHCP
+        dnsArgs = None
         state = WL_DISCONNECTED
     return state
 
+def config(localIp: str, dnsServer: str = None, gateway: str = None, subnet: str = None) -> int:
+    # Static IP for the station, begin() then joins without waiting for DHCP.
+    # gateway and dnsServer default to the address .1 of the local network.
+    global ipArgs, dnsArgs
+    
+    import EspAtQuery
+    net = localIp[:localIp.rfind(".") + 1]
+    gateway = gateway or net + "1"
+    dnsServer = dnsServer or gateway
+    ipArgs = (localIp, gateway, subnet or "255.255.255.0")
+    dnsArgs = (dnsServer, None)
+    return EspAtQuery.staStaticIp(*ipArgs) and EspAtQuery.setDNS(*dnsArgs)
+
+def setDns(dnsServer1: str, dnsServer2: str = None) -> int:
+    global dnsArgs
+    
+    import EspAtQuery
+    dnsArgs = (dnsServer1, dnsServer2)
+    return EspAtQuery.setDNS(*dnsArgs)
+
+def dhcpIsEnabled() -> int:
+    import EspAtQuery
+    return EspAtQuery.dhcpEnabled()
+
+def firmwareVersion() -> str:
+    # AT version of the firmware, from the capabilities probed by init()
+    caps = EspAtDrv.capabilities()
+    if (not caps):
+        return None
+    return caps.version.decode() + (" ESP_ATMod" if caps.atMod else "")
+
+def setPowerProfile(profile: int) -> int:
+    # EspAtDrv.PROFILE_LOW_LATENCY, PROFILE_BALANCED or PROFILE_LOW_POWER. The
+    # listen interval of the profile takes effect with the next begin().
+    return EspAtDrv.setPowerProfile(profile)
+
 def setPersistent(persistent: int) -> int:
     return EspAtDrv.sysPersistent(persistent)
 
-def endAP(persistent: int):
-    raise NotImplementedError('WiFi.py - endAP')
+def beginAP(ssid: str, passphrase: str = None, channel: int = 1, maxConn: int = 4) -> int:
+    global state
+    
+    import EspAtAp
+    ok = EspAtAp.beginSoftAP(ssid, passphrase, channel, maxConn)
+    state = WL_AP_LISTENING if ok else WL_AP_FAILED
+    return state
+
+def endAP(persistent: int = False) -> int:
+    global state
+    
+    import EspAtAp
+    if (not EspAtAp.endSoftAP(persistent)):
+        return False
+    if (state in (WL_AP_LISTENING, WL_AP_CONNECTED, WL_AP_FAILED)):
+        state = WL_IDLE_STATUS
+    return True
+
+def apStationCount() -> int:
+    import EspAtAp
+    return EspAtAp.softApStationCount()
+
+def apStations() -> list:
+    # (MAC, IP) of the stations connected to the soft AP, IP is None until the station got one
+    import EspAtAp
+    ret = []
+    for st in EspAtAp.softApStations():
+        ret.append((EspAtParse.macStr(st.mac), EspAtParse.ipStr(st.ip) if st.hasIp else None))
+    return ret
+
+def sslConfig(bufSize: int = 0, serverName: str = None) -> int:
+    # TLS buffer size of the firmware (bigger certificate chains need a bigger
+    # buffer, but it takes the ESP's heap) and the SNI server name. Call it
+    # before the SSL links are opened.
+    import EspAtSsl
+    return EspAtSsl.sslConfig(bufSize, serverName)
+
+def sslStatistics() -> tuple:
+    # (attempts, successes, average handshake ms) of SSL connects
+    import EspAtSsl
+    return EspAtSsl.sslStatistics()
+
+def poolStatistics() -> tuple:
+    # (blocks, block size, blocks in use, high-water mark, refused allocations,
+    # high-water marks per link) of the clients' buffer pool
+    return EspAtDrv.poolStatistics()
+
+def prewarmSSL(host: str, port: int, count: int = 1) -> int:
+    # Opens count SSL links to host:port now, so the handshake is done while the
+    # application is idle. A later connectSSL() to the same endpoint takes a
+    # parked link instead of opening a new one. Returns the number of parked links.
+    global prewarmed
+    
+    for i in range(count):
+        linkId = EspAtDrv.connect("SSL", host, port)
+        if (linkId == EspAtDrv.NO_LINK):
+            break
+        cli = Client()
+        cli._attach(linkId, "SSL", host, port)
+        prewarmed.append(cli)
+    return len(prewarmed)
+
+def _prewarmedLink(protocol: str, host: str, port: int) -> int:
+    global prewarmed, clientPool
+    
+    if (protocol != "SSL"):
+        return EspAtDrv.NO_LINK
+    for cli in prewarmed:
+        if (cli.host == host and cli.port == port):
+            prewarmed.remove(cli)
+            linkId = cli.linkId
+            if (EspAtDrv.connected(linkId)):
+                EspAtDrv.linkInfo[linkId].connectTime = 0
+                return linkId
+            cli.abort()  # closed by the server while parked
+            return _prewarmedLink(protocol, host, port)
+    return EspAtDrv.NO_LINK
 
 def rssi() -> int:
-    q = EspAtDrv.apQuery()
+    import EspAtQuery
+    q = EspAtQuery.apQuery()
     if (not q):
         return None
-    return int(q[3])
+    return q.rssi
 
 def channel() -> int:
-    q = EspAtDrv.apQuery()
+    import EspAtQuery
+    q = EspAtQuery.apQuery()
     if (not q):
         return None
-    return int(q[2])
+    return q.channel
 
 def localIp() -> str:
-    q = EspAtDrv.staIpQuery()
+    import EspAtQuery
+    q = EspAtQuery.staIpQuery()
     if (not q):
         return None
-    return q[0]
+    return EspAtParse.ipStr(q.ip)
 
 def gatewayIp() -> str:
-    q = EspAtDrv.staIpQuery()
+    import EspAtQuery
+    q = EspAtQuery.staIpQuery()
     if (not q):
         return None
-    return q[1]
+    return EspAtParse.ipStr(q.gateway)
 
 def subnetMask() -> str:
-    q = EspAtDrv.staIpQuery()
+    import EspAtQuery
+    q = EspAtQuery.staIpQuery()
     if (not q):
         return None
-    return q[2]
+    return EspAtParse.ipStr(q.netmask)
 
 def dnsIp(n: int = None):
-    q = EspAtDrv.dnsQuery()
+    import EspAtQuery
+    q = EspAtQuery.dnsQuery()
     if (not q):
         return None
     if (not n):
-        return q
-    return q[n-1]
+        return [EspAtParse.ipStr(q.servers[i]) for i in range(q.count)]
+    if (n > q.count):
+        return None
+    return EspAtParse.ipStr(q.servers[n-1])
 
 # TODO:
 #    UDP support
 #    def autoConnect(autoconnect: int) -> int:
-#    def config(localIp, DnsServer, gateway, subnet):
-#    def setDns(dnsServer1, dnsServer2):
 #    def hostName(name: str) -> str:
 #    def macAddress(mac: bytes) -> bytes:
-#    def dhcpIsEnabled() -> int:
 #    def ssid(ssid: str):
 #    def bssid(bssid: str):
 #    def scanNetworks():
@@ -0,0 +1,346 @@
+# WsClient.py
+#
+# WebSocket (RFC 6455) client over WiFi.Client
+#
+# Outgoing frames are built in one preallocated buffer, the payload is
+# copied behind the header and masked there in place. Received data are
+# read into a preallocated buffer and the frames are parsed where they are,
+# an unfragmented message is handed to the callback as a memoryview of that
+# buffer. Only fragmented messages are assembled in a separate bytearray.
+# loop() has to be called regularly. It handles incoming frames, answers
+# pings and sends keepalive pings, and never waits for the network. While the
+# firmware is busy, the unsent part of a frame stays in the buffer and the
+# rest of the message is kept, loop() sends them, so frames always go out whole.
+#
+# Version:
+#  0.1.0: initial version
+#  0.1.1: the rest of a message the busy firmware didn't take is sent by loop()
+#  0.1.2: a handshake line refused by the buffer pool fails the connect
+
+from micropython import const
+import micropython
+import os
+import utime
+import EspAtDrv
+import WiFi
+
+OP_CONT = const(0x0)
+OP_TEXT = const(0x1)
+OP_BINARY = const(0x2)
+OP_CLOSE = const(0x8)
+OP_PING = const(0x9)
+OP_PONG = const(0xA)
+
+FIN = const(0x80)
+MASKED = const(0x80)
+
+CLOSE_NORMAL = const(1000)
+CLOSE_PROTOCOL_ERROR = const(1002)
+CLOSE_TOO_BIG = const(1009)
+
+FRAME_SIZE = const(1024)      # payload of one outgoing frame, longer messages are fragmented
+RX_SIZE = const(4096)         # receive buffer, the longest frame and message accepted
+CONNECT_TIMEOUT = const(5000)
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+###################################
+
+class WsClient:
+    def __init__(self, keepAlive: int = 30, frameSize: int = FRAME_SIZE, rxSize: int = RX_SIZE):
+        self.keepAlive = keepAlive  # in seconds, 0 disables the pings
+        self.frameSize = frameSize
+        self.cli = WiFi.Client()
+        self.isConnected = False
+        self.txBuf = bytearray(frameSize + 14)  # header (up to 10) + mask key + payload
+        self.txView = memoryview(self.txBuf)
+        self.txPos = 0  # txBuf[txPos:txEnd] of the last frame is not written yet
+        self.txEnd = 0
+        self.rest = None  # payload of the message not framed yet
+        self.restOp = OP_CONT
+        self.flushPending = False  # the client holds data the busy firmware didn't take
+        self.rxBuf = bytearray(rxSize)
+        self.rxView = memoryview(self.rxBuf)
+        self.rxLen = 0
+        self.msg = None  # fragments of a message received so far
+        self.msgBinary = False
+        self.lastTx = 0
+        self.pingSent = 0  # ticks of the outstanding ping, 0 if none
+        self.pingRtt = 0  # ms of the last ping
+        self.closeCode = 0  # status code of the close frame of the server
+        self.callback = None
+
+    def setCallback(self, callback):
+        # callback(message: memoryview, binary: bool) is called for received
+        # messages. message is valid only during the call, copy what is kept.
+        self.callback = callback
+
+    def connect(self, host: str, port: int = 80, path: str = "/", ssl: bool = False,
+                headers: dict = None) -> int:
+        import binascii
+        if (not (self.cli.connectSSL(host, port) if ssl else self.cli.connect(host, port))):
+            return False
+
+        key = binascii.b2a_base64(os.urandom(16))[:-1]  # without the newline
+        req = (f'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\n'
+               f'Connection: Upgrade\r\nSec-WebSocket-Key: {key.decode()}\r\n'
+               'Sec-WebSocket-Version: 13\r\n')
+        if (headers):
+            for name, value in headers.items():
+                req += f'{name}: {value}\r\n'
+        self.cli.print(req + "\r\n")
+        self.cli.flush()
+
+        line = self.cli.readuntil(b'\n', 256, CONNECT_TIMEOUT) or b''  # None if the pool has no block
+        ok = line.startswith(b"HTTP/1.1 101")
+        accept = None
+        while (line and line != b"\r\n"):
+            line = self.cli.readuntil(b'\n', 256, CONNECT_TIMEOUT) or b''
+            if (line[:21].lower() == b"sec-websocket-accept:"):
+                accept = line[21:].strip()
+        if (ok and not self._accepted(key, accept)):
+            ok = False
+        if (not ok):
+            EspAtDrv.LOG_ERROR_PRINT("WebSocket handshake failed\r\n")
+            self.cli.stop()
+            return False
+
+        self.isConnected = True
+        self.rxLen = 0
+        self.msg = None
+        self.txPos = 0
+        self.txEnd = 0
+        self.rest = None
+        self.flushPending = False
+        self.pingSent = 0
+        self.closeCode = 0
+        self.lastTx = utime.ticks_ms()
+        return True
+
+    def _accepted(self, key: bytes, accept: bytes) -> int:
+        # the server's Sec-WebSocket-Accept, not checked without SHA-1 in hashlib
+        import binascii
+        import hashlib
+        if (accept == None):
+            return False
+        if (not hasattr(hashlib, "sha1")):
+            return True
+        return binascii.b2a_base64(hashlib.sha1(key + WS_GUID).digest())[:-1] == accept
+
+    def send(self, message, binary: bool = None) -> int:
+        # Sends a str as text and bytes as binary message (unless binary says
+        # otherwise). Messages longer than frameSize go in fragments. What the
+        # busy firmware doesn't take is sent by loop(), False while the previous
+        # message is still waiting.
+        if (not self.isConnected or not self._resume()):
+            return False
+        if (isinstance(message, str)):
+            message = message.encode()
+            if (binary == None):
+                binary = False
+        elif (binary == None):
+            binary = True
+
+        self.rest = memoryview(message)
+        self.restOp = OP_BINARY if binary else OP_TEXT
+        if (not self._resume()):
+            if (self.rest != None):
+                self.rest = memoryview(bytes(self.rest))  # the caller may reuse message
+            return True
+        return self._flush()
+
+    def ping(self, payload: bytes = b'') -> int:
+        if (not self.isConnected):
+            return False
+        if (not self._frame(FIN | OP_PING, payload)):
+            return False
+        self.pingSent = utime.ticks_ms()
+        return self._flush()
+
+    def loop(self) -> int:
+        if (not self.isConnected):
+            return False
+        if (not self._receive()):
+            self._lost()
+            return False
+        if (self.txPos < self.txEnd or self.rest != None or self.flushPending):
+            if (self._resume()):
+                self._flush()
+
+        if (self.keepAlive):
+            now = utime.ticks_ms()
+            if (self.pingSent):
+                if (utime.ticks_diff(now, self.pingSent) >= self.keepAlive * 1000):
+                    EspAtDrv.LOG_ERROR_PRINT("WebSocket server not responding\r\n")
+                    self._lost()
+                    return False
+            elif (utime.ticks_diff(now, self.lastTx) >= self.keepAlive * 500):
+                self.ping()
+
+        return self.isConnected
+
+    def close(self, code: int = CLOSE_NORMAL):
+        if (self.isConnected):
+            self._frame(FIN | OP_CLOSE, bytes((code >> 8, code & 255)))
+            self._flush()
+        self.isConnected = False
+        self.cli.stop()
+
+    def _frame(self, b0: int, payload) -> int:
+        # a control frame, after the frame being sent, between the fragments of
+        # a message. False if the busy firmware didn't take the previous frame.
+        if (not self._tail()):
+            return False
+        self._build(b0, payload)
+        self._tail()
+        return True
+
+    def _resume(self) -> int:
+        # writes the rest of the frame in txBuf and the frames of the rest of
+        # the message, False if the busy firmware didn't take all
+        while (self._tail()):
+            if (self.rest == None):
+                return True
+            n = min(len(self.rest), self.frameSize)
+            last = n == len(self.rest)
+            self._build(self.restOp | (FIN if last else 0), self.rest[:n])
+            self.rest = None if last else self.rest[n:]
+            self.restOp = OP_CONT
+        return False
+
+    def _tail(self) -> int:
+        # hands the unwritten part of the frame in txBuf to the client, True if it took all
+        if (self.txPos < self.txEnd):
+            self.txPos += self.cli.write(self.txView[self.txPos:self.txEnd])
+            if (self.txPos < self.txEnd):
+                return False
+            self.lastTx = utime.ticks_ms()
+        return True
+
+    def _build(self, b0: int, payload):
+        # header, mask key and the masked payload into txBuf
+        buf = self.txBuf
+        n = len(payload)
+        buf[0] = b0
+        if (n < 126):
+            buf[1] = MASKED | n
+            pos = 2
+        else:  # frameSize keeps it below 64 KB
+            buf[1] = MASKED | 126
+            buf[2] = n >> 8
+            buf[3] = n & 255
+            pos = 4
+        buf[pos:pos + 4] = os.urandom(4)
+        buf[pos + 4:pos + 4 + n] = payload
+        _mask(buf, pos + 4, pos + 4 + n, pos)
+        self.txPos = 0
+        self.txEnd = pos + 4 + n
+
+    def _flush(self) -> int:
+        self.flushPending = False
+        if (not self.cli.flush()):
+            if (EspAtDrv.getLastErrorCode() == EspAtDrv.Error_BUSY):
+                self.flushPending = True  # the client keeps the data, loop() sends them later
+                return True
+            EspAtDrv.LOG_ERROR_PRINT("WebSocket send failed\r\n")
+            self._lost()
+            return False
+        return True
+
+    def _lost(self):
+        self.isConnected = False
+        self.msg = None
+        self.txPos = 0
+        self.txEnd = 0
+        self.rest = None
+        self.flushPending = False
+        self.cli.stop()
+
+    def _receive(self) -> int:
+        # reads what is available and processes all complete frames in place
+        if (not self.cli.connected()):
+            return False
+        while (self.rxLen < len(self.rxBuf) and self.cli.available()):
+            n = self.cli.readinto(self.rxView[self.rxLen:])
+            if (n == 0):
+                break
+            self.rxLen += n
+
+        buf = self.rxBuf
+        pos = 0
+        while (self.isConnected and self.rxLen - pos >= 2):
+            b1 = buf[pos + 1]
+            length = b1 & 0x7F
+            start = pos + 2
+            if (length == 126):
+                start += 2
+                if (self.rxLen < start):
+                    break
+                length = (buf[pos + 2] << 8) | buf[pos + 3]
+            elif (length == 127):
+                start += 8
+                if (self.rxLen < start):
+                    break
+                length = int.from_bytes(buf[pos + 2:pos + 10], "big")
+            if (b1 & MASKED):
+                start += 4
+            if (start - pos + length > len(buf)):
+                EspAtDrv.LOG_ERROR_PRINT("WebSocket frame too big\r\n")
+                self.close(CLOSE_TOO_BIG)
+                return False
+            if (self.rxLen < start + length):
+                break  # incomplete frame
+            if (b1 & MASKED):  # servers don't mask, but it is allowed to read
+                _mask(buf, start, start + length, start - 4)
+            self._dispatch(buf[pos], self.rxView[start:start + length])
+            pos = start + length
+
+        if (pos):  # the incomplete frame to the start of the buffer
+            buf[:self.rxLen - pos] = self.rxView[pos:self.rxLen]
+            self.rxLen -= pos
+        return self.isConnected
+
+    def _dispatch(self, b0: int, payload: memoryview):
+        opcode = b0 & 0x0F
+        if (opcode == OP_TEXT or opcode == OP_BINARY):
+            if (self.msg != None):
+                return self._protocolError()
+            if (b0 & FIN):
+                if (self.callback):
+                    self.callback(payload, opcode == OP_BINARY)
+            else:
+                self.msg = bytearray(payload)
+                self.msgBinary = opcode == OP_BINARY
+        elif (opcode == OP_CONT):
+            if (self.msg == None):
+                return self._protocolError()
+            if (len(self.msg) + len(payload) > len(self.rxBuf)):
+                EspAtDrv.LOG_ERROR_PRINT("WebSocket message too big\r\n")
+                return self.close(CLOSE_TOO_BIG)
+            self.msg.extend(payload)
+            if (b0 & FIN):
+                msg = self.msg
+                self.msg = None
+                if (self.callback):
+                    self.callback(memoryview(msg), self.msgBinary)
+        elif (opcode == OP_PING):
+            if (self._frame(FIN | OP_PONG, payload)):
+                self._flush()
+        elif (opcode == OP_PONG):
+            if (self.pingSent):
+                self.pingRtt = utime.ticks_diff(utime.ticks_ms(), self.pingSent)
+                self.pingSent = 0
+        elif (opcode == OP_CLOSE):
+            self.closeCode = (payload[0] << 8) | payload[1] if len(payload) >= 2 else CLOSE_NORMAL
+            self.close(self.closeCode)  # the echo of the close frame
+        else:
+            self._protocolError()
+
+    def _protocolError(self):
+        EspAtDrv.LOG_ERROR_PRINT("WebSocket protocol error\r\n")
+        self.close(CLOSE_PROTOCOL_ERROR)
+
+@micropython.native
+def _mask(buf, start: int, end: int, key: int):
+    # XORs buf[start:end] in place with the 4 byte masking key at buf[key]
+    for i in range(start, end):
+        buf[i] ^= buf[key + ((i - start) & 3)]
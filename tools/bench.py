@@ -0,0 +1,1158 @@
+# bench.py
+#
+# Benchmarks of the driver against the ESP8285 emulator (CPython)
+#
+# Usage: python3 tools/bench.py [benchmark ...]
+# Without arguments all benchmarks are run. Times are virtual milliseconds
+# of the emulator clock. The bounds the benchmarks claim are checked, the
+# exit code is 1 if one is violated.
+#
+# Version:
+#  0.1.0: initial version
+#  0.2.0: check() of the claimed bounds, non-zero exit code on violations
+#  0.2.1: caps checks the AT 2 command names of the settings
+#  0.2.2: power checks the listen interval of the AT 2 join
+#  0.2.3: autotune before init()
+#  0.2.4: startup checks that the buffer pool is allocated by the first client
+#  0.2.5: pool checks the shares, the release of unused blocks and availableForWrite()
+#  0.2.6: tls checks the SSL settings after a failed init()
+#  0.2.7: ws sends a message through a busy period
+#  0.2.8: startup bounds the bytecode of the core
+#  0.2.9: startup checks that EspAtPool is loaded by the first client
+#  0.2.10: pool checks peek() on a link over its share
+#  0.2.11: pool checks readuntil() over the share returns None
+
+import binascii
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+LIB = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+sys.path.insert(0, LIB)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import espemu
+import replay
+
+SSID = "bench"
+PWD = "secret"
+
+failures = []  # claims violated by the benchmarks run
+
+def setup(join: bool = True, **kw):
+    # fresh emulator and fresh driver state, returns (emu, WiFi, EspAtDrv)
+    emu = espemu.install(espemu.EspEmulator(**kw))
+    emu.aps[SSID] = (PWD, "11:22:33:44:55:66", 6, -60)
+    emu.servers[7] = espemu.EchoServer
+    emu.servers[9] = espemu.SinkServer
+    emu.servers[1883] = espemu.MqttBroker
+    purge()
+    import WiFi
+    import EspAtDrv
+    WiFi.init(EspAtDrv.WIFI_SOFT_RESET)
+    if (join):
+        WiFi.begin(SSID, PWD)
+    return emu, WiFi, EspAtDrv
+
+def purge():
+    # the library modules keep driver state, the next import starts fresh
+    for name, m in list(sys.modules.items()):
+        if (os.path.dirname(getattr(m, "__file__", None) or "") == LIB):
+            del sys.modules[name]
+
+def report(name: str, value, unit: str = ""):
+    print(f'  {name:<40} {value:>10} {unit}')
+
+def check(ok, claim: str):
+    # a bound the benchmark guards, a violation makes bench.py exit with 1
+    if (not ok):
+        failures.append(claim)
+        print(f'  FAIL {claim}')
+
+def ms(emu, since: int) -> int:
+    return emu.clock.ms() - since
+
+def measure(emu, fn, *args):
+    # runs fn(*args), returns (result, virtual ms, UART writes, peak bytes allocated)
+    tracemalloc.start()
+    t = emu.clock.ms()
+    w = emu.writes
+    res = fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return res, ms(emu, t), emu.writes - w, peak
+
+###################################
+
+def bench_stall():
+    # worst-case time to detect a wedged module and to bring it back
+    print("stall: detection and recovery of a not responding firmware")
+    emu, WiFi, EspAtDrv = setup()
+
+    cli = WiFi.Client()
+    recovered = []
+    cli.onRecover(lambda c, ok: recovered.append(ok))
+    cli.connect("echo", 7)
+
+    emu.hang()  # until AT+RST
+    t = emu.clock.ms()
+    WiFi.status()
+    report("status() with wedged module", ms(emu, t), "ms")
+    check(ms(emu, t) <= EspAtDrv.RESYNC_COUNT * EspAtDrv.RESYNC_TIMEOUT + EspAtDrv.TIMEOUT,
+          "a wedged module is detected within the resync deadlines")
+
+    while (WiFi.status() != WiFi.WL_CONNECTED):
+        emu.clock.advance(100)
+    report("hang to reconnected via AT+RST", ms(emu, t), "ms")
+    report("client reconnected", recovered == [True])
+    check(ms(emu, t) < 10000, "the watchdog reconnects a hung module within 10 s")
+    check(recovered == [True], "the client is reconnected after the watchdog reset")
+
+    emu.clock.advance(EspAtDrv.STATUS_MAX_AGE)  # status() asks the module again
+    emu.stall(600)
+    t = emu.clock.ms()
+    st = WiFi.status()
+    report("status() during a 600 ms stall", st)
+    report("status() duration", ms(emu, t), "ms")
+    check(st == WiFi.WL_CONNECTED, "a stall shorter than the deadline is no failure")
+    check(ms(emu, t) < 1000, "status() during a stall returns with the reply")
+
+    emu.clock.advance(EspAtDrv.STATUS_MAX_AGE)
+    emu.hang(10000)  # AT+RST doesn't help, watchdog backs off
+    t = emu.clock.ms()
+    attempts = 0
+    while (WiFi.status() != WiFi.WL_CONNECTED):
+        attempts += 1
+        emu.clock.advance(100)
+    report("recovery after a 10 s hang", ms(emu, t), "ms")
+    report("status() calls while recovering", attempts)
+    check(ms(emu, t) < 10000 + 8 * EspAtDrv.RECOVER_BACKOFF_MIN,  # the backoff reached in 10 s
+          "recovery follows the end of a 10 s hang within the backoff")
+    check(attempts > 1, "status() doesn't block while the watchdog backs off")
+
+def bench_cmd():
+    # UART writes and allocations per AT command
+    print("cmd: UART writes and allocations per command")
+    emu, WiFi, EspAtDrv = setup(join=False)
+    emu.aps['my "net", 2'] = ("pa,ss\\word", "11:22:33:44:55:66", 6, -60)
+
+    def row(name, fn, *args, expect=None, maxWrites=1):
+        res, t, writes, peak = measure(emu, fn, *args)
+        report(name, f'{writes} writes', f'{peak:>6} B peak  -> {res!r}')
+        check(writes <= maxWrites, f'{name}: at most {maxWrites} UART writes')
+        if (expect is not None):
+            check(res == expect, f'{name}: returns {expect!r}')
+
+    row("joinAP with quotes/commas", EspAtDrv.joinAP, 'my "net", 2', "pa,ss\\word", None, expect=True)
+    row("joinAP with bssid", EspAtDrv.joinAP, SSID, PWD, b"\x11\x22\x33\x44\x55\x66", expect=True)
+    row("staStatus", EspAtDrv.staStatus)
+    linkId, *_ = measure(emu, EspAtDrv.connect, "TCP", "sink", 9)
+    row("connect", EspAtDrv.connect, "TCP", "echo", 7)
+    row("sendData 64 B", EspAtDrv.sendData, linkId, b"x" * 64, expect=64, maxWrites=2)
+    row("close", EspAtDrv.close, linkId, True, expect=True, maxWrites=2)
+
+def bench_parse():
+    # EspAtParse against the split-based parsing of driver 0.3, and a fuzz run
+    print("parse: response parsers, CPU time and allocations per line")
+    setup(join=False)
+    import EspAtParse
+
+    cwjap = bytearray(b'+CWJAP:"office, 2nd floor","aa:bb:cc:dd:ee:ff",11,-67')
+    cipsta = bytearray(b'+CIPSTA_CUR:gateway:"192.168.100.1"')
+    cipstatus = bytearray(b'+CIPSTATUS:3,"SSL","93.184.216.34",443,50003,0')
+    ap = EspAtParse.ApInfo()
+    cfg = EspAtParse.IpConfig()
+    links = [EspAtParse.LinkStatus() for i in range(5)]
+
+    cases = (
+        ("+CWJAP split", lambda: int(cwjap.split(b',')[3])),
+        ("+CWJAP parseCwjap", lambda: EspAtParse.parseCwjap(cwjap, ap)),
+        ("+CIPSTA split", lambda: cipsta.split(b':')[2][1:-1].decode()),
+        ("+CIPSTA parseCipsta", lambda: EspAtParse.parseCipsta(cipsta, cfg)),
+        ("+CIPSTATUS offset", lambda: cipstatus[11] - 48),
+        ("+CIPSTATUS parseCipstatus", lambda: EspAtParse.parseCipstatus(cipstatus, links)),
+    )
+    n = 20000
+    for name, fn in cases:
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        t = time.perf_counter()
+        for i in range(n):
+            res = fn()
+        us = (time.perf_counter() - t) * 1e6 / n
+        report(name, f'{us:.2f} us', f'{peak:>4} B peak  -> {res!r}')
+    report("rssi of a comma SSID by split", int(cwjap.split(b',')[3]), "(wrong)")
+    report("rssi of a comma SSID by parseCwjap", ap.rssi)
+    check(ap.rssi == -67, "parseCwjap reads the rssi behind a comma SSID")
+
+    # fuzz: random SSIDs must round trip, mutated lines must be rejected without exceptions
+    rnd = random.Random(1)
+    alphabet = b'ab,"\\: \xc3\xa9'
+    errors = 0
+    for i in range(5000):
+        ssid = bytes(rnd.choice(alphabet) for j in range(rnd.randint(1, 32)))
+        line = bytearray(b'+CWJAP:"' + ssid + b'","01:23:45:67:89:ab",' + str(rnd.randint(1, 13)).encode()
+                         + b',' + str(-rnd.randint(20, 99)).encode())
+        if (not EspAtParse.parseCwjap(line, ap) or bytes(ap.ssid[:ap.ssidLen]) != ssid):
+            errors += 1
+        for src in (line, cipsta, cipstatus):
+            m = bytearray(src)
+            for k in range(rnd.randint(1, 4)):
+                op = rnd.randrange(3)
+                pos = rnd.randrange(len(m) + 1)
+                if (op == 0 and m):
+                    del m[min(pos, len(m) - 1)]
+                elif (op == 1):
+                    m[pos:pos] = bytes([rnd.randrange(256)])
+                else:
+                    del m[pos:]
+            try:
+                EspAtParse.parseCwjap(m, ap)
+                EspAtParse.parseCipsta(m, cfg)
+                EspAtParse.parseCipstatus(m, links)
+            except Exception as e:
+                errors += 1
+                print("   ", bytes(m), repr(e))
+    report("fuzz errors in 5000 rounds", errors)
+    check(errors == 0, "the parsers survive the fuzz run")
+
+def bench_mqtt():
+    # telemetry publishing: stop-and-wait Client sends against MqttClient
+    print("mqtt: 200 publishes of 32 B telemetry")
+    N = 200
+    payload = b"t=21.5;h=40.2;p=1013.2;seq=00000"
+
+    emu, WiFi, EspAtDrv = setup()
+    import MqttClient
+    cli = WiFi.Client()
+    cli.connect("broker", 1883)
+    cli.write(b'\x10\x10\x00\x04MQTT\x04\x02\x00\x3c\x00\x04raw1')
+    cli.flush()
+    t = emu.clock.ms()
+    sends = len(emu.commands)
+    for i in range(N):
+        pkt = b'\x30' + bytes((2 + 9 + len(payload),)) + b'\x00\x09telemetry' + payload
+        cli.write(pkt)
+        cli.flush()
+    dt = ms(emu, t)
+    report("Client.write+flush per publish, QoS 0", f'{N * 1000 // max(dt, 1)} msg/s',
+           f'{len(emu.commands) - sends} AT commands')
+    perPublish = len(emu.commands) - sends
+    cli.stop()
+
+    for qos, window in ((0, 8), (1, 1), (1, 8)):
+        emu, WiFi, EspAtDrv = setup()
+        import MqttClient
+        mq = MqttClient.MqttClient("bench", window=window)
+        mq.connect("broker", 1883)
+        t = emu.clock.ms()
+        sends = len(emu.commands)
+        i = 0
+        while (i < N or mq.pending() or mq.out):
+            if (i < N and mq.publish("telemetry", payload, qos) >= 0):
+                i += 1
+                continue
+            mq.loop()
+            emu.clock.advance(1)
+        dt = ms(emu, t)
+        broker = emu.links[4].server
+        report(f'MqttClient QoS {qos} window {window}', f'{N * 1000 // max(dt, 1)} msg/s',
+               f'{len(emu.commands) - sends} AT commands, {len(broker.published)} at broker')
+        check(len(broker.published) == N, f'MqttClient QoS {qos} window {window}: all published')
+        if (window > 1):
+            check(len(emu.commands) - sends < perPublish // 2,
+                  f'MqttClient QoS {qos} window {window}: batches the publishes')
+
+def heldMemory() -> int:
+    # bytes currently allocated by the library and the benchmark, not by the emulator
+    snap = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(True, LIB + os.sep + "*"), tracemalloc.Filter(True, __file__)])
+    return sum(stat.size for stat in snap.statistics("filename"))
+
+class CountingSink:
+    # writable stream which only counts and samples the memory held
+    def __init__(self):
+        self.n = 0
+        self.peak = 0
+
+    def write(self, data) -> int:
+        self.n += len(data)
+        self.peak = max(self.peak, heldMemory())
+        return len(data)
+
+def bench_download():
+    # byte-wise read() as in example/wifitest.py against Client.copyTo
+    print("download: HTTP-like download, time and peak memory")
+    for size in (16384, 65536):
+        server = espemu.DownloadServer(size)
+        crc = binascii.crc32(server.data)
+
+        emu, WiFi, EspAtDrv = setup()
+        emu.servers[80] = lambda: server
+        cli = WiFi.Client()
+        cli.connect("files", 80)
+
+        peak = [0]
+
+        def bytewise():
+            resp = bytearray()
+            t = emu.clock.ms()
+            while (cli.available() == 0 and emu.clock.ms() - t < 5000):
+                emu.clock.advance(10)
+            while (cli.available()):
+                ch = cli.read()
+                if (ch < 0):
+                    break
+                resp.append(ch)
+                if (len(resp) % 1024 == 0):
+                    peak[0] = max(peak[0], heldMemory())
+                t = emu.clock.ms()
+                while (cli.available() == 0 and emu.clock.ms() - t < 1000):
+                    emu.clock.advance(10)
+            return len(resp)
+
+        t = time.perf_counter()
+        n, dt, _, _ = measure(emu, bytewise)
+        cpu = time.perf_counter() - t
+        report(f'{size // 1024} KB read() per byte', f'{n * 1000 // max(dt, 1)} B/s',
+               f'{peak[0]:>6} B held, {cpu:.2f} s CPU')
+
+        emu, WiFi, EspAtDrv = setup()
+        emu.servers[80] = lambda: server
+        cli = WiFi.Client()
+        cli.connect("files", 80)
+        sink = CountingSink()
+        t = time.perf_counter()
+        n, dt, _, _ = measure(emu, cli.copyTo, sink, None, 1024, "crc32")
+        cpu = time.perf_counter() - t
+        report(f'{size // 1024} KB copyTo 1 KB buffer + CRC32', f'{n * 1000 // max(dt, 1)} B/s',
+               f'{sink.peak:>6} B held, {cpu:.2f} s CPU, copyRate {cli.copyRate} B/s, '
+               f'CRC {"ok" if cli.copyDigest == crc else "wrong"}')
+        check(n == size and cli.copyDigest == crc, f'{size // 1024} KB copyTo: complete, CRC ok')
+        check(sink.peak < 4096, f'{size // 1024} KB copyTo: memory held independent of the size')
+
+def bench_softap():
+    # station list from notices against polling AT+CWLIF
+    print("softap: station list of a soft AP with 4 phones")
+    emu, WiFi, EspAtDrv = setup()
+    report("beginAP", WiFi.beginAP("provision", "pass1234", 6, 4))
+    report("status", WiFi.status())
+    for i in range(4):
+        emu.stationJoin(f'aa:bb:cc:00:00:0{i}', f'192.168.4.{i + 2}')
+        emu.clock.advance(30)
+    emu.clock.advance(100)
+    emu.stationLeave("aa:bb:cc:00:00:01")
+    emu.clock.advance(10)
+
+    stations, dt, writes, peak = measure(emu, WiFi.apStations)
+    report("apStations() from notices", f'{dt} ms', f'{writes} writes, {len(stations)} stations')
+    check(writes == 0 and len(stations) == 3, "apStations() from the notices, without a command")
+    _, dt, writes, peak = measure(emu, EspAtDrv.simpleCommand, b"AT+CWLIF")
+    report("AT+CWLIF query", f'{dt} ms', f'{writes} writes')
+    report("status with stations", WiFi.status())
+    ip = WiFi.localIp()
+    report("STA still joined (AP+STA mode)", ip)
+    check(ip and ip != "0.0.0.0", "the station stays joined while the soft AP runs")
+    emu.ap = None  # the station loses its AP
+    emu.reply("WIFI DISCONNECT\r\n")
+    emu.clock.advance(EspAtDrv.STATUS_MAX_AGE)
+    st = WiFi.status()
+    report("status after the station lost its AP", st)
+    check(st == WiFi.WL_CONNECTION_LOST, "a lost station is reported while the soft AP runs")
+    ok = WiFi.endAP()
+    report("endAP", ok)
+    report("wifiMode after endAP", EspAtDrv.wifiMode)
+    check(ok and EspAtDrv.wifiMode == EspAtDrv.WIFI_MODE_STA, "endAP() returns to station mode")
+
+def bench_tls():
+    # TLS buffer size against handshake time and success, prewarmed links
+    print("tls: 20 SSL connects to a server with a 5 KB certificate chain")
+    N = 20
+    for size in (0, 2048, 4096, 6144, 8192, 16384):
+        emu, WiFi, EspAtDrv = setup()
+        emu.servers[443] = espemu.EchoServer
+        emu.certChains[443] = 5000
+        emu.sslFailRate = 0.05
+        emu.sslHeap = 12000
+        WiFi.sslConfig(size)
+        cli = WiFi.Client()
+        for i in range(N):
+            if (cli.connectSSL("tls.example", 443)):
+                cli.stop()
+        attempts, ok, avg = WiFi.sslStatistics()
+        report(f'CIPSSLSIZE {size or "default"}', f'{ok}/{attempts} ok', f'{avg} ms per handshake')
+        if (size in (6144, 8192)):
+            check(ok >= N * 3 // 4, f'CIPSSLSIZE {size}: the 5 KB chain fits')
+
+    emu, WiFi, EspAtDrv = setup()
+    emu.servers[443] = espemu.EchoServer
+    emu.certChains[443] = 5000
+    emu.sniRequired.add(443)
+    WiFi.sslConfig(6144, "tls.example")
+    cli = WiFi.Client()
+    _, dt, writes, _ = measure(emu, cli.connectSSL, "tls.example", 443)
+    report("connectSSL with SNI", f'{dt} ms', f'connectTime {cli.connectTime()} ms')
+    cli.stop()
+    report("prewarmSSL", WiFi.prewarmSSL("tls.example", 443), "links parked")
+    ok, dt, writes, _ = measure(emu, cli.connectSSL, "tls.example", 443)
+    report("connectSSL on a prewarmed link", f'{dt} ms', f'{writes} writes, ok {ok}')
+    check(ok and writes == 0, "connectSSL takes the prewarmed link without a command")
+    cli.write(b"ping")
+    cli.flush()
+    emu.clock.advance(100)
+    echo = cli.readBuf(4)
+    report("echo over the prewarmed link", str(echo))
+    check(echo == b"ping", "the prewarmed link carries data")
+    cli.stop()
+
+    emu = espemu.install(espemu.EspEmulator())
+    emu.unsupported.add("GMR")  # init() can't identify the firmware
+    purge()
+    import WiFi
+    import EspAtDrv
+    init = WiFi.init()
+    ok = WiFi.sslConfig(4096, "tls.example")
+    EspAtDrv.sslServerName = "tls.example"  # as set before the firmware failed
+    connected = WiFi.Client().connectSSL("tls.example", 443)
+    report("sslConfig, connectSSL after failed init", f'{ok} {connected}', f'error {EspAtDrv.lastErrorCode}')
+    check(not init and not ok and not connected and EspAtDrv.lastErrorCode == EspAtDrv.Error_NOT_INITIALIZED,
+          "the SSL settings fail with Error_NOT_INITIALIZED after a failed init()")
+
+def bench_busy():
+    # sustained upload while the firmware answers "busy p..." after some sends
+    print("busy: 100 KB upload in 1 KB writes, 20 % of sends followed by 150 ms busy")
+    N = 100
+    chunk = bytes(range(256)) * 4
+    emu, WiFi, EspAtDrv = setup()
+    emu.busyRate = 0.2
+    emu.busyTime = 150
+    cli = WiFi.Client()
+    cli.connect("sink", 9)
+    t = emu.clock.ms()
+    short = 0
+    i = 0
+    while (i < N):
+        n = cli.write(chunk)
+        if (n < len(chunk)):  # would block, the rest is written later
+            short += 1
+            chunk2 = chunk[n:]
+            while (chunk2):
+                emu.clock.advance(10)
+                chunk2 = chunk2[cli.write(chunk2):]
+        i += 1
+    cli.flush()
+    dt = ms(emu, t)
+    sink = emu.links[cli.linkId].server
+    report("throughput", f'{len(sink.data) * 1000 // max(dt, 1)} B/s',
+           f'{len(sink.data)}/{N * len(chunk)} B delivered, {EspAtDrv.busyCount} busy retries')
+    report("short writes", short)
+    check(len(sink.data) == N * len(chunk), "all data delivered through the busy periods")
+
+    emu.busy(5000)
+    _, dt, writes, _ = measure(emu, cli.write, chunk * 3)
+    report("write of 3 KB into a busy firmware", f'{dt} ms',
+           f'availableForWrite {cli.availableForWrite()}')
+    check(dt <= EspAtDrv.BUSY_TIMEOUT + EspAtDrv.TIMEOUT, "write() into a busy firmware gives up after BUSY_TIMEOUT")
+    emu.clock.advance(5000)
+    ok = cli.flush()
+    report("flush after the busy period", ok, f'{len(sink.data) - N * len(chunk)} B more')
+    check(ok and len(sink.data) - N * len(chunk) == EspAtDrv.maxSendSize,
+          "the data taken while busy are sent by the next flush()")
+
+def bench_readline():
+    # parsing a block of HTTP response headers line by line
+    headers = [b"HTTP/1.1 200 OK"] + [f'X-Header-{i:02}: {"v" * 40}'.encode() for i in range(36)]
+    block = b"\r\n".join(headers) + b"\r\n\r\n"
+    print(f'readline: {len(block)} B header block, {len(headers)} lines')
+
+    def perByte(cli):
+        lines = []
+        line = bytearray()
+        while True:
+            c = cli.read()
+            if (c < 0):
+                break
+            line.append(c)
+            if (c == 10):
+                if (line == b"\r\n"):
+                    break
+                lines.append(bytes(line))
+                line = bytearray()
+        return lines
+
+    def byLine(cli):
+        lines = []
+        for line in cli:
+            if (line == b"\r\n"):
+                break
+            lines.append(line)
+        return lines
+
+    for name, fn in (("read() per byte", perByte), ("readline() iteration", byLine)):
+        emu, WiFi, EspAtDrv = setup()
+        cli = WiFi.Client()
+        cli.connect("echo", 7)
+        cli.write(block)
+        cli.flush()
+        emu.clock.advance(200)
+        calls = 0
+        commands = len(emu.commands)
+
+        def profile(frame, event, arg):  # counts the calls of library functions
+            nonlocal calls
+            if (event == "call" and os.path.dirname(frame.f_code.co_filename) == LIB):
+                calls += 1
+
+        t0 = time.process_time()
+        sys.setprofile(profile)
+        lines, dt, writes, peak = measure(emu, fn, cli)
+        sys.setprofile(None)
+        cpu = time.process_time() - t0
+        report(name, f'{dt} ms', f'{len(lines)} lines, {calls} library calls, '
+               f'{len(emu.commands) - commands} AT commands, {cpu * 1000:.1f} ms CPU')
+        check([l[:-2] for l in lines] == headers, f'{name}: all header lines')
+        check(len(emu.commands) - commands <= 2, f'{name}: the block is fetched in one or two AT commands')
+
+def bench_poll():
+    # application loop polling WiFi.status() and Client.available()
+    print("poll: 5 s loop calling status() and available() every 20 ms")
+    emu, WiFi, EspAtDrv = setup()
+    cli = WiFi.Client()
+    cli.connect("echo", 7)
+    t = emu.clock.ms()
+    commands = len(emu.commands)
+    loops = 0
+    while (ms(emu, t) < 5000):
+        WiFi.status()
+        cli.available()
+        emu.clock.advance(20)
+        loops += 1
+    sent = emu.commands[commands:]
+    report("loops", loops)
+    report("AT+CIPSTATUS", sum(1 for c in sent if c == "AT+CIPSTATUS"), "commands")
+    report("all AT commands", len(sent), f'{len(sent) * 1000 // ms(emu, t)} per s')
+    check(sum(1 for c in sent if c == "AT+CIPSTATUS") <= 5000 // EspAtDrv.STATUS_MAX_AGE + 1,
+          "one AT+CIPSTATUS per STATUS_MAX_AGE answers the polling")
+
+    emu.drop(1)  # the server closes, the driver misses CLOSED
+    emu.links[cli.linkId].close(0)
+    emu.pump()
+    emu.clock.advance(600)
+    report("status() after a missed CLOSED", WiFi.status())
+    ok = cli.connected()
+    report("connected() after the snapshot", ok)
+    check(not ok, "the snapshot notices a link closed without a CLOSED notice")
+
+def bench_staticip():
+    # join to the first answered request, with DHCP and with a static IP
+    print("staticip: begin() to the first echo reply")
+
+    def usable(WiFi, emu):
+        WiFi.begin(SSID, PWD)
+        cli = WiFi.Client()
+        cli.connect("echo", 7)
+        cli.write(b"ping")
+        cli.flush()
+        while (cli.available() < 4):
+            emu.clock.advance(1)
+        return cli.readBuf(4)
+
+    for dhcpTime in (1000, 3000):
+        for static in (False, True):
+            emu, WiFi, EspAtDrv = setup(join=False)
+            emu.dhcpTime = dhcpTime
+            if (static):
+                WiFi.config("192.168.1.77")
+            res, dt, writes, _ = measure(emu, usable, WiFi, emu)
+            report(f'{"static IP" if static else "DHCP"}, DHCP server {dhcpTime} ms', f'{dt} ms',
+                   f'{res!r}, {writes} writes')
+            check(res == b"ping", f'{"static IP" if static else "DHCP"}: the echo comes back')
+            if (static):
+                check(dt < dhcpTime, "a static IP doesn't wait for the DHCP server")
+
+    _, dt, writes, _ = measure(emu, WiFi.localIp)
+    report("localIp() with static IP", WiFi.localIp(), f'{writes} writes')
+    report("dnsIp()", str(WiFi.dnsIp()), f'dhcpIsEnabled {WiFi.dhcpIsEnabled()}')
+    WiFi.disconnect(False)
+    report("after disconnect", str(WiFi.dhcpIsEnabled()), f'emulator DHCP {emu.dhcp}')
+    check(emu.dhcp, "disconnect() turns DHCP on again")
+
+def bench_startup():
+    # import cost of the library for an application with status() and one TCP client
+    # (tools/startup.py measures the same on the board, for .py and .mpy)
+    print("startup: import WiFi, then status() and one TCP client")
+    OPTIONAL = {"EspAtAp", "EspAtPower", "EspAtQuery", "EspAtSsl", "EspAtTrace", "EspAtTune"}
+    CORE_BYTECODE = 40000    # import WiFi, user-037 split the core down to 30856 B
+    CLIENT_BYTECODE = 46000  # with EspAtPool, loaded by the first client
+    espemu.install(espemu.EspEmulator())
+    purge()
+
+    def loaded():
+        return sorted(n for n, m in sys.modules.items()
+                      if os.path.dirname(getattr(m, "__file__", None) or "") == LIB)
+
+    def codeSize() -> int:
+        # bytecode of the loaded library functions, it takes the RAM on the board
+        size = 0
+        codes = [f.__code__ for n in loaded() for f in vars(sys.modules[n]).values()
+                 if hasattr(f, "__code__")]
+        codes += [f.__code__ for n in loaded() for c in vars(sys.modules[n]).values()
+                  if isinstance(c, type) for f in vars(c).values() if hasattr(f, "__code__")]
+        seen = set()  # functions imported by name from another module count once
+        while (codes):
+            co = codes.pop()
+            if (id(co) not in seen):
+                seen.add(id(co))
+                size += len(co.co_code)
+                codes += [c for c in co.co_consts if hasattr(c, "co_code")]
+        return size
+
+    for name in ("WiFi", "EspAtDrv", "EspAtParse"):  # compiled once, then the .pyc import is timed
+        __import__(name)
+        del sys.modules[name]
+    t = time.perf_counter()
+    import WiFi
+    dt = time.perf_counter() - t
+    report("import WiFi", f'{dt * 1000:.1f} ms', f'{codeSize()} B bytecode, {" ".join(loaded())}')
+    check(codeSize() <= CORE_BYTECODE, f'import WiFi loads at most {CORE_BYTECODE} B bytecode')
+    check(not set(loaded()) & (OPTIONAL | {"EspAtPool"}), "import WiFi loads no optional module")
+    import EspAtDrv
+    check(EspAtDrv.pool is None, "import WiFi creates no buffer pool")
+
+    emu = espemu.install(espemu.EspEmulator())
+    emu.aps[SSID] = (PWD, "11:22:33:44:55:66", 6, -60)
+    emu.servers[7] = espemu.EchoServer
+    WiFi.init()
+    WiFi.begin(SSID, PWD)
+    WiFi.status()
+    cli = WiFi.Client()
+    check(EspAtDrv.pool is None and "EspAtPool" not in loaded(), "init() and status() load no buffer pool")
+    cli.connect("echo", 7)
+    cli.stop()
+    report("after status() and a client", f'{codeSize()} B bytecode', " ".join(loaded()))
+    check(codeSize() <= CLIENT_BYTECODE, f'status() and a TCP client load at most {CLIENT_BYTECODE} B bytecode')
+    check(EspAtDrv.pool.mem is not None, "the first client allocates the buffer pool")
+    check(not set(loaded()) & OPTIONAL, "status() and a TCP client load no optional module")
+    WiFi.localIp()
+    WiFi.sslConfig(4096)
+    WiFi.beginAP("ap")
+    report("after localIp(), sslConfig(), beginAP()", f'{codeSize()} B bytecode', " ".join(loaded()))
+
+def bench_replay():
+    # a session recorded with EspAtDrv.record() replayed to the unmodified driver
+    headers = [b"HTTP/1.1 200 OK"] + [f'X-Header-{i:02}: {"v" * 40}'.encode() for i in range(36)]
+    block = b"\r\n".join(headers) + b"\r\n\r\n"
+    server = espemu.DownloadServer(16384)
+    print("replay: header lines, a lost reply and a 16 KB download, recorded and replayed")
+
+    def session(uart, fault) -> tuple:
+        import WiFi
+        import EspAtDrv
+        WiFi.init(EspAtDrv.WIFI_SOFT_RESET)
+        WiFi.begin(SSID, PWD)
+        cli = WiFi.Client()
+        cli.connect("echo", 7)
+        cli.write(block)
+        cli.flush()
+        uart.clock.advance(200)
+        lines = 0
+        for line in cli:
+            if (line == b"\r\n"):
+                break
+            lines += 1
+        cli.stop()
+        fault()  # the reply to the next command is lost
+        status = WiFi.status()
+        cli.connect("files", 80)
+        n = cli.copyTo(io.BytesIO(), None, 1024, "crc32")
+        return lines, status, n, cli.copyDigest
+
+    def run(uart, fault, trace=None) -> tuple:
+        espemu.install(uart)
+        purge()
+        import EspAtDrv
+        if (trace):
+            EspAtDrv.record(trace)
+        t = time.process_time()
+        res = session(uart, fault)
+        cpu = time.process_time() - t
+        EspAtDrv.record(None)
+        return res, uart.clock.ms(), cpu
+
+    emu = espemu.EspEmulator()
+    emu.aps[SSID] = (PWD, "11:22:33:44:55:66", 6, -60)
+    emu.servers[7] = espemu.EchoServer
+    emu.servers[80] = lambda: server
+    trace = io.BytesIO()
+    expected, t, cpu = run(emu, emu.drop, trace)
+    records = replay.parse(trace.getvalue())
+    report("recorded", f'{t} ms', f'{cpu * 1000:.1f} ms CPU, {len(trace.getvalue())} B trace, '
+           f'{len(records)} records, {emu.rxBytes + emu.txBytes} B UART traffic')
+
+    for name, timing in (("replay with the recorded timing", True), ("replay as fast as possible", False)):
+        uart = replay.ReplayUART(records, timing)
+        res, t, cpu = run(uart, lambda: None)
+        report(name, f'{t} ms', f'{cpu * 1000:.1f} ms CPU, same result {res == expected}, '
+               f'{uart.mismatches} TX mismatches, all RX consumed {uart.done()}')
+        check(res == expected and uart.mismatches == 0 and uart.done(), f'{name}: same session')
+
+def bench_caps():
+    # capability probing of init() and the command variants it selects
+    print("caps: firmware capabilities probed by init()")
+    size = 65536
+    server = espemu.DownloadServer(size)
+    data = bytes(range(256)) * (size // 256)
+    for fw in ("AT", "ESP_ATMod", "AT2"):
+        emu = espemu.install(espemu.EspEmulator(firmware=fw))
+        emu.aps[SSID] = (PWD, "11:22:33:44:55:66", 6, -60)
+        emu.servers[9] = espemu.SinkServer
+        emu.servers[80] = lambda: server
+        emu.servers[443] = espemu.EchoServer
+        emu.sniRequired.add(443)
+        purge()
+        import WiFi
+        import EspAtDrv
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            ok, dt, writes, _ = measure(emu, WiFi.init)
+        print(log.getvalue(), end="")
+        caps = EspAtDrv.capabilities()
+        check("got ERROR" not in log.getvalue(), f'{fw}: unsupported probes are not logged as errors')
+        report(f'{fw} init', f'{dt} ms', f'{writes} commands, {WiFi.firmwareVersion()}')
+        _, dt, writes, _ = measure(emu, EspAtDrv.init, EspAtDrv.WIFI_SOFT_RESET)
+        report("  init again (capabilities kept)", f'{dt} ms', f'{writes} commands')
+        report("  maxSend, SNI, MFLN, UART_CUR", f'{caps.maxSend}',
+               f'{caps.sni} {caps.mfln} {caps.uartCur}')
+        WiFi.begin(SSID, PWD)
+
+        cli = WiFi.Client()
+        cli.connect("sink", 9)
+        t = emu.clock.ms()
+        w = emu.writes
+        for i in range(0, size, 8192):
+            cli.write(data[i:i + 8192])
+        cli.flush()
+        report("  64 KB upload in 8 KB writes", f'{size * 1000 // ms(emu, t)} B/s',
+               f'{emu.writes - w} UART writes')
+        cli.stop()
+
+        cli.connect("files", 80)
+        n, dt, _, _ = measure(emu, cli.copyTo, io.BytesIO(), None, 1024, "crc32")
+        report("  64 KB download", f'{n * 1000 // max(dt, 1)} B/s',
+               f'CRC {"ok" if cli.copyDigest == binascii.crc32(server.data) else "wrong"}')
+        check(cli.copyDigest == binascii.crc32(server.data), f'{fw}: download CRC ok')
+        cli.stop()
+
+        WiFi.sslConfig(4096, "tls.example")
+        commands = len(emu.commands)
+        ok = cli.connectSSL("tls.example", 443)
+        sent = [c.split("=")[0] for c in emu.commands[commands:]]
+        report("  connectSSL to a server requiring SNI", ok, " ".join(sent))
+        check(ok and ("AT+CIPSSLCSNI" in sent) == caps.sni, f'{fw}: SNI sent where the firmware has it')
+        cli.stop()
+
+        # the settings in the command names of the firmware, AT 2 rejects _CUR/_DEF
+        commands = len(emu.commands)
+        dns = WiFi.dnsIp()
+        ok = (WiFi.config("192.168.1.77") and WiFi.setDns("9.9.9.9", "1.1.1.1")
+              and WiFi.beginAP("emu-ap", "secret123") == WiFi.WL_AP_LISTENING and WiFi.endAP()
+              and WiFi.disconnect(False) == WiFi.WL_DISCONNECTED
+              and WiFi.begin(SSID, PWD) == WiFi.WL_CONNECTED)
+        settings = [c.split("=")[0] for c in emu.commands[commands:]
+                    if ("_CUR" in c or "_DEF" in c) and not c.startswith("AT+UART")]
+        report("  settings, DNS, soft AP, rejoin", ok, f'{dns} {" ".join(sorted(set(settings)))}')
+        check(ok and dns == list(emu.dhcpDns), f'{fw}: static IP, DNS and soft AP settings accepted')
+        check(not settings if fw == "AT2" else bool(settings), f'{fw}: _CUR commands only on AT 1')
+        check(emu.flashWrites == 0, f'{fw}: non-persistent settings not saved')
+
+def bench_sched():
+    # reply latency of a control link while a bulk link transfers 64 KB
+    print("sched: 50 control pings every 100 ms during a 64 KB bulk transfer")
+    size = 65536
+    data = bytes(range(256)) * (size // 256)
+
+    for direction in ("upload", "download"):
+        for name, prioritized in (("call order", False), ("bulk priority", True)):
+            emu, WiFi, EspAtDrv = setup()
+            pings = espemu.PingServer(50, 100)
+            emu.servers[5000] = lambda: pings
+            emu.servers[80] = lambda: espemu.DownloadServer(size, rate=20000)
+            control = WiFi.Client()
+            bulk = WiFi.Client()
+
+            def serve(cli=None):
+                while (control.available()):
+                    line = control.readline()
+                    if (not line):
+                        break  # None until the line fits in the pool share
+                    control.write(line)
+                control.flush()
+
+            if (prioritized):
+                control.setPriority(EspAtDrv.PRIORITY_INTERACTIVE)
+                bulk.setPriority(EspAtDrv.PRIORITY_BULK)
+                WiFi.setSliceCallback(serve)
+            control.connect("control", 5000)
+            t = emu.clock.ms()
+            if (direction == "upload"):
+                bulk.connect("sink", 9)
+                for i in range(0, size, 8192):
+                    bulk.write(data[i:i + 8192])
+                    serve()
+                bulk.flush()
+            else:
+                bulk.connect("files", 80)
+                while (bulk.copyTo(io.BytesIO(), 8192, 8192)):
+                    serve()
+            rate = size * 1000 // ms(emu, t)
+            while (len(pings.latencies) < pings.count and ms(emu, t) < 20000):
+                serve()
+                emu.clock.advance(10)
+            lat = sorted(pings.latencies)
+            report(f'{direction}, {name}', f'{rate} B/s',
+                   f'ping p50 {lat[len(lat) // 2]} ms, p95 {lat[len(lat) * 95 // 100]} ms, '
+                   f'max {lat[-1]} ms, {len(lat)}/{pings.count} answered')
+            check(len(lat) == pings.count, f'{direction}, {name}: all pings answered')
+            if (prioritized):
+                check(lat[len(lat) * 95 // 100] < p95, f'{direction}: slices cut the ping p95')
+            p95 = lat[len(lat) * 95 // 100]
+
+def bench_ws():
+    # WebSocket messages against a new SSL connection per value
+    print("ws: WebSocket echo, latency and throughput")
+    N = 50
+    value = b'{"temp": 21.5, "seq": 0000000}'
+
+    emu, WiFi, EspAtDrv = setup()
+    emu.servers[443] = espemu.EchoServer
+    WiFi.sslConfig(4096)  # for the default 3 KB certificate chain
+    cli = WiFi.Client()
+    t = emu.clock.ms()
+    for i in range(N):
+        cli.connectSSL("dashboard", 443)
+        cli.write(value)
+        cli.flush()
+        resp = b''
+        while (len(resp) < len(value)):
+            resp += cli.readBuf(len(value) - len(resp))
+            emu.clock.advance(1)
+        cli.stop()
+    report("new SSL link per value", f'{ms(emu, t) // N} ms', "per value")
+
+    emu, WiFi, EspAtDrv = setup()
+    import WsClient
+    server = espemu.WsEchoServer(fragment=512, pingInterval=1000)
+    emu.servers[80] = lambda: server
+    ws = WsClient.WsClient()
+    got = []
+    ws.setCallback(lambda msg, binary: got.append(bytes(msg)))
+    ok, dt, writes, _ = measure(emu, ws.connect, "dashboard", 80, "/live")
+    report("connect with handshake", f'{dt} ms', f'ok {ok}')
+    check(ok, "WebSocket handshake")
+
+    lat = []
+    commands = len(emu.commands)
+    for i in range(N):
+        t = emu.clock.ms()
+        ws.send(value)
+        while (len(got) <= i):
+            ws.loop()
+            emu.clock.advance(1)
+        lat.append(ms(emu, t))
+    lat.sort()
+    report(f'{len(value)} B message round trip', f'{lat[N // 2]} ms',
+           f'p95 {lat[N * 95 // 100]} ms, {(len(emu.commands) - commands) / N:.1f} AT commands per message')
+
+    got.clear()
+    data = bytes(range(256)) * 4
+    t = emu.clock.ms()
+    cpu = time.process_time()
+    for i in range(N):
+        ws.send(data)
+    while (len(got) < N and ms(emu, t) < 60000):
+        ws.loop()
+        emu.clock.advance(1)
+    cpu = time.process_time() - cpu
+    report(f'{N} x 1 KB pipelined echo', f'{N * len(data) * 2000 // ms(emu, t)} B/s',
+           f'both directions, {cpu * 1000:.0f} ms CPU, all equal {all(m == data for m in got)}')
+    check(len(got) == N and all(m == data for m in got), "pipelined WebSocket echo")
+
+    got.clear()
+    big = bytes(range(256)) * 12
+    ws.send(big)
+    while (not got):
+        ws.loop()
+        emu.clock.advance(1)
+    report("3 KB message, fragmented both ways", got[0] == big,
+           f'{sum(1 for op, m in server.messages if len(m) == len(big))} at server')
+    check(got[0] == big, "fragmented WebSocket message")
+
+    got.clear()
+    emu.busy(3000)  # the firmware stops taking data in the middle of the message
+    queued = ws.send(big)
+    connected = ws.isConnected
+    hello = ws.send(b"hello")  # False while the rest of big waits
+    t = emu.clock.ms()
+    while (len(got) < 2 and ms(emu, t) < 10000):
+        ws.loop()
+        if (not hello):
+            hello = ws.send(b"hello")
+        emu.clock.advance(1)
+    report("3 KB message through a 3 s busy period", f'{ms(emu, t)} ms',
+           f'queued {queued}, {len(server.buf)} B unparsed at server')
+    check(queued and connected and got == [big, b"hello"] and not server.buf,
+          "a message interrupted by the busy firmware goes out whole, the next one behind it")
+
+    ws.ping()
+    t = emu.clock.ms()
+    while (ws.pingSent and ms(emu, t) < 2000):
+        ws.loop()
+        emu.clock.advance(1)
+    report("ping round trip", f'{ws.pingRtt} ms', f'{server.pongs} pongs to server pings, '
+           f'{server.unmasked} unmasked frames')
+    check(server.pongs > 0 and server.unmasked == 0, "pongs to the server, all frames masked")
+    ws.close()
+    report("close", server.closeCode)
+    check(server.closeCode == 1000, "WebSocket close")
+
+###################################
+
+def bench_autotune():
+    # echo throughput and latency with the default settings and the tuned ones
+    print("autotune: 16 KB echo and 32 B round trip, wiring clean up to 460800 Bd")
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), "espat.json")
+    size = 16384
+    data = bytes(range(256)) * (size // 256)
+    emu = espemu.install(espemu.EspEmulator())
+    emu.aps[SSID] = (PWD, "11:22:33:44:55:66", 6, -60)
+    emu.servers[7] = espemu.EchoServer
+    emu.maxBaud = 460800
+
+    def boot():
+        purge()
+        import WiFi
+        import EspAtDrv
+        EspAtDrv.profileFile = path
+        _, dt, _, _ = measure(emu, WiFi.init)
+        WiFi.begin(SSID, PWD)
+        return WiFi, EspAtDrv, dt
+
+    def echo(cli, payload) -> int:
+        t = emu.clock.ms()
+        cli.write(payload)
+        cli.flush()
+        resp = b""
+        while (len(resp) < len(payload) and ms(emu, t) < 10000):
+            if (cli.available()):
+                resp += cli.readBuf(len(payload) - len(resp))
+        return ms(emu, t) if resp == payload else None
+
+    def run(WiFi, EspAtDrv, name):
+        cli = WiFi.Client()
+        cli.connect("echo", 7)
+        latency = [echo(cli, data[:32]) for i in range(10)]
+        dt = echo(cli, data)
+        cli.stop()
+        report(f'{name} at {EspAtDrv.uartBaud} Bd, recv {EspAtDrv.recvSize}',
+               f'{size * 1000 // dt} B/s' if dt else "failed",
+               f'round trip {sum(latency) // len(latency)} ms' if all(latency) else "")
+        check(dt and all(latency), f'{name}: echo intact')
+        return size * 1000 // dt if dt else 0
+
+    purge()
+    import EspAtDrv
+    profile = EspAtDrv.autotune("echo", 7)
+    report("autotune before init()", f'{profile}', f'error {EspAtDrv.lastErrorCode}')
+    check(profile == None and EspAtDrv.lastErrorCode == EspAtDrv.Error_NOT_INITIALIZED,
+          "autotune before init() fails with Error_NOT_INITIALIZED")
+
+    WiFi, EspAtDrv, dt = boot()
+    base = run(WiFi, EspAtDrv, "default")
+    t = emu.clock.ms()
+    profile = EspAtDrv.autotune("echo", 7)
+    report("autotune", f'{ms(emu, t)} ms', f'{profile}')
+    import EspAtTune
+    for baud, recvSize, rate, latency in EspAtTune.results:
+        report(f'  {baud} Bd, recv {recvSize}', f'{rate} B/s', f'{latency} ms')
+    check(run(WiFi, EspAtDrv, "tuned") > base * 2, "the tuned profile doubles the throughput")
+
+    WiFi, EspAtDrv, dt = boot()
+    report("init, module still at the tuned rate", f'{dt} ms', f'{EspAtDrv.uartBaud} Bd')
+    emu.powerOn()
+    WiFi, EspAtDrv, dt = boot()
+    report("init, module power cycled", f'{dt} ms', f'{EspAtDrv.uartBaud} Bd')
+    check(EspAtDrv.uartBaud == profile["baud"], "init() applies the saved profile")
+    run(WiFi, EspAtDrv, "after restart")
+    emu.hang()
+    t = emu.clock.ms()
+    WiFi.status()
+    while (not EspAtDrv.watchdog() and ms(emu, t) < 60000):
+        emu.clock.advance(100)
+    report("watchdog reset of a hung module", f'{ms(emu, t)} ms', f'{EspAtDrv.uartBaud} Bd')
+    check(EspAtDrv.uartBaud == profile["baud"], "the watchdog reset restores the tuned rate")
+    WiFi.begin(SSID, PWD)
+    run(WiFi, EspAtDrv, "after recovery")
+    os.remove(path)
+
+def bench_power():
+    # ping and command latency, duty cycle and current of the power profiles
+    print("power: AT 2, 20 pings every 500 ms, status() and available() polled every 100 ms")
+    profiles = (("low latency", 0, True), ("balanced", 1, True), ("low power", 2, True),
+                ("low power, fixed deadlines", 2, False))
+    last = 1000
+    for name, profile, wakeAware in profiles:
+        emu, WiFi, EspAtDrv = setup(join=False, firmware="AT2")
+        pings = espemu.PingServer(20, 500)
+        emu.servers[5000] = lambda: pings
+        WiFi.setPowerProfile(profile)
+        if (not wakeAware):
+            EspAtDrv.wakeMargin = 0
+        commands = len(emu.commands)
+        joined = WiFi.begin(SSID, PWD) == WiFi.WL_CONNECTED
+        join = [c for c in emu.commands[commands:] if c.startswith("AT+CWJAP")]
+        report("  join", joined, f'{" ".join(join)}, listen interval {emu.listenInterval}')
+        check(joined and emu.listenInterval == EspAtDrv.listenInterval,
+              f'{name}: AT+CWJAP sets the listen interval {EspAtDrv.listenInterval}')
+        control = WiFi.Client()
+        control.connect("control", 5000)
+
+        mark = emu.dutyMark()
+        commands = len(emu.commands)
+        wedged = 0
+        t = emu.clock.ms()
+        while (len(pings.latencies) < pings.count and ms(emu, t) < 30000):
+            WiFi.status()
+            while (control.available()):
+                line = control.readline()
+                if (not line):
+                    break
+                control.write(line)
+            control.flush()
+            if (EspAtDrv.wedged):
+                wedged += 1
+                EspAtDrv.watchdog()
+            emu.clock.advance(100)
+        cpu, radio = emu.duty(mark)
+        perSecond = (len(emu.commands) - commands) * 1000 // ms(emu, t)
+
+        cmd = []
+        for i in range(10):  # a command after an idle second
+            emu.clock.advance(1000)
+            c = emu.clock.ms()
+            EspAtDrv.statusSnapshot(0)
+            cmd.append(ms(emu, c))
+            if (EspAtDrv.wedged):
+                wedged += 1
+                EspAtDrv.watchdog()
+        cmd.sort()
+        lat = sorted(pings.latencies) or [0]
+        # ESP8266 datasheet: 0.9 mA light sleep, 15 mA modem sleep, about 70 mA receiving
+        current = 0.9 + 14.1 * cpu + 55 * radio
+        report(name, f'{current:.1f} mA', f'CPU {cpu:.0%}, radio {radio:.0%}, {perSecond} AT commands/s')
+        report("  ping round trip", f'{lat[len(lat) // 2]} ms',
+               f'p95 {lat[len(lat) * 95 // 100]} ms, {len(pings.latencies)}/{pings.count} answered')
+        report("  command after 1 s idle", f'{cmd[5]} ms', f'max {cmd[-1]} ms, wedged {wedged} times')
+        check(len(pings.latencies) == pings.count, f'{name}: all pings answered')
+        if (wakeAware):
+            check(wedged == 0, f'{name}: the deadlines cover the wake-up')
+            check(current < last, f'{name}: less current than the previous profile')
+            last = current
+
+def bench_pool():
+    # five links sharing the clients' buffer pool, one reads far more than the others
+    print("pool: 4 links echo 541 B lines, 1 link reads a 64 KB download with readuntil(8192)")
+    N = 40
+    line = bytes(range(32, 122)) * 6 + b"\n"
+    for budget in (12288, 6144):
+        emu, WiFi, EspAtDrv = setup()
+        EspAtDrv.setPoolBudget(budget)
+        emu.servers[80] = lambda: espemu.DownloadServer(65536, rate=50000)
+        echo = [WiFi.Client() for i in range(4)]
+        for cli in echo:
+            cli.connect("echo", 7)
+        bulk = WiFi.Client()
+        bulk.connect("files", 80)
+
+        intact = 0
+        chunks = []
+        partial = 0  # data without the delimiter while the link was connected
+        waits = 0
+        t = emu.clock.ms()
+        for i in range(N):
+            for cli in echo:
+                cli.write(line)
+                cli.flush()
+            for cli in echo:
+                if (cli.readline(1024) == line):
+                    intact += 1
+            data = bulk.readuntil(b"\r\n\r\n", 8192, 100)  # not in the data
+            if (data is None):  # over its share, the queued data are taken by readBuf()
+                waits += 1
+                data = bulk.readBuf(bulk.rx.n)
+            elif (data and EspAtDrv.connected(bulk.linkId)):
+                partial += 1
+            chunks.append(len(data))
+        dt = ms(emu, t)
+        blocks, size, used, high, denied, peaks = WiFi.poolStatistics()
+        report(f'{budget // 1024} KB pool', f'{dt} ms',
+               f'{intact}/{len(echo) * N} lines intact, bulk {sum(chunks)} B, max {max(chunks)} B per read')
+        report("  blocks in use", f'{high}/{blocks}',
+               f'high-water, {denied} refused, per link {list(peaks)}')
+        report("  readuntil() over the share", waits, f'None, {partial} partial')
+        check(intact == len(echo) * N, f'{budget // 1024} KB pool: the echo links are not starved')
+        check(max(chunks) <= -(-blocks // 5) * size, f'{budget // 1024} KB pool: the bulk link stays in its share')
+        check(waits and not partial,
+              f'{budget // 1024} KB pool: readuntil() over the share returns None, not a partial line')
+
+        pool = EspAtDrv.pool
+        shares = [pool.share(i) for i in range(5)]
+        check(sum(shares) == blocks, f'{budget // 1024} KB pool: the shares {shares} use all blocks')
+        cli = echo[1]
+        held = pool.held[cli.linkId]
+        cli.rx.space()
+        cli.rx.commit(0)  # as a read which got nothing
+        check(pool.held[cli.linkId] == held, f'{budget // 1024} KB pool: a block nothing was read into goes back')
+        cli.write(line)
+        avail = cli.availableForWrite()
+        w = emu.writes
+        k = cli.write(bytes(avail))
+        report("  availableForWrite() after a line", avail, f'{k} B taken, {emu.writes - w} UART writes')
+        check(k == avail and emu.writes == w,
+              f'{budget // 1024} KB pool: availableForWrite() bytes are taken without sending')
+        cli.flush()
+
+        cli = echo[2]
+        cli.write(line)
+        cli.flush()
+        t = emu.clock.ms()
+        while (cli.available() == 0 and emu.clock.ms() - t < 1000):
+            emu.clock.advance(10)
+        taken = [pool.alloc(cli.linkId) for i in range(pool.room(cli.linkId))]  # the link over its share
+        peeked = (cli.peek(), cli.peek())
+        b = cli.read()
+        for i in taken:
+            pool.release(cli.linkId, i)
+        rest = cli.readline(1024)
+        report("  peek() over the share", peeked[0], f'read() {b}, then {len(rest)} B line')
+        check(peeked == (line[0], line[0]) and b == line[0] and bytes((b,)) + rest == line,
+              f'{budget // 1024} KB pool: peek() over the share returns the byte read() returns next')
+
+def main(names):
+    benchmarks = {n[6:]: f for n, f in globals().items() if n.startswith("bench_")}
+    for name in names or benchmarks:
+        benchmarks[name]()
+    if (failures):
+        print(f'{len(failures)} claims violated:')
+        for claim in failures:
+            print(f'  {claim}')
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,1029 @@
+# espemu.py
+#
+# ESP8285 AT firmware emulator for running the driver on CPython
+#
+# install() puts stand-ins for the MicroPython modules used by the driver
+# (machine, micropython, utime) into sys.modules, so lib/EspAtDrv.py and
+# lib/WiFi.py import unmodified. machine.UART returns the emulator, which
+# answers AT commands the way ESP_ATMod / AT 1.7 does in passive receive mode.
+#
+# Time is virtual: blocking UART reads, UART transfers and utime.sleep()
+# advance the emulator clock instead of sleeping, so benchmarks are fast
+# and deterministic. Faults (stalls, hangs, busy periods, dropped replies)
+# can be injected to measure the driver's worst-case behavior.
+#
+# Version:
+#  0.1.0: initial version
+#  0.2.0: TLS handshake model with AT+CIPSSLSIZE and AT+CIPSSLCSNI
+#  0.3.0: busy periods answered with "busy p..."
+#  0.3.1: AT+CIPSTATUS reports the resolved remote IP as the firmware does
+#  0.4.0: static IP and DNS, DHCP time of the join
+#  0.5.0: Espressif AT 1.7, AT 2 or ESP_ATMod identity, AT+<cmd>=? test commands, AT+UART_CUR
+#  0.5.1: PingServer measuring the reply latency of a control connection
+#  0.6.0: WebSocket echo server, micropython.native stand-in
+#  0.7.0: separate baud rates of host and module, line errors above maxBaud
+#  0.8.0: AT+SLEEP modem and light sleep with beacon wake-ups, duty cycle statistics
+#  0.9.0: AT 2 rejects the _CUR/_DEF commands, AT+SYSSTORE and the settings it saves
+
+import base64
+import hashlib
+import random
+import sys
+import types
+
+LINKS_COUNT = 5
+SLEEP_NONE = 0
+SLEEP_LIGHT = 1
+SLEEP_MODEM = 2
+STORED_SETTINGS = ("CWMODE", "CWJAP", "CWSAP", "CIPSTA", "CIPDNS", "CWDHCP")  # AT 2, by AT+SYSSTORE
+
+###################################
+
+class Clock:
+    def __init__(self):
+        self.us = 0
+
+    def ms(self) -> int:
+        return self.us // 1000
+
+    def advance(self, ms: float):
+        self.us += int(ms * 1000)
+
+    def advanceTo(self, us: int):
+        if (us > self.us):
+            self.us = us
+
+###################################
+
+class EchoServer:
+    # remote peer which sends back everything it receives
+    def connected(self, link):
+        pass
+
+    def received(self, link, data: bytes):
+        link.send(data)
+
+class SinkServer:
+    # remote peer which swallows everything it receives
+    def __init__(self):
+        self.data = bytearray()
+
+    def connected(self, link):
+        pass
+
+    def received(self, link, data: bytes):
+        self.data.extend(data)
+
+class PingServer:
+    # remote peer which sends b"<n>\n" every interval ms and takes the same
+    # line back as the reply, latencies holds the ms from sending to the reply
+    def __init__(self, count: int = 50, interval: float = 100):
+        self.count = count
+        self.interval = interval
+        self.sent = {}
+        self.latencies = []
+        self.pending = bytearray()
+
+    def connected(self, link):
+        for n in range(self.count):
+            link.emu.at(self.interval * (n + 1), self.ping, link, n)
+
+    def ping(self, link, n: int):
+        self.sent[n] = link.emu.clock.ms()
+        link.send(b'%d\n' % n)
+
+    def received(self, link, data: bytes):
+        self.pending.extend(data)
+        while (b'\n' in self.pending):
+            i = self.pending.index(b'\n')
+            n = int(self.pending[:i])
+            del self.pending[:i + 1]
+            self.latencies.append(link.emu.clock.ms() - self.sent.pop(n))
+
+class WsEchoServer:
+    # WebSocket server which sends every message back after the handshake,
+    # in fragments of `fragment` bytes if set, and pings every pingInterval ms.
+    # Unmasked client frames (a protocol error) are counted in unmasked.
+    def __init__(self, fragment: int = 0, pingInterval: float = 0):
+        self.fragment = fragment
+        self.pingInterval = pingInterval
+        self.buf = bytearray()
+        self.upgraded = False
+        self.messages = []  # (opcode, message) received
+        self.msg = None
+        self.pongs = 0
+        self.unmasked = 0
+        self.closeCode = None
+
+    def connected(self, link):
+        pass
+
+    def ping(self, link):
+        if (link.open and self.upgraded and self.closeCode is None):
+            link.send(b'\x89\x04ping')
+            link.emu.at(self.pingInterval, self.ping, link)
+
+    def received(self, link, data: bytes):
+        self.buf.extend(data)
+        if (not self.upgraded):
+            end = self.buf.find(b'\r\n\r\n')
+            if (end < 0):
+                return
+            head = bytes(self.buf[:end]).decode()
+            del self.buf[:end + 4]
+            key = [l.split(":", 1)[1].strip() for l in head.split("\r\n")
+                   if l.lower().startswith("sec-websocket-key:")][0]
+            accept = base64.b64encode(hashlib.sha1((key + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11")
+                                                   .encode()).digest()).decode()
+            link.send(f'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                      f'Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n'.encode())
+            self.upgraded = True
+            if (self.pingInterval):
+                link.emu.at(self.pingInterval, self.ping, link)
+        while (len(self.buf) >= 2):
+            b0, b1 = self.buf[0], self.buf[1]
+            n, pos = b1 & 0x7F, 2
+            if (n == 126):
+                n, pos = int.from_bytes(self.buf[2:4], "big"), 4
+            elif (n == 127):
+                n, pos = int.from_bytes(self.buf[2:10], "big"), 10
+            if (b1 & 0x80):
+                key = self.buf[pos:pos + 4]
+                pos += 4
+            else:
+                self.unmasked += 1
+                key = b'\0\0\0\0'
+            if (len(self.buf) < pos + n):
+                return
+            payload = bytes(c ^ key[i & 3] for i, c in enumerate(self.buf[pos:pos + n]))
+            del self.buf[:pos + n]
+            op = b0 & 0x0F
+            if (op == 0x9):
+                link.send(self.frame(0xA, payload))
+            elif (op == 0xA):
+                self.pongs += 1
+            elif (op == 0x8):
+                self.closeCode = int.from_bytes(payload[:2], "big") if payload else 1005
+                link.send(self.frame(0x8, payload))
+                link.close()
+            elif (op == 0x0 or op in (0x1, 0x2)):
+                if (op):
+                    self.msg = [op, bytearray()]
+                self.msg[1].extend(payload)
+                if (b0 & 0x80):
+                    op, msg = self.msg
+                    self.msg = None
+                    self.messages.append((op, bytes(msg)))
+                    self.echo(link, op, msg)
+
+    def echo(self, link, op: int, msg: bytes):
+        step = self.fragment or max(len(msg), 1)
+        out = bytearray()
+        for i in range(0, max(len(msg), 1), step):
+            last = i + step >= len(msg)
+            out += self.frame((op if i == 0 else 0) | (0x80 if last else 0), msg[i:i + step], False)
+        link.send(out)
+
+    @staticmethod
+    def frame(b0: int, payload: bytes, fin: bool = True) -> bytes:
+        n = len(payload)
+        head = bytes((b0 | (0x80 if fin else 0),))
+        if (n < 126):
+            head += bytes((n,))
+        elif (n < 65536):
+            head += bytes((126,)) + n.to_bytes(2, "big")
+        else:
+            head += bytes((127,)) + n.to_bytes(8, "big")
+        return head + payload
+
+class DownloadServer:
+    # remote peer which sends size bytes on connect and closes the connection,
+    # in TCP segments at the given rate in bytes/s
+    def __init__(self, size: int = 65536, rate: int = 200000, segment: int = 1460):
+        self.size = size
+        self.rate = rate
+        self.segment = segment
+        self.data = bytes((i * 7 + (i >> 8)) & 255 for i in range(size))
+
+    def connected(self, link):
+        delay = link.emu.rtt / 2
+        for i in range(0, self.size, self.segment):
+            chunk = self.data[i:i + self.segment]
+            link.send(chunk, delay)
+            delay += len(chunk) * 1000 / self.rate
+        link.close(delay)
+
+    def received(self, link, data: bytes):
+        pass
+
+class MqttBroker:
+    # MQTT 3.1.1 broker stand-in: acknowledges CONNECT, QoS 1 PUBLISH, SUBSCRIBE
+    # and PINGREQ, and delivers publishes back to the link if it subscribed
+    def __init__(self):
+        self.buf = bytearray()
+        self.subs = set()
+        self.published = []  # (topic, message, qos)
+
+    def connected(self, link):
+        pass
+
+    def received(self, link, data: bytes):
+        self.buf.extend(data)
+        out = bytearray()
+        while (len(self.buf) >= 2):
+            length, shift, pos = 0, 0, 1
+            while (pos < len(self.buf)):
+                b = self.buf[pos]
+                length |= (b & 0x7F) << shift
+                shift += 7
+                pos += 1
+                if (not b & 0x80):
+                    break
+            else:
+                break
+            if (len(self.buf) < pos + length):
+                break
+            header, body = self.buf[0], bytes(self.buf[pos:pos + length])
+            del self.buf[:pos + length]
+            type = header & 0xF0
+            if (type == 0x10):
+                out += b'\x20\x02\x00\x00'
+            elif (type == 0x30):
+                tl = (body[0] << 8) | body[1]
+                topic = body[2:2 + tl].decode()
+                qos = (header >> 1) & 3
+                pos = 2 + tl + (2 if qos else 0)
+                self.published.append((topic, body[pos:], qos))
+                if (qos):
+                    out += b'\x40\x02' + body[2 + tl:4 + tl]
+                if (topic in self.subs):  # delivered with QoS 0
+                    fwd = body[:2 + tl] + body[pos:]
+                    out.append(header & 0xF9)
+                    n = len(fwd)
+                    while True:
+                        out.append((n & 0x7F) | (0x80 if n > 0x7F else 0))
+                        n >>= 7
+                        if (not n):
+                            break
+                    out += fwd
+            elif (type == 0x80):
+                tl = (body[2] << 8) | body[3]
+                self.subs.add(body[4:4 + tl].decode())
+                out += b'\x90\x03' + body[:2] + b'\x00'
+            elif (type == 0xC0):
+                out += b'\xd0\x00'
+        if (out):
+            link.send(out)
+
+class Link:
+    def __init__(self, emu, linkId: int, type: str, host: str, port: int, server):
+        self.emu = emu
+        self.linkId = linkId
+        self.type = type
+        self.host = host
+        self.ip = host if host.replace(".", "").isdigit() else f'93.184.{len(host)}.{port % 250 + 1}'  # "DNS"
+        self.port = port
+        self.localPort = 50000 + linkId
+        self.server = server
+        self.rx = bytearray()  # data held by the module until AT+CIPRECVDATA
+        self.open = True
+
+    def send(self, data: bytes, delay: float = None):
+        # remote peer sends data, it arrives after the network round trip
+        self.emu.at(self.emu.rtt / 2 if delay is None else delay, self._arrive, bytes(data))
+
+    def close(self, delay: float = None):
+        # remote peer closes the connection
+        self.emu.at(self.emu.rtt / 2 if delay is None else delay, self._closed)
+
+    def _arrive(self, data: bytes):
+        if (not self.open or self.emu.deferred(self._arrive, data)):
+            return
+        self.rx.extend(data)
+        self.emu.reply(f'+IPD,{self.linkId},{len(self.rx)}\r\n')  # passive mode: all buffered data
+
+    def _closed(self):
+        if (not self.open or self.emu.deferred(self._closed)):
+            return
+        self.open = False
+        if (not self.rx):
+            self.emu.links[self.linkId] = None
+        self.emu.reply(f'{self.linkId},CLOSED\r\n')
+
+###################################
+
+class EspEmulator:
+    def __init__(self, baudrate: int = 115200, firmware: str = "AT"):
+        self.clock = Clock()
+        self.defaultBaud = baudrate  # rate of the module after a reset
+        self.hostBaud = baudrate     # rate of the host's UART, set by machine.UART
+        self.maxBaud = None    # highest rate the wiring carries cleanly, None for any
+        self.lineErrorRate = 0.002  # probability of a corrupted byte above maxBaud
+        self.lineRandom = random.Random(2)
+        # "AT": Espressif AT 1.7.4, "ESP_ATMod": ESP_ATMod 0.6 (firmware/ESP_ATMod.0.6.bin),
+        # which has no AT+CIPSSLCSNI and AT+SLEEP and takes the SNI from the host of
+        # AT+CIPSTART, "AT2": the AT 2 data commands (+CIPRECVDATA:<len>, 8 KB
+        # AT+CIPSEND), the listen interval of AT+CWJAP and AT+SYSSTORE, the
+        # _CUR/_DEF commands are rejected except AT+UART_CUR/_DEF
+        self.firmware = firmware
+        self.maxSend = 8192 if firmware == "AT2" else 2048
+        self.unsupported = {"CIPSSLCSNI", "SLEEP"} if firmware == "ESP_ATMod" else set()
+        if (firmware != "AT2"):
+            self.unsupported.add("SYSSTORE")
+        self.flashWrites = 0  # AT 2 settings saved with AT+SYSSTORE=1
+        self.timeout = 1000
+        self.timeout_char = 100
+
+        # emulated network
+        self.aps = {}          # ssid -> (password, bssid, channel, rssi)
+        self.servers = {}      # port -> factory of remote peer objects
+        self.rtt = 20          # network round trip in ms
+        self.joinTime = 500    # time to associate in ms
+        self.dhcpTime = 1000   # time to get an IP from DHCP after the association in ms
+        self.sslTime = 800     # TLS handshake time in ms, without the certificate transfer
+        self.certChains = {}   # port -> certificate chain size in bytes (default 3000)
+        self.sniRequired = set()  # ports whose server rejects handshakes without SNI
+        self.sslHeap = 20000   # heap left for the TLS buffers of the open SSL links
+        self.sslFailRate = 0.0 # probability of a handshake failing anyway
+        self.beaconTime = 102.4  # beacon interval of the AP in ms
+        self.dtim = 1          # DTIM period of the AP in beacons, the sleep cadence without a listen interval
+        self.beaconOn = 3      # ms the module is awake to receive a beacon
+        self.radioTail = 50    # ms the radio stays on after traffic
+        self.sleepIdle = 20    # ms without UART input before the CPU sleeps again in light sleep
+        self.random = random.Random(1)
+        self.cmdTime = 1       # time to process a simple command in ms
+        self.dhcpIp = ("192.168.1.50", "192.168.1.1", "255.255.255.0")
+        self.dhcpDns = ("192.168.1.1", "8.8.8.8")
+
+        # statistics
+        self.writes = 0
+        self.txBytes = 0
+        self.rxBytes = 0
+        self.commands = []
+        self.onUs = [0, 0]     # us the CPU and the radio were on outside the beacons
+        self.onUntil = [0, 0]
+
+        # injected faults
+        self.stallUntil = 0    # in us, replies are held until then
+        self.hangUntil = None  # in us, input is dropped until then (-1 until AT+RST)
+        self.dropReplies = 0
+        self.busyUntil = 0     # in us, commands are dropped with "busy p..." until then
+        self.busyRate = 0.0    # probability of a busy period after a send
+        self.busyTime = 0      # length of these busy periods in ms
+
+        self.powerOn()
+
+    def powerOn(self):
+        self.baudrate = self.defaultBaud  # rate of the module, AT+UART_CUR
+        self.echo = True
+        self.mode = 1
+        self.ap = None
+        self.softap = None
+        self.stations = {}     # MAC -> IP of stations connected to the soft AP
+        self.dhcp = True       # station DHCP client, off with a static IP
+        self.ip = self.dhcpIp
+        self.dns = self.dhcpDns
+        self.links = [None] * LINKS_COUNT
+        self.closeMode = [0] * LINKS_COUNT
+        self.sslSize = 2048    # AT+CIPSSLSIZE
+        self.sni = [None] * LINKS_COUNT
+        self.events = []       # (time in us, sequence, function, argument)
+        self.eventTime = None  # us the running event was due, pump() runs it later
+        self.seq = 0
+        self.rxbuf = bytearray()
+        self.rxFree = self.clock.us  # time when the TX line of the module is free
+        self.inbuf = bytearray()
+        self.sendLink = None   # link id while waiting for AT+CIPSEND data
+        self.sendLen = 0
+        # AT+SLEEP. The firmware starts in modem sleep, the emulator without
+        # sleep, so benchmarks which don't set it see no wake-up delays.
+        self.sleepMode = SLEEP_NONE
+        self.listenInterval = 0  # AT 2 AT+CWJAP parameter, 0 for the DTIM period
+        self.sysStore = True     # AT 2 AT+SYSSTORE, the settings are saved after a restart
+        self.wakePending = False
+
+    # ---- fault injection
+
+    def stall(self, ms: float):
+        # the module is busy, replies are delayed until the stall ends
+        self.stallUntil = self.clock.us + int(ms * 1000)
+
+    def hang(self, ms: float = None):
+        # the module ignores all input, for ms or (if None) until AT+RST
+        self.hangUntil = -1 if ms is None else self.clock.us + int(ms * 1000)
+
+    def busy(self, ms: float):
+        # the module is processing, it drops commands with "busy p..." for ms
+        self.busyUntil = self.clock.us + int(ms * 1000)
+
+    def drop(self, count: int = 1):
+        # the next count replies are lost
+        self.dropReplies += count
+
+    # ---- sleep
+
+    def wakePeriod(self) -> float:
+        # ms between the beacons the sleeping module wakes up for
+        return self.beaconTime * (self.listenInterval or self.dtim)
+
+    def nextWake(self, us: int) -> int:
+        # us of the first beacon from us on the module wakes up for
+        period = int(self.wakePeriod() * 1000)
+        return -(-us // period) * period
+
+    def keepAwake(self, ms: float, radio: bool = True):
+        # the radio (with the CPU) or only the CPU stays on for ms from now
+        end = self.clock.us + int(ms * 1000)
+        for i in ((0, 1) if radio else (0,)):
+            start = max(self.clock.us, self.onUntil[i])
+            if (end > start):
+                self.onUs[i] += end - start
+                self.onUntil[i] = end
+
+    def deferred(self, fn, *args) -> bool:
+        # A sleeping radio receives the data the AP buffered for it at the next
+        # beacon it wakes up for. Returns True if fn(*args) was moved there.
+        now = self.clock.us if self.eventTime is None else self.eventTime
+        if (self.sleepMode != SLEEP_NONE and now >= self.onUntil[1]):
+            wake = self.nextWake(now)
+            if (wake > now):
+                self.at((wake - self.clock.us) / 1000, fn, *args)
+                return True
+        self.keepAwake(self.radioTail)
+        return False
+
+    def dutyMark(self) -> tuple:
+        return (self.clock.us, list(self.onUs))
+
+    def duty(self, mark: tuple) -> tuple:
+        # fractions of the time since dutyMark() the CPU and the radio were on
+        if (self.sleepMode == SLEEP_NONE):
+            return 1.0, 1.0
+        t0, on0 = mark
+        elapsed = max(self.clock.us - t0, 1)
+        beacons = elapsed / self.wakePeriod() * self.beaconOn
+        radio = min((self.onUs[1] - on0[1] + beacons) / elapsed, 1.0)
+        if (self.sleepMode == SLEEP_MODEM):
+            return 1.0, radio
+        return min((self.onUs[0] - on0[0] + beacons) / elapsed, 1.0), radio
+
+    def _wakeUp(self):
+        # UART input which arrived during light sleep is processed at the beacon
+        self.wakePending = False
+        self.keepAwake(self.sleepIdle, False)
+        self.process()
+
+    # ---- event scheduling
+
+    def at(self, delay: float, fn, *args):
+        self.seq += 1
+        self.events.append((self.clock.us + int(delay * 1000), self.seq, fn, args))
+        self.events.sort(key=lambda e: (e[0], e[1]))
+
+    def reply(self, data, delay: float = 0, baudrate: int = None):
+        # queue data on the TX line of the module
+        baudrate = baudrate or self.baudrate
+        if (isinstance(data, str)):
+            data = data.encode()
+        if (self.dropReplies):
+            self.dropReplies -= 1
+            return
+        start = max(self.clock.us + int(delay * 1000), self.stallUntil, self.rxFree)
+        self.rxFree = start + self.byteTime(len(data), baudrate)
+        self.at((self.rxFree - self.clock.us) / 1000, self._deliver, bytes(data), baudrate)
+
+    def _deliver(self, data: bytes, baudrate: int):
+        self.rxbuf.extend(self.line(data, baudrate))
+
+    def line(self, data: bytes, baudrate: int) -> bytes:
+        # data sent at baudrate as the other side of the UART receives it. With
+        # different rates on the two sides nothing useful arrives, the bytes are
+        # dropped. Above maxBaud single bits flip with lineErrorRate per byte.
+        if (self.hostBaud != baudrate):
+            return b""
+        if (self.maxBaud is None or baudrate <= self.maxBaud):
+            return data
+        data = bytearray(data)
+        for i in range(len(data)):
+            if (self.lineRandom.random() < self.lineErrorRate):
+                data[i] ^= 1 << self.lineRandom.randrange(8)
+        return bytes(data)
+
+    def byteTime(self, n: int, baudrate: int = None) -> int:
+        # 10 bits per byte on the UART, in us
+        return n * 10_000_000 // (baudrate or self.baudrate)
+
+    def pump(self):
+        while (self.events and self.events[0][0] <= self.clock.us):
+            self.eventTime, _, fn, args = self.events.pop(0)
+            fn(*args)
+        self.eventTime = None
+
+    def nextEvent(self) -> int:
+        return self.events[0][0] if self.events else None
+
+    def wait(self, ms: float) -> bool:
+        # wait up to ms for RX data, returns True if some data is available
+        limit = self.clock.us + int(ms * 1000)
+        self.pump()
+        while (not self.rxbuf):
+            t = self.nextEvent()
+            if (t is None or t > limit):
+                self.clock.advanceTo(limit)
+                self.pump()
+                return bool(self.rxbuf)
+            self.clock.advanceTo(t)
+            self.pump()
+        return True
+
+    # ---- UART interface
+
+    def init(self, baudrate: int = None, timeout: int = None, timeout_char: int = None, **kw):
+        if (baudrate):
+            self.hostBaud = baudrate
+        if (timeout is not None):
+            self.timeout = timeout
+        if (timeout_char is not None):
+            self.timeout_char = timeout_char
+
+    def any(self) -> int:
+        self.clock.advance(0.01)
+        self.pump()
+        return len(self.rxbuf)
+
+    def read(self, n: int = None):
+        if (not self.wait(self.timeout)):
+            return None
+        if (n is None):
+            # everything which arrives without a timeout_char gap
+            while (self.nextEvent() is not None
+                   and self.nextEvent() <= self.clock.us + self.timeout_char * 1000):
+                self.clock.advanceTo(self.nextEvent())
+                self.pump()
+            n = len(self.rxbuf)
+        while (len(self.rxbuf) < n):
+            t = self.nextEvent()
+            if (t is None or t > self.clock.us + self.timeout_char * 1000):
+                self.clock.advance(self.timeout_char)
+                break
+            self.clock.advanceTo(t)
+            self.pump()
+        b = bytes(self.rxbuf[:n])
+        del self.rxbuf[:n]
+        self.rxBytes += len(b)
+        return b
+
+    def readinto(self, buf, nbytes: int = None):
+        n = len(buf) if nbytes is None else nbytes
+        b = self.read(n)
+        if (b is None):
+            return None
+        buf[:len(b)] = b
+        return len(b)
+
+    def write(self, data) -> int:
+        if (isinstance(data, str)):
+            data = data.encode()
+        data = bytes(data)
+        n = len(data)
+        self.writes += 1
+        self.txBytes += n
+        self.clock.advance(self.byteTime(n, self.hostBaud) / 1000)
+        self.pump()
+        data = self.line(data, self.baudrate)
+        if (self.hangUntil is not None):
+            if (self.hangUntil == -1 or self.clock.us < self.hangUntil):
+                self.inbuf.extend(data)
+                if (self.hangUntil == -1 and b'AT+RST\r\n' in self.inbuf):
+                    self.hangUntil = None
+                    self.inbuf = bytearray()
+                    self.reset()
+                del self.inbuf[:-16]
+                return n
+            self.inbuf = bytearray()
+            self.hangUntil = None
+        self.inbuf.extend(data)
+        if (self.sleepMode == SLEEP_LIGHT and self.clock.us >= self.onUntil[0]):
+            if (not self.wakePending):  # the CPU sleeps until the next beacon
+                self.wakePending = True
+                self.at((self.nextWake(self.clock.us) - self.clock.us) / 1000, self._wakeUp)
+            return n
+        self.process()
+        return n
+
+    # ---- AT command processing
+
+    def process(self):
+        if (self.sleepMode == SLEEP_LIGHT):
+            self.keepAwake(self.sleepIdle, False)
+        while (self.inbuf):
+            if (self.sendLink is not None):
+                if (len(self.inbuf) < self.sendLen):
+                    return
+                data = bytes(self.inbuf[:self.sendLen])
+                del self.inbuf[:self.sendLen]
+                self.sent(self.sendLink, data)
+                self.sendLink = None
+                continue
+            if (self.inbuf[0:1] == b'?'):
+                # the driver's probe for a not responding firmware
+                del self.inbuf[:1]
+                self.reply("busy p...\r\n" if self.isBusy() else "\r\nERROR\r\n", self.cmdTime)
+                continue
+            eol = self.inbuf.find(b'\r\n')
+            if (eol < 0):
+                return
+            line = bytes(self.inbuf[:eol]).decode()
+            del self.inbuf[:eol + 2]
+            if (self.echo):
+                self.reply(line + "\r\n")
+            if (line and self.isBusy()):
+                self.commands.append(line)
+                self.reply("busy p...\r\n", self.cmdTime)
+            elif (line):
+                self.command(line)
+
+    def isBusy(self) -> bool:
+        return self.clock.us < self.busyUntil
+
+    def command(self, line: str):
+        self.commands.append(line)
+        if (line == "AT"):
+            return self.ok()
+        if (not line.startswith("AT")):
+            return self.error()
+        body = line[2:]
+        if (body.startswith("E")):
+            self.echo = body == "E1"
+            return self.ok()
+        if (not body.startswith("+")):
+            return self.error()
+        body = body[1:]
+        for op in ("=", "?"):
+            i = body.find(op)
+            if (i > 0):
+                name, args = body[:i], body[i + 1:]
+                break
+        else:
+            name, op, args = body, "", ""
+        handler = None if name in self.unsupported else getattr(self, "at_" + name, None)
+        if (self.firmware == "AT2" and name.endswith(("_CUR", "_DEF")) and not name.startswith("UART")):
+            handler = None
+        if (handler is None):
+            return self.error()
+        if (op == "=" and args == "?"):
+            return self.ok()  # test command, only says the command exists
+        if (self.firmware == "AT2" and op == "=" and self.sysStore and name in STORED_SETTINGS):
+            self.flashWrites += 1
+        handler(op, args)
+
+    def ok(self, delay: float = None, pre: str = ""):
+        self.reply(pre + "\r\nOK\r\n", self.cmdTime if delay is None else delay)
+
+    def error(self, pre: str = ""):
+        self.reply(pre + "\r\nERROR\r\n", self.cmdTime)
+
+    def reset(self):
+        baudrate = self.baudrate
+        self.powerOn()
+        self.reply("\r\nOK\r\n", self.cmdTime, baudrate)  # still at the rate before the restart
+        self.reply(" ets Jan  8 2013,rst cause:2, boot mode:(3,6)\r\n\r\n", 100)
+        self.reply("\r\nready\r\n", 300)
+
+    @staticmethod
+    def args(args: str) -> list:
+        # split AT command arguments, honoring quoting and \ escapes
+        ret = []
+        cur = ""
+        quoted = False
+        i = 0
+        while (i < len(args)):
+            c = args[i]
+            if (c == "\\" and i + 1 < len(args)):
+                cur += args[i + 1]
+                i += 2
+                continue
+            if (c == '"'):
+                quoted = not quoted
+            elif (c == "," and not quoted):
+                ret.append(cur)
+                cur = ""
+            else:
+                cur += c
+            i += 1
+        ret.append(cur)
+        return ret
+
+    def at_RST(self, op, args):
+        self.reset()
+
+    def at_GMR(self, op, args):
+        if (self.firmware == "ESP_ATMod"):
+            return self.ok(pre="AT version:1.7.0.0 (partial)\r\n"
+                               "SDK version:2.2.2-dev(38a443e)\r\n"
+                               "Arduino core version:2.7.4\r\n"
+                               "Version ESP_ATMod:0.6.0\r\n")
+        if (self.firmware == "AT2"):
+            return self.ok(pre="AT version:2.2.0.0(s-b097cdf - ESP8266 - Jun 17 2021 12:57:45)\r\n"
+                               "SDK version:v3.4-22-g967752e2\r\n"
+                               "compile time(6800286):Aug  4 2021 17:20:05\r\n"
+                               "Bin version:2.2.0(WROOM-02)\r\n")
+        self.ok(pre="AT version:1.7.4.0(May 11 2020 19:13:04)\r\n"
+                    "SDK version:3.0.4(9532ceb)\r\n"
+                    "compile time:May 27 2020 10:12:22\r\n"
+                    "Bin version(Wroom 02):1.7.4\r\n")
+
+    def at_UART_CUR(self, op, args):
+        a = self.args(args)
+        self.ok()  # still at the old rate
+        self.baudrate = int(a[0])
+
+    def at_SYSSTORE(self, op, args):
+        if (op == "?"):
+            return self.ok(pre=f'+SYSSTORE:{int(self.sysStore)}')
+        if (args not in ("0", "1")):
+            return self.error()
+        self.sysStore = args == "1"
+        self.ok()
+
+    def at_SLEEP(self, op, args):
+        if (op == "?"):
+            return self.ok(pre=f'+SLEEP:{self.sleepMode}')
+        mode = int(args)
+        if (mode not in (SLEEP_NONE, SLEEP_LIGHT, SLEEP_MODEM)):
+            return self.error()
+        self.sleepMode = mode
+        self.ok()
+
+    def at_CIPMUX(self, op, args):
+        self.ok()
+
+    def at_CIPRECVMODE(self, op, args):
+        self.ok()
+
+    def at_CWMODE(self, op, args):
+        if (op == "?"):
+            return self.ok(pre=f'+CWMODE:{self.mode}')
+        self.mode = int(args)
+        if (not self.mode & 2):
+            self.stations = {}
+        self.ok()
+
+    at_CWMODE_CUR = at_CWMODE
+    at_CWMODE_DEF = at_CWMODE
+
+    def at_CWSAP(self, op, args):
+        if (not self.mode & 2):
+            return self.error()
+        if (op == "?"):
+            ssid, pwd, channel, ecn, maxConn = self.softap
+            return self.ok(pre=f'+CWSAP_CUR:"{ssid}","{pwd}",{channel},{ecn},{maxConn},0')
+        a = self.args(args)
+        self.softap = (a[0], a[1], int(a[2]), int(a[3]), int(a[4]) if len(a) > 4 else 4)
+        self.stations = {}
+        self.ok(self.cmdTime + 100)
+
+    at_CWSAP_CUR = at_CWSAP
+    at_CWSAP_DEF = at_CWSAP
+
+    def at_CWLIF(self, op, args):
+        lines = [f'{ip},{mac}' for mac, ip in self.stations.items() if ip]
+        self.ok(pre="\r\n".join(lines))
+
+    def stationJoin(self, mac: str, ip: str, dhcpTime: float = 50):
+        # a station connects to the soft AP and gets an IP address
+        self.stations[mac] = None
+        self.reply(f'+STA_CONNECTED:"{mac}"\r\n')
+        self.at(dhcpTime, self._stationIp, mac, ip)
+
+    def _stationIp(self, mac: str, ip: str):
+        if (mac in self.stations):
+            self.stations[mac] = ip
+            self.reply(f'+DIST_STA_IP:"{mac}","{ip}"\r\n')
+
+    def stationLeave(self, mac: str):
+        if (self.stations.pop(mac, 0) != 0):
+            self.reply(f'+STA_DISCONNECTED:"{mac}"\r\n')
+
+    def at_CWAUTOCONN(self, op, args):
+        self.ok()
+
+    def at_CWDHCP(self, op, args):
+        a = self.args(args)
+        if (a[0] in ("1", "2")):  # station or both
+            self.dhcp = a[1] == "1"
+            if (self.dhcp):
+                self.ip = self.dhcpIp
+        self.ok()
+
+    at_CWDHCP_CUR = at_CWDHCP
+    at_CWDHCP_DEF = at_CWDHCP
+
+    def at_CIPDNS(self, op, args):
+        if (op == "?"):
+            if (self.firmware == "AT2"):
+                servers = "".join(f',"{d}"' for d in self.dns)
+                return self.ok(pre=f'+CIPDNS:{int(self.dns != self.dhcpDns)}{servers}')
+            return self.ok(pre="".join(f'+CIPDNS_CUR:{d}\r\n' for d in self.dns)[:-2])
+        a = self.args(args)
+        self.dns = tuple(a[1:]) if a[0] == "1" and len(a) > 1 else self.dhcpDns
+        self.ok()
+
+    at_CIPDNS_CUR = at_CIPDNS
+    at_CIPDNS_DEF = at_CIPDNS
+
+    def at_CWJAP(self, op, args):
+        if (op == "?"):
+            if (self.ap is None):
+                return self.ok(pre="No AP")
+            ssid = self.ap
+            _, bssid, channel, rssi = self.aps[ssid]
+            return self.ok(pre=f'+CWJAP:"{ssid}","{bssid}",{channel},{rssi}')
+        a = self.args(args)
+        ssid = a[0]
+        pwd = a[1] if len(a) > 1 else ""
+        if (ssid not in self.aps or self.aps[ssid][0] != pwd):
+            self.ap = None
+            return self.reply("+CWJAP:1\r\n\r\nFAIL\r\n", self.joinTime)
+        self.ap = ssid
+        if (self.firmware == "AT2" and len(a) > 5 and a[5]):
+            self.listenInterval = int(a[5])
+        self.reply("WIFI CONNECTED\r\n", self.joinTime)
+        self.reply("WIFI GOT IP\r\n\r\nOK\r\n", self.joinTime + (self.dhcpTime if self.dhcp else 0))
+
+    at_CWJAP_CUR = at_CWJAP
+    at_CWJAP_DEF = at_CWJAP
+
+    def at_CWQAP(self, op, args):
+        wasConnected = self.ap is not None
+        self.ap = None
+        self.ok(pre="WIFI DISCONNECT" if wasConnected else "")
+
+    def at_CIPSTA(self, op, args):
+        if (op == "="):
+            a = self.args(args)
+            self.ip = (a[0], a[1] if len(a) > 1 else self.dhcpIp[1], a[2] if len(a) > 2 else self.dhcpIp[2])
+            self.dhcp = False
+            return self.ok()
+        ip, gw, mask = self.ip if self.ap or not self.dhcp else ("0.0.0.0",) * 3
+        self.ok(pre=f'+CIPSTA:ip:"{ip}"\r\n+CIPSTA:gateway:"{gw}"\r\n+CIPSTA:netmask:"{mask}"')
+
+    at_CIPSTA_CUR = at_CIPSTA
+    at_CIPSTA_DEF = at_CIPSTA
+
+    def at_CIPSTATUS(self, op, args):
+        if (self.ap is None):
+            status = 5
+        elif (any(self.links)):
+            status = 3
+        else:
+            status = 2
+        lines = [f'STATUS:{status}']
+        for link in self.links:
+            if (link and link.open):
+                lines.append(f'+CIPSTATUS:{link.linkId},"{link.type}","{link.ip}",'
+                             f'{link.port},{link.localPort},0')
+        self.ok(pre="\r\n".join(lines))
+
+    def at_CIPSTART(self, op, args):
+        self.keepAwake(self.radioTail)
+        a = self.args(args)
+        linkId = int(a[0])
+        type, host, port = a[1], a[2], int(a[3])
+        if (self.links[linkId]):
+            return self.error("ALREADY CONNECTED\r\n")
+        if (self.ap is None or port not in self.servers):
+            return self.error(f'{linkId},CONNECT FAIL\r\n' if self.ap else "")
+        delay = self.rtt
+        if (type == "SSL"):
+            if (self.firmware == "ESP_ATMod"):
+                self.sni[linkId] = host  # BearSSL sends the host name
+            ok, delay = self.handshake(linkId, port)
+            if (not ok):
+                return self.reply(f'{linkId},CONNECT FAIL\r\n\r\nERROR\r\n', delay)
+        link = Link(self, linkId, type, host, port, self.servers[port]())
+        self.links[linkId] = link
+        self.reply(f'{linkId},CONNECT\r\n\r\nOK\r\n', delay)
+        self.at(delay, link.server.connected, link)
+
+    def handshake(self, linkId: int, port: int):
+        # Returns (success, handshake time in ms). The certificate
+        # chain goes in records of the TLS buffer size; a chain bigger than the
+        # buffer can't be verified and every buffer takes heap while the link is open.
+        sni, self.sni[linkId] = self.sni[linkId], None
+        chain = self.certChains.get(port, 3000)
+        used = sum(self.sslSize for link in self.links if link and link.type == "SSL")
+        records = -(-chain // self.sslSize)
+        if (used + self.sslSize > self.sslHeap):
+            return (False, self.cmdTime)  # no memory for the buffer
+        if (port in self.sniRequired and not sni):
+            return (False, self.rtt * 2)  # alert after the ClientHello
+        if (chain > self.sslSize or self.random.random() < self.sslFailRate):
+            return (False, self.rtt * 2 + self.sslTime // 2)
+        return (True, self.rtt * 2 + self.sslTime + 150 * records)
+
+    def at_CIPSSLSIZE(self, op, args):
+        n = int(args)
+        if (n < 512 or n > 16384 or any(link and link.type == "SSL" for link in self.links)):
+            return self.error()
+        self.sslSize = n
+        self.ok()
+
+    def at_CIPSSLCSNI(self, op, args):
+        a = self.args(args)
+        self.sni[int(a[0])] = a[1]
+        self.ok()
+
+    def at_CIPCLOSEMODE(self, op, args):
+        a = self.args(args)
+        self.closeMode[int(a[0])] = int(a[1])
+        self.ok()
+
+    def at_CIPCLOSE(self, op, args):
+        linkId = int(args)
+        link = self.links[linkId]
+        if (not link):
+            return self.error("UNLINK")
+        link.open = False
+        self.links[linkId] = None
+        self.ok(self.cmdTime if self.closeMode[linkId] else self.rtt, f'{linkId},CLOSED\r\n')
+
+    def at_CIPSEND(self, op, args):
+        a = self.args(args)
+        linkId, n = int(a[0]), int(a[1])
+        link = self.links[linkId]
+        if (not link or not link.open):
+            return self.error("link is not valid")
+        if (n > self.maxSend):
+            return self.error()
+        self.sendLink = linkId
+        self.sendLen = n
+        self.reply("\r\nOK\r\n> ", self.cmdTime)
+
+    def sent(self, linkId: int, data: bytes):
+        link = self.links[linkId]
+        self.keepAwake(self.radioTail)  # the radio wakes up to transmit
+        self.reply(f'\r\nRecv {len(data)} bytes\r\n', self.cmdTime)
+        self.reply("\r\nSEND OK\r\n", self.rtt)
+        self.at(self.rtt / 2, link.server.received, link, data)
+        if (self.busyRate and self.random.random() < self.busyRate):
+            # still busy with the TCP stack when SEND OK is already out
+            self.at(self.rtt, self.busy, self.busyTime)
+
+    def at_CIPRECVLEN(self, op, args):
+        lens = []
+        for link in self.links:
+            lens.append(str(len(link.rx)) if link else "0")
+        self.ok(pre="+CIPRECVLEN:" + ",".join(lens))
+
+    def at_CIPRECVDATA(self, op, args):
+        a = self.args(args)
+        linkId, n = int(a[0]), int(a[1])
+        link = self.links[linkId]
+        if (not link or not link.rx):
+            return self.error()
+        data = bytes(link.rx[:n])
+        del link.rx[:n]
+        if (not link.open and not link.rx):
+            self.links[linkId] = None
+        if (self.firmware == "AT2"):
+            head = b'+CIPRECVDATA:' + str(len(data)).encode() + b','
+        else:
+            head = b'+CIPRECVDATA,' + str(len(data)).encode() + b':'
+        self.reply(head + data + b'\r\nOK\r\n', self.cmdTime)
+
+###################################
+
+_active = None
+
+def install(emu: EspEmulator = None) -> EspEmulator:
+    # register the MicroPython stand-ins, returns the active emulator
+    # (or the replay.ReplayUART, which plays the emulator's part)
+    global _active
+
+    _active = emu or EspEmulator()
+    clock = _active.clock
+
+    machine = types.ModuleType("machine")
+
+    def UART(id, baudrate=115200, **kw):
+        _active.init(baudrate, **kw)
+        return _active
+    machine.UART = UART
+
+    micropython = types.ModuleType("micropython")
+    micropython.const = lambda x: x
+    micropython.native = lambda f: f
+
+    utime = types.ModuleType("utime")
+    utime.ticks_ms = lambda: clock.ms()
+    utime.ticks_us = lambda: clock.us
+    utime.ticks_add = lambda t, d: t + d
+    utime.ticks_diff = lambda a, b: a - b
+    utime.sleep = lambda s: clock.advance(s * 1000)
+    utime.sleep_ms = lambda ms: clock.advance(ms)
+    utime.sleep_us = lambda us: clock.advance(us / 1000)
+
+    for m in (machine, micropython, utime):
+        sys.modules[m.__name__] = m
+    return _active
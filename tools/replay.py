@@ -0,0 +1,224 @@
+# replay.py
+#
+# Replay of UART traces recorded with EspAtDrv.record() (CPython)
+#
+# ReplayUART feeds the firmware's side of a trace back to the unmodified
+# driver. Install it like the emulator, espemu.install(ReplayUART(trace)),
+# then run the same application calls as in the recording.
+#
+# The driver's writes are not interpreted. Every received record is released
+# only after the driver wrote as many command bytes and '?' probes as it had
+# written before that record in the recording, so a response never arrives
+# before its command. With timing=True the record then follows after the
+# delay it had in the recording, with timing=False it is available at once.
+# Time is the virtual clock of espemu, a replay doesn't sleep.
+#
+# Writes which differ from the recorded ones are counted in mismatches, the
+# first at byte divergence of the recorded TX stream.
+#
+# Usage: python3 tools/replay.py trace ...
+# prints the records of the traces
+#
+# Version:
+#  0.1.0: initial version
+
+import os
+import sys
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib")))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import espemu
+
+TRACE_HEADER = b"EATR1\n"  # as in lib/EspAtTrace.py, which needs the stand-ins to import
+REC_TX = 0x54
+REC_RX = 0x52
+REC_PROBE = 0x50
+
+###################################
+
+def parse(trace: bytes) -> list:
+    # records of a trace as (kind, ms since the start, data)
+    if (not trace.startswith(TRACE_HEADER)):
+        raise ValueError("not an EspAtTrace recording")
+    records = []
+    pos = len(TRACE_HEADER)
+    t = 0
+
+    def varint():
+        nonlocal pos
+        i = 0
+        shift = 0
+        while True:
+            b = trace[pos]
+            pos += 1
+            i |= (b & 0x7F) << shift
+            shift += 7
+            if (not b & 0x80):
+                return i
+
+    while (pos < len(trace)):
+        kind = trace[pos]
+        pos += 1
+        if (kind not in (REC_TX, REC_RX, REC_PROBE)):
+            raise ValueError(f'unknown record {kind:#x} at {pos - 1}')
+        t += varint()
+        data = b""
+        if (kind != REC_PROBE):
+            n = varint()
+            data = bytes(trace[pos:pos + n])
+            pos += n
+        records.append((kind, t, data))
+    return records
+
+def load(path: str) -> list:
+    with open(path, "rb") as f:
+        return parse(f.read())
+
+class RxRecord:
+    def __init__(self, data: bytes, txBytes: int, probes: int, delay: int):
+        self.data = data
+        self.txBytes = txBytes  # command bytes written before it in the recording
+        self.probes = probes    # '?' probes written before it
+        self.delay = delay      # ms after the write which released it
+        self.gateTime = None    # us when the replayed driver reached the gate
+
+class ReplayUART:
+    def __init__(self, records: list, timing: bool = True):
+        if (isinstance(records, (bytes, bytearray))):
+            records = parse(records)
+        self.clock = espemu.Clock()
+        self.timing = timing
+        self.timeout = 1000
+        self.timeout_char = 100
+
+        self.rx = []
+        self.txExpected = bytearray()
+        probes = 0
+        writeTime = 0
+        for kind, t, data in records:
+            if (kind == REC_RX):
+                self.rx.append(RxRecord(data, len(self.txExpected), probes, t - writeTime))
+            else:
+                writeTime = t
+                if (kind == REC_PROBE):
+                    probes += 1
+                else:
+                    self.txExpected.extend(data)
+        self.next = 0          # index of the next record to release
+        self.gated = 0         # index of the first record not reached by the writes
+        self.rxbuf = bytearray()
+
+        # statistics
+        self.writes = 0
+        self.txBytes = 0
+        self.probes = 0
+        self.rxBytes = 0
+        self.mismatches = 0
+        self.divergence = None
+
+        self.gate()  # the records before the first write
+
+    def done(self) -> bool:
+        # all recorded data was received by the driver
+        return self.next == len(self.rx) and not self.rxbuf
+
+    def releaseTime(self, rec: RxRecord) -> int:
+        return rec.gateTime + (rec.delay * 1000 if self.timing else 0)
+
+    def pump(self):
+        while (self.next < self.gated and self.releaseTime(self.rx[self.next]) <= self.clock.us):
+            self.rxbuf.extend(self.rx[self.next].data)
+            self.next += 1
+
+    def nextEvent(self) -> int:
+        if (self.next < self.gated):
+            return max(self.releaseTime(self.rx[self.next]), self.clock.us)
+        return None
+
+    def wait(self, ms: float) -> bool:
+        limit = self.clock.us + int(ms * 1000)
+        self.pump()
+        while (not self.rxbuf):
+            t = self.nextEvent()
+            if (t is None or t > limit):
+                self.clock.advanceTo(limit)
+                self.pump()
+                return bool(self.rxbuf)
+            self.clock.advanceTo(t)
+            self.pump()
+        return True
+
+    # ---- UART interface
+
+    def init(self, baudrate: int = None, timeout: int = None, timeout_char: int = None, **kw):
+        if (timeout is not None):
+            self.timeout = timeout
+        if (timeout_char is not None):
+            self.timeout_char = timeout_char
+
+    def any(self) -> int:
+        self.clock.advance(0.01)
+        self.pump()
+        return len(self.rxbuf)
+
+    def read(self, n: int = None):
+        if (not self.wait(self.timeout)):
+            return None
+        if (n is None):
+            n = len(self.rxbuf)
+        while (len(self.rxbuf) < n):
+            t = self.nextEvent()
+            if (t is None or t > self.clock.us + self.timeout_char * 1000):
+                self.clock.advance(self.timeout_char)
+                break
+            self.clock.advanceTo(t)
+            self.pump()
+        b = bytes(self.rxbuf[:n])
+        del self.rxbuf[:n]
+        self.rxBytes += len(b)
+        return b
+
+    def readinto(self, buf, nbytes: int = None):
+        n = len(buf) if nbytes is None else nbytes
+        b = self.read(n)
+        if (b is None):
+            return None
+        buf[:len(b)] = b
+        return len(b)
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.writes += 1
+        if (data == b"?"):
+            self.probes += 1
+        else:
+            expected = self.txExpected[self.txBytes:self.txBytes + len(data)]
+            if (data != expected):
+                self.mismatches += 1
+                if (self.divergence is None):
+                    self.divergence = self.txBytes
+            self.txBytes += len(data)
+        self.gate()
+        self.pump()
+        return len(data)
+
+    def gate(self):
+        # opens the records the driver's writes reached
+        while (self.gated < len(self.rx)):
+            rec = self.rx[self.gated]
+            if (rec.txBytes > self.txBytes or rec.probes > self.probes):
+                break
+            rec.gateTime = self.clock.us
+            self.gated += 1
+
+###################################
+
+def dump(records: list):
+    names = {REC_TX: "TX", REC_RX: "RX", REC_PROBE: "??"}
+    for kind, t, data in records:
+        print(f'{t:>8} {names[kind]} {data!r}' if data else f'{t:>8} {names[kind]}')
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        dump(load(path))
@@ -0,0 +1,48 @@
+# startup.py
+#
+# Startup cost of the library on the Pico (MicroPython)
+#
+# Usage: mpremote cp lib/*.py : + mpremote run tools/startup.py
+# For the .mpy build compile the library first and copy the .mpy files
+# instead (remove the .py files from the board, .py is found before .mpy):
+#   for f in lib/*.py; do mpy-cross -march=armv6m $f; done
+#
+# Reports the time and heap of `import WiFi` (the core: WiFi, EspAtDrv and
+# EspAtParse), of the submodules loaded on first use and of the buffer pool,
+# loaded with EspAtPool and allocated when the first client connects.
+#
+# Version:
+#  0.1.0: initial version
+#  0.2.0: EspAtPool, EspAtTrace and EspAtTune, the heap of the buffer pool
+#  0.2.1: EspAtPower
+#  0.2.2: EspAtPool is no longer core
+
+import gc
+import sys
+import time
+
+def measure(name: str):
+    gc.collect()
+    free = gc.mem_free()
+    t = time.ticks_us()
+    mod = __import__(name)
+    t = time.ticks_diff(time.ticks_us(), t)
+    gc.collect()
+    used = free - gc.mem_free()
+    print(f'{name:12} {mod.__file__:20} {t / 1000:8.1f} ms {used:7} B')
+
+gc.collect()
+print(f'free heap {gc.mem_free()} B')
+for name in ("EspAtParse", "EspAtDrv", "WiFi", "EspAtPool",
+             "EspAtQuery", "EspAtSsl", "EspAtAp", "EspAtTrace", "EspAtTune", "EspAtPower"):
+    measure(name)
+
+import EspAtDrv
+gc.collect()
+free = gc.mem_free()
+EspAtDrv.bufferPool().attach(0)  # as the first client's connect
+gc.collect()
+print(f'{"buffer pool":12} {"first attach()":20} {"":8}    {free - gc.mem_free():7} B')
+EspAtDrv.pool.detach(0)
+gc.collect()
+print(f'free heap {gc.mem_free()} B, modules: {" ".join(sorted(sys.modules))}')